@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark :func:`vermouth.graph_utils.maximum_common_subgraph` on residues
+with missing atoms.
+
+For every amino acid of the universal force field, 1 to 5 heavy atoms are
+removed at random from the residue, and the maximum common subgraph between
+the reference graph and the incomplete residue is computed, the way
+:func:`vermouth.processors.repair_graph.make_reference` does when the residue
+is not a subgraph of its reference.
+"""
+
+import argparse
+import random
+import time
+
+import vermouth.forcefield
+from vermouth.graph_utils import (add_element_attr, maximum_common_subgraph,
+                                  categorical_maximum_common_subgraph)
+
+AMINO_ACIDS = ('ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS',
+               'ILE', 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP',
+               'TYR', 'VAL')
+
+
+def incomplete_residue(reference, n_missing, rng, hydrogens=False):
+    """
+    Copy a reference graph without some of its heavy atoms.
+
+    Unless `hydrogens` is set, the hydrogens are removed as well, as they are
+    usually missing from crystal structures.
+    """
+    residue = reference.copy()
+    heavy = [node for node in residue if residue.nodes[node]['element'] != 'H']
+    to_remove = rng.sample(heavy, min(n_missing, len(heavy) - 1))
+    if not hydrogens:
+        to_remove += [node for node in residue if residue.nodes[node]['element'] == 'H']
+    residue.remove_nodes_from(to_remove)
+    return residue
+
+
+def time_function(function, reference, residue, repeats):
+    """
+    Best time over `repeats` runs, and the number of matches.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        matches = function(reference, residue, ['element'])
+        best = min(best, time.perf_counter() - start)
+    return best, len(matches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--hydrogens', action='store_true',
+                        help='Keep the hydrogens in the incomplete residues.')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also time categorical_maximum_common_subgraph.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    force_field = vermouth.forcefield.FORCE_FIELDS['universal']
+    functions = [('mcs', maximum_common_subgraph)]
+    if args.compare:
+        functions.append(('categorical', categorical_maximum_common_subgraph))
+
+    print('{:<5} {:>7}'.format('resn', 'missing')
+          + ''.join(' {:>12} {:>8}'.format(name + ' (s)', 'matches')
+                    for name, _ in functions))
+    totals = [0.0] * len(functions)
+    for resname in AMINO_ACIDS:
+        reference = force_field.reference_graphs[resname]
+        add_element_attr(reference)
+        for n_missing in range(1, 6):
+            residue = incomplete_residue(reference, n_missing, rng, args.hydrogens)
+            line = '{:<5} {:>7}'.format(resname, n_missing)
+            for idx, (_, function) in enumerate(functions):
+                duration, n_matches = time_function(function, reference,
+                                                    residue, args.repeats)
+                totals[idx] += duration
+                line += ' {:>12.5f} {:>8}'.format(duration, n_matches)
+            print(line)
+    print('Total: ' + ', '.join('{} {:.3f} s'.format(name, total)
+                                for (name, _), total in zip(functions, totals)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark the parsers of the force field files.
+
+Every file is parsed in a fresh force field, with
+:func:`vermouth.ffinput.read_ff` for the .ff files, or with
+:func:`vermouth.gmx.rtp.read_rtp` for the RTP files. By default, the files of
+the force fields distributed with vermouth are used. The files are read in
+memory beforehand, so only the parsing, and the completion of the blocks for
+RTP files, are timed.
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from vermouth import DATA_PATH
+from vermouth.ffinput import read_ff
+from vermouth.forcefield import ForceField
+from vermouth.gmx.rtp import read_rtp
+
+PARSERS = {
+    'ff': read_ff,
+    'rtp': read_rtp,
+}
+
+
+def read_files(paths):
+    """
+    Read the content of the files.
+    """
+    contents = []
+    for path in paths:
+        with open(path) as infile:
+            contents.append((path, infile.readlines()))
+    return contents
+
+
+def time_file(parse, lines, repeats):
+    """
+    Best time over `repeats` parsings of a file.
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        force_field = ForceField(name='benchmark')
+        start = time.perf_counter()
+        parse(lines, force_field)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('format', choices=sorted(PARSERS),
+                        help='Format of the files to parse.')
+    parser.add_argument('paths', nargs='*',
+                        help='Files to read. Defaults to the bundled ones.')
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    paths = args.paths
+    if not paths:
+        pattern = os.path.join(DATA_PATH, 'force_fields', '*', '*.' + args.format)
+        paths = sorted(glob.glob(pattern))
+    contents = read_files(paths)
+    parse = PARSERS[args.format]
+    print('{:<50} {:>7} {:>10} {:>12}'.format('file', 'lines', 'time (s)', 'lines/s'))
+    total_time = 0
+    total_lines = 0
+    for path, lines in contents:
+        duration = time_file(parse, lines, args.repeats)
+        total_time += duration
+        total_lines += len(lines)
+        name = os.path.relpath(path, DATA_PATH)
+        print('{:<50} {:>7} {:>10.4f} {:>12.0f}'
+              .format(name, len(lines), duration, len(lines) / duration))
+    print('{:<50} {:>7} {:>10.4f} {:>12.0f}'
+          .format('Total', total_lines, total_time, total_lines / total_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Benchmark :meth:`vermouth.molecule.Molecule.subgraph` on every residue.
+
+A linear molecule is built with bonds, angles, and dihedrals along the chain,
+then the subgraph of each residue is extracted in turn, as processors do
+when they record where each bead or atom comes from.
+"""
+
+import argparse
+import time
+
+from vermouth.molecule import Interaction, Molecule
+
+
+def build_chain(n_residues, residue_size):
+    """
+    Build a linear molecule with bonds, angles, and dihedrals.
+    """
+    molecule = Molecule()
+    n_atoms = n_residues * residue_size
+    for idx in range(n_atoms):
+        molecule.add_node(idx, resid=idx // residue_size + 1, resname='RES',
+                          atomname='A{}'.format(idx % residue_size), chain='A')
+    for name, n_involved in (('bonds', 2), ('angles', 3), ('dihedrals', 4)):
+        for start in range(n_atoms - n_involved + 1):
+            atoms = tuple(range(start, start + n_involved))
+            if n_involved == 2:
+                molecule.add_edge(*atoms)
+            molecule.interactions[name].append(
+                Interaction(atoms=atoms, parameters=[], meta={})
+            )
+    return molecule
+
+
+def time_subgraphs(molecule, repeats):
+    """
+    Best time over `repeats` extractions of all the residue subgraphs.
+    """
+    residues = list(molecule.iter_residues())
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for residue in residues:
+            molecule.subgraph(residue)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--residue-size', type=int, default=10)
+    parser.add_argument('--residues', type=int, nargs='+',
+                        default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    print('{:>10} {:>12} {:>10} {:>14}'
+          .format('residues', 'interactions', 'time (s)', 'residues/s'))
+    for n_residues in args.residues:
+        molecule = build_chain(n_residues, args.residue_size)
+        n_interactions = sum(map(len, molecule.interactions.values()))
+        duration = time_subgraphs(molecule, args.repeats)
+        print('{:>10} {:>12} {:>10.4f} {:>14.0f}'
+              .format(n_residues, n_interactions, duration, n_residues / duration))
+
+
+if __name__ == '__main__':
+    main()
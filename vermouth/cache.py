@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Persistent cache for objects parsed from data files.
+
+Parsing the force fields and the mappings takes a significant part of the run
+time of short conversions. Parsed objects are pickled in a cache directory
+together with a fingerprint of the files they were read from, and of the
+source code of vermouth. A cached object is only used if none of these files
+changed since it was stored.
+
+The cache directory is given by the ``VERMOUTH_CACHE_DIR`` environment
+variable, and defaults to ``vermouth`` in the user cache directory. Setting
+``VERMOUTH_CACHE_DIR`` to an empty string disables the cache. Cached files are
+unpickled, so the cache directory must only be writable by trusted users.
+
+Objects stored with :func:`store_cached` only depend on their key and on the
+source code of vermouth; they expire after :data:`STORED_MAX_AGE` seconds.
+The first time an entry is stored in a process, the entries of the cache
+directory that are expired or whose files changed are removed, so that the
+cache does not grow with every new version of the files.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+from .log_helpers import StyleAdapter, get_logger
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+# Changing this number invalidates every existing cache entry.
+CACHE_FORMAT = 3
+
+# How long, in seconds, an object stored with `store_cached` stays valid.
+STORED_MAX_AGE = 30 * 24 * 60 * 60
+
+PACKAGE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# The cache directories already pruned by this process.
+_PRUNED_DIRECTORIES = set()
+
+
+def cache_directory():
+    """
+    Get the directory where the cache is stored.
+
+    Returns
+    -------
+    str or None
+        The path to the cache directory, or ``None`` if caching is disabled.
+    """
+    directory = os.environ.get('VERMOUTH_CACHE_DIR')
+    if directory is None:
+        base = os.environ.get('XDG_CACHE_HOME')
+        if not base:
+            base = os.path.join(os.path.expanduser('~'), '.cache')
+        directory = os.path.join(base, 'vermouth')
+    return directory or None
+
+
+@functools.lru_cache(maxsize=None)
+def _code_files():
+    """
+    List the python files of vermouth, except for the tests.
+
+    The package is only walked once per process.
+
+    Returns
+    -------
+    tuple[str]
+    """
+    paths = []
+    for root, directories, files in os.walk(PACKAGE_PATH):
+        directories[:] = [
+            directory for directory in directories
+            if directory not in ('tests', '__pycache__', 'data')
+        ]
+        paths.extend(os.path.join(root, name)
+                     for name in files if name.endswith('.py'))
+    return tuple(paths)
+
+
+def _digest(path):
+    with open(path, 'rb') as infile:
+        return hashlib.sha1(infile.read()).hexdigest()
+
+
+def _fingerprint(path):
+    """
+    Describe the content of a file as a (mtime, size, sha1) tuple.
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, _digest(path))
+
+
+def _is_unchanged(path, fingerprint):
+    """
+    Test if a file still matches its fingerprint.
+
+    The content of the file is only hashed if its modification time changed,
+    so that touching a file does not invalidate the cache.
+    """
+    mtime, size, digest = fingerprint
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if stat.st_size != size:
+        return False
+    return stat.st_mtime_ns == mtime or _digest(path) == digest
+
+
+def _cache_path(directory, key):
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(directory, name + '.pickle')
+
+
+def _is_current(header):
+    """
+    Test if a cache entry did not expire, and if none of the files it depends
+    on changed.
+    """
+    stored = header.get('stored')
+    if stored is not None and time.time() - stored > STORED_MAX_AGE:
+        return False
+    return all(_is_unchanged(file_path, fingerprint)
+               for file_path, fingerprint in header['files'].items())
+
+
+def _read_header(infile):
+    """
+    Read the header of a cache entry from an open cache file.
+
+    A cache file holds two pickles: the header describing the entry, and the
+    cached value. The header can be read without unpickling the value.
+
+    Returns
+    -------
+    dict or None
+        The header, or `None` if it is not in the current format.
+    """
+    header = pickle.load(infile)
+    if not isinstance(header, dict) or header.get('format') != CACHE_FORMAT:
+        return None
+    return header
+
+
+def _read_entry(path, key, files):
+    """
+    Read a cache entry, and return its value if it is still valid.
+
+    Returns
+    -------
+    tuple[bool, object]
+        Whether the entry is valid, and the cached value.
+    """
+    try:
+        with open(path, 'rb') as infile:
+            header = _read_header(infile)
+            if (header is None
+                    or header.get('key') != key
+                    or set(header.get('files', ())) != set(files)
+                    or not _is_current(header)):
+                return False, None
+            value = pickle.load(infile)
+    except FileNotFoundError:
+        return False, None
+    # A cache file can be corrupted in many ways, and unpickling it can raise
+    # about anything. An invalid cache entry is just a cache miss.
+    except Exception as error:  # pylint: disable=broad-except
+        LOGGER.debug('Could not read the cache file "{}": {}', path, error,
+                     type='cache')
+        return False, None
+    return True, value
+
+
+def _prune(directory, keep):
+    """
+    Remove the cache entries that can no longer be valid.
+
+    An entry is stale if it is not in the current format, if it expired, or if
+    any of the files it depends on, including the source code of vermouth,
+    changed. Every entry of the directory is read, so a directory is only
+    pruned once per process.
+
+    Parameters
+    ----------
+    directory: str
+        The cache directory.
+    keep: str
+        The path of an entry to leave alone, typically the one just stored.
+    """
+    if directory in _PRUNED_DIRECTORIES:
+        return
+    _PRUNED_DIRECTORIES.add(directory)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        if not name.endswith('.pickle') or path == keep:
+            continue
+        try:
+            with open(path, 'rb') as infile:
+                header = _read_header(infile)
+        except FileNotFoundError:
+            continue
+        except Exception:  # pylint: disable=broad-except
+            header = None
+        if header is not None and _is_current(header):
+            continue
+        LOGGER.debug('Removing the stale cache file "{}"', path, type='cache')
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _write_entry(path, header, value):
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # Write in a temporary file first so that concurrent runs never read
+        # an incomplete cache file.
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as outfile:
+            pickle.dump(header, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(outfile.name, path)
+    except (OSError, pickle.PicklingError, AttributeError, TypeError) as error:
+        LOGGER.debug('Could not write the cache file "{}": {}', path, error,
+                     type='cache')
+        try:
+            os.remove(outfile.name)
+        except (NameError, OSError):
+            pass
+        return
+    _prune(directory, path)
+
+
+def read_cached(key, directory=None):
+    """
+    Get an object stored with :func:`store_cached`.
+
+    Parameters
+    ----------
+    key: str
+        Identifies the object in the cache.
+    directory: str or None
+        The cache directory. If ``None``, the directory is given by
+        :func:`cache_directory`.
+
+    Returns
+    -------
+    tuple[bool, object]
+        Whether the object was found in the cache, and the object itself.
+    """
+    if directory is None:
+        directory = cache_directory()
+    if directory is None:
+        return False, None
+    return _read_entry(_cache_path(directory, key), key, _code_files())
+
+
+def store_cached(key, value, directory=None):
+    """
+    Store an object in the cache.
+
+    Unlike with :func:`load_cached`, the object does not depend on any data
+    file, it is only identified by its key. The key must therefore describe
+    everything the object depends on, besides the source code of vermouth.
+    The object expires after :data:`STORED_MAX_AGE` seconds.
+
+    Parameters
+    ----------
+    key: str
+        Identifies the object in the cache.
+    value: object
+        The object to store. It must be picklable.
+    directory: str or None
+        The cache directory. If ``None``, the directory is given by
+        :func:`cache_directory`.
+    """
+    if directory is None:
+        directory = cache_directory()
+    if directory is None:
+        return
+    try:
+        fingerprints = {path: _fingerprint(path) for path in _code_files()}
+    except OSError:
+        return
+    header = {
+        'format': CACHE_FORMAT,
+        'key': key,
+        'files': fingerprints,
+        'stored': time.time(),
+    }
+    _write_entry(_cache_path(directory, key), header, value)
+
+
+def load_cached(key, paths, loader, directory=None):
+    """
+    Get an object parsed from files, from the cache if possible.
+
+    The cached object is used if it was stored under the same key, from the
+    same files, and neither these files nor the source code of vermouth
+    changed since. Otherwise, the object is produced by `loader`, and stored
+    in the cache.
+
+    Parameters
+    ----------
+    key: str
+        Identifies the object in the cache. Typically, what kind of object is
+        cached and the absolute path of the directory it is read from.
+    paths: collections.abc.Iterable[str]
+        The files `loader` reads.
+    loader: collections.abc.Callable
+        Called without argument to produce the object when it is not cached.
+    directory: str or None
+        The cache directory. If ``None``, the directory is given by
+        :func:`cache_directory`.
+
+    Returns
+    -------
+    object
+        The object produced by `loader`, or an identical copy. Every call
+        returns a new copy that can be modified freely.
+    """
+    if directory is None:
+        directory = cache_directory()
+    if directory is None:
+        return loader()
+    files = [os.path.abspath(path) for path in paths] + list(_code_files())
+    cache_path = _cache_path(directory, key)
+    valid, value = _read_entry(cache_path, key, files)
+    if valid:
+        return value
+
+    try:
+        # The fingerprints are taken before the files are read, so a file
+        # modified while being read invalidates the entry.
+        fingerprints = {path: _fingerprint(path) for path in files}
+    except OSError:
+        return loader()
+    value = loader()
+    header = {
+        'format': CACHE_FORMAT,
+        'key': key,
+        'files': fingerprints,
+    }
+    _write_entry(cache_path, header, value)
+    return value
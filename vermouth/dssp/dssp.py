@@ -17,16 +17,28 @@ Assign protein secondary structures using DSSP.
 """
 
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
+import shutil
 import subprocess
+import threading
 import logging
 
 from ..pdb import pdb
 from ..system import System
 from ..processors.processor import Processor
 from ..selectors import is_protein, selector_has_position, filter_minimal, select_all
+from ..log_helpers import StyleAdapter, get_logger
+from .. import cache as disk_cache
 from .. import utils
 
+LOGGER = StyleAdapter(get_logger(__name__))
+
+# DSSP assigns the secondary structure from the hydrogen bonds between these
+# atoms only.
+BACKBONE_ATOMS = frozenset(('N', 'CA', 'C', 'O'))
+
 
 class DSSPError(Exception):
     """
@@ -141,7 +153,129 @@ def read_dssp2(lines):
     return secstructs
 
 
-def run_dssp(system, executable='dssp', savefile=None):
+def dssp_cache_key(system, executable='dssp'):
+    """
+    Describe the input of a DSSP run for :class:`DSSPCache`.
+
+    The key covers the DSSP executable, the sequence of residues, and the
+    names and the coordinates of their backbone atoms, as they would be
+    written in the PDB file passed to DSSP. The other atoms do not change the
+    secondary structure assigned by DSSP, and are ignored.
+
+    Parameters
+    ----------
+    system: System
+    executable: str
+        Where to find the DSSP executable.
+
+    Returns
+    -------
+    str
+    """
+    hasher = hashlib.sha1()
+    path = shutil.which(executable) or executable
+    try:
+        stat = os.stat(path)
+    except OSError:
+        hasher.update(path.encode('utf8'))
+    else:
+        hasher.update('{} {} {}'.format(
+            os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+        ).encode('utf8'))
+
+    def residue_key(node):
+        return (str(node.get('chain')), node.get('resid'),
+                str(node.get('insertioncode')), str(node.get('resname')))
+
+    for molecule in system.molecules:
+        hasher.update(b'\nmolecule')
+        nodes = sorted(molecule.nodes.values(),
+                       key=lambda node: residue_key(node) + (node['atomname'],))
+        previous = None
+        for node in nodes:
+            residue = residue_key(node)
+            if residue != previous:
+                hasher.update('\n{} {} {} {}'.format(*residue).encode('utf8'))
+                previous = residue
+            if node['atomname'] in BACKBONE_ATOMS:
+                hasher.update(' {} {:.3f} {:.3f} {:.3f}'.format(
+                    node['atomname'], *(node['position'] * 10)
+                ).encode('utf8'))
+    return hasher.hexdigest()
+
+
+class DSSPCache:
+    """
+    Stores the outputs of DSSP so that it does not run twice on the same input.
+
+    The outputs are kept in memory and, if a directory is given, on disk so
+    they can be used in later runs. The outputs are identified by
+    :func:`dssp_cache_key`. Because only the backbone is part of that key,
+    the solvent accessibility in a saved DSSP output may come from an earlier
+    run on a structure with different side chains.
+
+    The cache can be shared between threads.
+
+    Parameters
+    ----------
+    directory: str or None
+        Where to store the DSSP outputs on disk. If ``None``, they are only
+        kept in memory. See :mod:`vermouth.cache`.
+
+    Attributes
+    ----------
+    hits: int
+        How many times an output was found in the cache.
+    misses: int
+        How many times an output was not found in the cache.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._outputs = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get the DSSP output for a key, or ``None`` if it is not known.
+        """
+        with self._lock:
+            output = self._outputs.get(key)
+        if output is None and self.directory is not None:
+            found, output = disk_cache.read_cached('dssp:' + key, self.directory)
+            if found:
+                with self._lock:
+                    self._outputs[key] = output
+        with self._lock:
+            if output is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return output
+
+    def store(self, key, output):
+        """
+        Store the DSSP output for a key.
+        """
+        with self._lock:
+            self._outputs[key] = output
+        if self.directory is not None:
+            disk_cache.store_cached('dssp:' + key, output, self.directory)
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of the lookups that found an output, or ``None`` if
+        there was no lookup.
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return self.hits / lookups
+
+
+def run_dssp(system, executable='dssp', savefile=None, cache=None):
     """
     Run DSSP on a system and return the assigned secondary structures.
 
@@ -161,6 +295,9 @@ def run_dssp(system, executable='dssp', savefile=None):
     If "savefile" is set to a path, then the output of DSSP is written in
     that file.
 
+    If a cache is given, DSSP does not run if its output for the same
+    backbone is already in the cache.
+
     Parameters
     ----------
     system: System
@@ -168,6 +305,8 @@ def run_dssp(system, executable='dssp', savefile=None):
         Where to find the DSSP executable.
     savefile: None or str or pathlib.Path
         If set to a path, the output of DSSP is written in that file.
+    cache: DSSPCache or None
+        Where to look for, and store, the output of DSSP.
 
     Returns
     list of str
@@ -187,6 +326,21 @@ def run_dssp(system, executable='dssp', savefile=None):
     read_dssp2
         Parse a DSSP output.
     """
+    out = None
+    if cache is not None:
+        key = dssp_cache_key(system, executable)
+        out = cache.get(key)
+    if out is None:
+        out = _execute_dssp(system, executable)
+        if cache is not None:
+            cache.store(key, out)
+    if savefile is not None:
+        with open(str(savefile), 'w') as outfile:
+            outfile.write(out)
+    return read_dssp2(out.split('\n'))
+
+
+def _execute_dssp(system, executable):
     process = subprocess.Popen(
         [executable, "-i", "/dev/stdin"],
         stderr=subprocess.PIPE,
@@ -196,14 +350,10 @@ def run_dssp(system, executable='dssp', savefile=None):
     out, err = process.communicate(
         pdb.write_pdb_string(system, conect=False).encode('utf8')
     )
-    out = out.decode('utf8')
     status = process.wait()
     if status:
         raise DSSPError(err.decode('utf8'))
-    if savefile is not None:
-        with open(str(savefile), 'w') as outfile:
-            outfile.write(out)
-    return read_dssp2(out.split('\n'))
+    return out.decode('utf8')
 
 
 def _savefile_path(molecule, savedir=None):
@@ -218,7 +368,34 @@ def _savefile_path(molecule, savedir=None):
     return savefile
 
 
-def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruct'):
+def _dssp_input(molecule):
+    """
+    Build the system to pass to DSSP for a molecule.
+
+    Returns
+    -------
+    System or None
+        A system with the atoms of the molecule that have a position, or
+        ``None`` if DSSP should not run on the molecule.
+    """
+    if not is_protein(molecule):
+        return None
+
+    clean_pos = molecule.subgraph(
+        filter_minimal(molecule, selector=selector_has_position)
+    )
+
+    # We ignore empty molecule, there is no point at running DSSP on them.
+    if not clean_pos:
+        return None
+
+    system = System()
+    system.add_molecule(clean_pos)
+    return system
+
+
+def annotate_dssp(molecule, executable='dssp', savedir=None,
+                  attribute='secstruct', cache=None):
     """
     Adds the DSSP assignation to the atoms of a molecule.
 
@@ -251,29 +428,91 @@ def annotate_dssp(molecule, executable='dssp', savedir=None, attribute='secstruc
         atom attribute.
     attribute: str
         The name of the atom attribute in which to store the annotation.
+    cache: DSSPCache or None
+        Where to look for, and store, the output of DSSP.
 
     See Also
     --------
-    run_dssp, read_dssp2
+    run_dssp, read_dssp2, annotate_dssp_concurrently
     """
-    if not is_protein(molecule):
+    system = _dssp_input(molecule)
+    if system is None:
         return
 
-    clean_pos = molecule.subgraph(
-        filter_minimal(molecule, selector=selector_has_position)
-    )
+    savefile = _savefile_path(molecule, savedir)
+    secstructs = run_dssp(system, executable, savefile, cache)
 
-    # We ignore empty molecule, there is no point at running DSSP on them.
-    if not clean_pos:
-        return
+    annotate_residues_from_sequence(molecule, attribute, secstructs)
 
-    savefile = _savefile_path(molecule, savedir)
 
-    system = System()
-    system.add_molecule(clean_pos)
-    secstructs = run_dssp(system, executable, savefile)
+def annotate_dssp_concurrently(molecules, executable='dssp', savedir=None,
+                               attribute='secstruct', processes=1,
+                               cache=None):
+    """
+    Adds the DSSP assignation to the atoms of several molecules.
 
-    annotate_residues_from_sequence(molecule, attribute, secstructs)
+    This is equivalent to calling :func:`annotate_dssp` on each molecule, but
+    up to `processes` DSSP processes run at the same time. The molecules are
+    annotated only once all the DSSP processes completed successfully.
+
+    .. warning::
+
+        The molecules are annotated **in-place**.
+
+    Parameters
+    ----------
+    molecules: collections.abc.Iterable[Molecule]
+        The molecules to annotate. See :func:`annotate_dssp`.
+    executable: str
+        The path or name in the research PATH of the DSSP executable.
+    savedir: None or str
+        If set to a path, the DSSP outputs will be written in this
+        **directory**. The option is only available if chains are defined with
+        the 'chain' atom attribute.
+    attribute: str
+        The name of the atom attribute in which to store the annotation.
+    processes: int or None
+        The maximum number of DSSP processes running at the same time. By
+        default, DSSP runs on one molecule at a time. `None` uses as many
+        processes as there are CPUs.
+    cache: DSSPCache or None
+        Where to look for, and store, the outputs of DSSP.
+
+    Raises
+    ------
+    DSSPError
+        DSSP failed to run on one of the molecules. If it failed for several
+        molecules, the error is the one for the first of them.
+    IOError
+        The output of DSSP could not be parsed.
+
+    See Also
+    --------
+    annotate_dssp, run_dssp
+    """
+    jobs = []
+    for molecule in molecules:
+        system = _dssp_input(molecule)
+        if system is not None:
+            jobs.append((molecule, system, _savefile_path(molecule, savedir)))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1 or len(jobs) < 2:
+        results = [run_dssp(system, executable, savefile, cache)
+                   for _, system, savefile in jobs]
+    else:
+        # DSSP runs in external processes, the threads only wait for them,
+        # so they do not compete for the GIL.
+        with ThreadPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(run_dssp, system, executable, savefile, cache)
+                for _, system, savefile in jobs
+            ]
+            results = [future.result() for future in futures]
+
+    for (molecule, _, _), secstructs in zip(jobs, results):
+        annotate_residues_from_sequence(molecule, attribute, secstructs)
 
 
 def convert_dssp_to_martini(sequence):
@@ -432,17 +671,62 @@ def convert_dssp_annotation_to_martini(
 
 
 class AnnotateDSSP(Processor):
+    """
+    Annotate the protein molecules with the secondary structure from DSSP.
+
+    When run on a system, DSSP runs concurrently on the molecules, with up to
+    `processes` DSSP processes at the same time.
+
+    Parameters
+    ----------
+    executable: str
+        The path or name in the research PATH of the DSSP executable.
+    savedir: None or str
+        If set to a path, the DSSP outputs will be written in this
+        **directory**.
+    processes: int or None
+        The maximum number of DSSP processes running at the same time. By
+        default, DSSP runs on one molecule at a time. `None` uses as many
+        processes as there are CPUs.
+    cache: DSSPCache or None
+        Where to look for, and store, the outputs of DSSP. DSSP does not run
+        on molecules with a backbone found in the cache. The hit rate of the
+        cache is logged after each system.
+
+    See Also
+    --------
+    annotate_dssp, annotate_dssp_concurrently
+    """
     name = 'AnnotateDSSP'
 
-    def __init__(self, executable='dssp', savedir=None):
+    def __init__(self, executable='dssp', savedir=None, processes=1,
+                 cache=None):
         super().__init__()
         self.executable = executable
         self.savedir = savedir
+        self.processes = processes
+        self.cache = cache
 
     def run_molecule(self, molecule):
-        annotate_dssp(molecule, self.executable, self.savedir)
+        annotate_dssp(molecule, self.executable, self.savedir, cache=self.cache)
         return molecule
 
+    def run_system(self, system):
+        if self.cache is not None:
+            hits = self.cache.hits
+            misses = self.cache.misses
+        annotate_dssp_concurrently(
+            system.molecules, self.executable, self.savedir,
+            processes=self.processes, cache=self.cache,
+        )
+        if self.cache is not None:
+            hits = self.cache.hits - hits
+            lookups = hits + self.cache.misses - misses
+            if lookups:
+                LOGGER.info('DSSP outputs found in the cache for {} out of {} '
+                            'molecules ({:.0%}).', hits, lookups, hits / lookups,
+                            type='cache')
+
 
 class AnnotateMartiniSecondaryStructures(Processor):
     name = 'AnnotateMartiniSecondaryStructures'
@@ -0,0 +1,479 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Assign protein secondary structures without calling an external program.
+
+This is a reimplementation of the algorithm of DSSP version 2 [Kabsch1983]_,
+that produces the same one-letter codes as :func:`vermouth.dssp.dssp.read_dssp2`.
+The hydrogen bond energies, the turns, the helices and the bends are computed
+with numpy over the backbone of the whole molecule; the candidate hydrogen
+bonds are found with a KD-tree.
+
+.. [Kabsch1983] W. Kabsch and C. Sander, Dictionary of protein secondary
+   structure: pattern recognition of hydrogen-bonded and geometrical
+   features. Biopolymers 22 (1983) 2577-2637.
+"""
+
+import numpy as np
+
+from .. import KDTree
+from ..processors.processor import Processor
+from ..selectors import is_protein
+from .dssp import annotate_residues_from_sequence
+
+BACKBONE_ATOMS = ('N', 'CA', 'C', 'O')
+
+# All the distances are in Ångström, as in DSSP.
+# Electrostatic coupling of the hydrogen bond energy, in kcal/mol.
+COUPLING = 0.42 * 0.20 * 332
+MIN_HBOND_ENERGY = -9.9
+MAX_HBOND_ENERGY = -0.5
+MIN_DISTANCE = 0.5
+MAX_CA_DISTANCE = 9.0
+MAX_PEPTIDE_BOND_LENGTH = 2.5
+MIN_BEND_ANGLE = 70
+
+PARALLEL = 'parallel'
+ANTIPARALLEL = 'antiparallel'
+
+
+class _Backbone:
+    """
+    The backbone of a molecule, as needed to assign secondary structures.
+
+    Attributes
+    ----------
+    positions: dict[str, numpy.ndarray]
+        The position of each backbone atom, including the amide hydrogen, for
+        every residue. Positions are in Ångström, and are `nan` for missing
+        atoms.
+    valid: numpy.ndarray[bool]
+        Which residues have a complete backbone.
+    proline: numpy.ndarray[bool]
+        Which residues are prolines, and cannot donate a hydrogen bond.
+    breaks: numpy.ndarray[int]
+        The number of chain breaks before each residue.
+    """
+    def __init__(self, molecule):
+        residues = list(molecule.iter_residues())
+        nres = len(residues)
+        self.positions = {
+            name: np.full((nres, 3), np.nan) for name in BACKBONE_ATOMS
+        }
+        self.proline = np.zeros(nres, dtype=bool)
+        chains = []
+        for idx, residue in enumerate(residues):
+            first_node = molecule.nodes[residue[0]]
+            self.proline[idx] = first_node.get('resname') == 'PRO'
+            chains.append(first_node.get('chain'))
+            for key in residue:
+                node = molecule.nodes[key]
+                name = node.get('atomname')
+                if name in self.positions and node.get('position') is not None:
+                    self.positions[name][idx] = node['position'] * 10
+        self.valid = np.all([
+            np.all(np.isfinite(positions), axis=1)
+            for positions in self.positions.values()
+        ], axis=0)
+
+        peptide_length = np.linalg.norm(
+            self.positions['N'][1:] - self.positions['C'][:-1], axis=1
+        )
+        same_chain = np.array([
+            first == second for first, second in zip(chains[:-1], chains[1:])
+        ], dtype=bool)
+        with np.errstate(invalid='ignore'):
+            linked = (same_chain & self.valid[:-1] & self.valid[1:]
+                      & (peptide_length <= MAX_PEPTIDE_BOND_LENGTH))
+        self.breaks = np.concatenate(([0], np.cumsum(~linked)))
+
+        # The amide hydrogen is placed 1 Å from the nitrogen, in the
+        # direction opposite to the carbonyl of the previous residue.
+        hydrogens = self.positions['N'].copy()
+        carbonyl = self.positions['C'][:-1] - self.positions['O'][:-1]
+        with np.errstate(invalid='ignore'):
+            carbonyl /= np.linalg.norm(carbonyl, axis=1)[:, np.newaxis]
+        has_previous = same_chain & self.valid[:-1]
+        hydrogens[1:][has_previous] += carbonyl[has_previous]
+        self.positions['H'] = hydrogens
+
+    def __len__(self):
+        return len(self.valid)
+
+    def no_break(self, start, stop):
+        """
+        Test if there is no chain break between two residues, included.
+        """
+        return self.breaks[start] == self.breaks[stop]
+
+
+def _hbond_energies(backbone, donors, acceptors):
+    """
+    Compute the DSSP hydrogen bond energy, in kcal/mol, between NH groups and
+    CO groups.
+    """
+    positions = backbone.positions
+
+    def distance(atom_donor, atom_acceptor):
+        return np.linalg.norm(
+            positions[atom_donor][donors] - positions[atom_acceptor][acceptors],
+            axis=1
+        )
+
+    dist_ho = distance('H', 'O')
+    dist_hc = distance('H', 'C')
+    dist_nc = distance('N', 'C')
+    dist_no = distance('N', 'O')
+    with np.errstate(divide='ignore'):
+        energies = COUPLING * (1 / dist_no + 1 / dist_hc - 1 / dist_ho - 1 / dist_nc)
+    too_close = np.min([dist_ho, dist_hc, dist_nc, dist_no], axis=0) < MIN_DISTANCE
+    energies[too_close] = MIN_HBOND_ENERGY
+    energies = np.round(energies, 3)
+    return np.maximum(energies, MIN_HBOND_ENERGY)
+
+
+def _find_hbonds(backbone):
+    """
+    Find the hydrogen bonds as defined by DSSP.
+
+    Only the two most favourable hydrogen bonds of each NH group are kept.
+
+    Returns
+    -------
+    numpy.ndarray[int]
+        The hydrogen bonds encoded as ``donor * len(backbone) + acceptor``,
+        sorted.
+    """
+    nres = len(backbone)
+    indices = np.flatnonzero(backbone.valid)
+    if len(indices) < 2:
+        return np.zeros(0, dtype=int)
+    tree = KDTree(backbone.positions['CA'][indices])
+    pairs = np.array(sorted(tree.query_pairs(MAX_CA_DISTANCE)), dtype=int)
+    if not len(pairs):
+        return np.zeros(0, dtype=int)
+    pairs = indices[pairs]
+    donors = np.concatenate((pairs[:, 0], pairs[:, 1]))
+    acceptors = np.concatenate((pairs[:, 1], pairs[:, 0]))
+    keep = (~backbone.proline[donors]) & (donors != acceptors + 1)
+    donors = donors[keep]
+    acceptors = acceptors[keep]
+
+    energies = _hbond_energies(backbone, donors, acceptors)
+    order = np.lexsort((acceptors, energies, donors))
+    donors = donors[order]
+    acceptors = acceptors[order]
+    energies = energies[order]
+    group_start = np.searchsorted(donors, donors, side='left')
+    rank = np.arange(len(donors)) - group_start
+    bonded = (rank < 2) & (energies < MAX_HBOND_ENERGY)
+    return np.sort(donors[bonded] * nres + acceptors[bonded])
+
+
+def _has_bond(hbonds, nres, donors, acceptors):
+    """
+    Test if each NH group of `donors` is bonded to the CO group of the
+    corresponding `acceptors`.
+    """
+    donors = np.asarray(donors)
+    acceptors = np.asarray(acceptors)
+    inside = (donors >= 0) & (donors < nres) & (acceptors >= 0) & (acceptors < nres)
+    return inside & np.isin(donors * nres + acceptors, hbonds)
+
+
+def _find_turns(backbone, hbonds):
+    """
+    Find the n-turns, for n in 3, 4, and 5.
+
+    Returns
+    -------
+    dict[int, numpy.ndarray[bool]]
+        For each n, whether an n-turn starts at each residue.
+    """
+    nres = len(backbone)
+    starts = np.arange(nres)
+    turns = {}
+    for stride in (3, 4, 5):
+        turn = np.zeros(nres, dtype=bool)
+        if nres > stride:
+            start = starts[:-stride]
+            turn[:-stride] = (
+                backbone.no_break(start, start + stride)
+                & _has_bond(hbonds, nres, start + stride, start)
+            )
+        turns[stride] = turn
+    return turns
+
+
+def _find_bridges(backbone, hbonds):
+    """
+    Find the β-bridges.
+
+    Returns
+    -------
+    list[tuple[int, int, str]]
+        The bridges as pairs of residue indices, sorted, with the type of
+        bridge.
+    """
+    nres = len(backbone)
+    if not len(hbonds):
+        return []
+    donors, acceptors = np.divmod(hbonds, nres)
+    # Every bridge involves at least one hydrogen bond; each hydrogen bond
+    # can only be part of the bridges between these pairs of residues.
+    first = np.concatenate((donors - 1, acceptors, donors - 1, acceptors))
+    second = np.concatenate((acceptors, donors - 1, acceptors + 1, donors))
+    first, second = np.minimum(first, second), np.maximum(first, second)
+    keep = (first >= 1) & (second - first >= 3) & (second + 1 < nres)
+    candidates = np.unique(np.stack((first[keep], second[keep]), axis=1), axis=0)
+    if not len(candidates):
+        return []
+    res_i = candidates[:, 0]
+    res_j = candidates[:, 1]
+
+    def bond(donor, acceptor):
+        return _has_bond(hbonds, nres, donor, acceptor)
+
+    linked = backbone.no_break(res_i - 1, res_i + 1) & backbone.no_break(res_j - 1, res_j + 1)
+    parallel = linked & (
+        (bond(res_i + 1, res_j) & bond(res_j, res_i - 1))
+        | (bond(res_j + 1, res_i) & bond(res_i, res_j - 1))
+    )
+    antiparallel = linked & ~parallel & (
+        (bond(res_i + 1, res_j - 1) & bond(res_j + 1, res_i - 1))
+        | (bond(res_j, res_i) & bond(res_i, res_j))
+    )
+    bridges = []
+    for i, j, is_parallel, is_antiparallel in zip(res_i, res_j, parallel, antiparallel):
+        if is_parallel:
+            bridges.append((int(i), int(j), PARALLEL))
+        elif is_antiparallel:
+            bridges.append((int(i), int(j), ANTIPARALLEL))
+    return bridges
+
+
+def _build_ladders(backbone, bridges):
+    """
+    Group consecutive bridges in ladders, and join the ladders separated by a
+    β-bulge.
+
+    Returns
+    -------
+    list[tuple[str, list[int], list[int]]]
+        The type of each ladder, and the residues of its two strands.
+    """
+    ladders = []
+    for i, j, kind in bridges:
+        for ladder_kind, strand_i, strand_j in ladders:
+            if ladder_kind != kind or i != strand_i[-1] + 1:
+                continue
+            if kind == PARALLEL and strand_j[-1] + 1 == j:
+                strand_i.append(i)
+                strand_j.append(j)
+                break
+            if kind == ANTIPARALLEL and strand_j[0] - 1 == j:
+                strand_i.append(i)
+                strand_j.insert(0, j)
+                break
+        else:  # no break
+            ladders.append((kind, [i], [j]))
+    ladders.sort(key=lambda ladder: ladder[1][0])
+
+    # DSSP compares these residue indices as unsigned integers; a negative
+    # difference is never small.
+    def is_within(difference, limit):
+        return 0 <= difference < limit
+
+    idx = 0
+    while idx < len(ladders):
+        kind, strand_i, strand_j = ladders[idx]
+        jdx = idx + 1
+        while jdx < len(ladders):
+            other_kind, other_i, other_j = ladders[jdx]
+            ibi, iei, jbi, jei = strand_i[0], strand_i[-1], strand_j[0], strand_j[-1]
+            ibj, iej, jbj, jej = other_i[0], other_i[-1], other_j[0], other_j[-1]
+            if (other_kind != kind
+                    or not backbone.no_break(min(ibi, ibj), max(iei, iej))
+                    or not backbone.no_break(min(jbi, jbj), max(jei, jej))
+                    or not is_within(ibj - iei, 6)
+                    or (iei >= ibj and ibi <= iej)):
+                jdx += 1
+                continue
+            if kind == PARALLEL:
+                bulge = ((is_within(jbj - jei, 6) and is_within(ibj - iei, 3))
+                         or is_within(jbj - jei, 3))
+            else:
+                bulge = ((is_within(jbi - jej, 6) and is_within(ibj - iei, 3))
+                         or is_within(jbi - jej, 3))
+            if bulge:
+                strand_i.extend(other_i)
+                if kind == PARALLEL:
+                    strand_j.extend(other_j)
+                else:
+                    strand_j[:0] = other_j
+                del ladders[jdx]
+            else:
+                jdx += 1
+        idx += 1
+    return ladders
+
+
+def _find_bends(backbone):
+    """
+    Find the residues where the backbone bends by more than 70°.
+    """
+    nres = len(backbone)
+    bends = np.zeros(nres, dtype=bool)
+    if nres < 5:
+        return bends
+    calpha = backbone.positions['CA']
+    center = np.arange(2, nres - 2)
+    before = calpha[center] - calpha[center - 2]
+    after = calpha[center + 2] - calpha[center]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = (
+            np.sum(before * after, axis=1)
+            / (np.linalg.norm(before, axis=1) * np.linalg.norm(after, axis=1))
+        )
+        angle = np.degrees(np.arccos(np.clip(cosine, -1, 1)))
+        bends[center] = (
+            backbone.no_break(center - 2, center + 2)
+            & (angle > MIN_BEND_ANGLE)
+        )
+    return bends
+
+
+def _mark_helices(secstructs, turns, stride, code, allowed):
+    """
+    Assign a helix where two consecutive n-turns start, if the residues
+    only have one of the `allowed` assignments.
+    """
+    nres = len(secstructs)
+    if nres <= stride + 1:
+        return
+    starts = np.arange(1, nres - stride)
+    helix_starts = starts[turns[stride][starts] & turns[stride][starts - 1]]
+    if not len(helix_starts):
+        return
+    residues = helix_starts[:, np.newaxis] + np.arange(stride)
+    free = np.all(np.isin(secstructs[residues], allowed), axis=1)
+    secstructs[residues[free].ravel()] = code
+
+
+def assign_secondary_structure(molecule):
+    """
+    Assign the secondary structure of a protein the way DSSP would.
+
+    The secondary structure codes are the ones produced by
+    :func:`vermouth.dssp.dssp.read_dssp2`: "H" for α-helices, "B" for
+    isolated β-bridges, "E" for β-strands, "G" for 3-10 helices, "I" for
+    π-helices, "T" for turns, "S" for bends, and "C" for the rest. Residues
+    without an N, a CA, a C, and an O atom with known positions are assigned
+    "C", and break the chain.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+        The protein. Only the atom names, the positions, the residue names,
+        and the chains are used. Residues are taken in the order of
+        :meth:`vermouth.molecule.Molecule.iter_residues`.
+
+    Returns
+    -------
+    list[str]
+        One secondary structure code per residue.
+    """
+    backbone = _Backbone(molecule)
+    nres = len(backbone)
+    hbonds = _find_hbonds(backbone)
+    turns = _find_turns(backbone, hbonds)
+
+    secstructs = np.full(nres, 'C')
+    for _, strand_i, strand_j in _build_ladders(backbone, _find_bridges(backbone, hbonds)):
+        code = 'E' if len(strand_i) > 1 else 'B'
+        for strand in (strand_i, strand_j):
+            residues = np.arange(min(strand), max(strand) + 1)
+            residues = residues[secstructs[residues] != 'E']
+            secstructs[residues] = code
+
+    _mark_helices(secstructs, turns, 4, 'H', allowed=list('CHBEGITS'))
+    _mark_helices(secstructs, turns, 3, 'G', allowed=['C', 'G'])
+    _mark_helices(secstructs, turns, 5, 'I', allowed=['C', 'I'])
+
+    in_turn = np.zeros(nres, dtype=bool)
+    for stride, turn in turns.items():
+        for shift in range(1, stride):
+            in_turn[shift:] |= turn[:nres - shift]
+    loops = np.zeros(nres, dtype=bool)
+    loops[1:-1] = secstructs[1:-1] == 'C'
+    secstructs[loops & in_turn] = 'T'
+    secstructs[loops & ~in_turn & _find_bends(backbone)] = 'S'
+    return secstructs.tolist()
+
+
+def annotate_secondary_structure(molecule, attribute='secstruct'):
+    """
+    Adds the secondary structure assignation to the atoms of a molecule.
+
+    This is the built-in equivalent of :func:`vermouth.dssp.dssp.annotate_dssp`.
+    Non-protein molecules, and molecules without atoms with positions, are
+    left unmodified.
+
+    .. warning::
+
+        The molecule is annotated **in-place**.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+        The molecule to annotate.
+    attribute: str
+        The name of the atom attribute in which to store the annotation.
+
+    See Also
+    --------
+    assign_secondary_structure
+    """
+    if not is_protein(molecule):
+        return
+    if not any(node.get('position') is not None for node in molecule.nodes.values()):
+        return
+    secstructs = assign_secondary_structure(molecule)
+    annotate_residues_from_sequence(molecule, attribute, secstructs)
+
+
+class AnnotateSecondaryStructure(Processor):
+    """
+    Annotate the protein molecules with their secondary structure, without
+    running DSSP.
+
+    Parameters
+    ----------
+    attribute: str
+        The name of the atom attribute in which to store the annotation.
+
+    See Also
+    --------
+    annotate_secondary_structure, vermouth.dssp.dssp.AnnotateDSSP
+    """
+    name = 'AnnotateSecondaryStructure'
+
+    def __init__(self, attribute='secstruct'):
+        super().__init__()
+        self.attribute = attribute
+
+    def run_molecule(self, molecule):
+        annotate_secondary_structure(molecule, self.attribute)
+        return molecule
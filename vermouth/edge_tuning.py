@@ -18,7 +18,6 @@
 Set of tools to add and remove edges.
 """
 
-import functools
 import numpy as np
 import networkx as nx
 
@@ -27,6 +26,10 @@ from . import selectors
 from . import geometry
 from .utils import distance
 
+# Marks the attributes that are not defined in a node. It must differ from
+# ``None`` as some link predicates make the distinction.
+_MISSING = object()
+
 
 def _edge_is_between_selections(edge, selection_a, selection_b):
     """
@@ -224,9 +227,9 @@ def add_inter_molecule_edges(molecules, edges):
         for key in base_molecule:
             correspondance[(base_index, key)] = (new_index, key)
 
-        for other_index in component[1:]:
-            other_molecule = molecules[other_index]
-            mol_correspondance = base_molecule.merge_molecule(other_molecule)
+        other_molecules = [molecules[other_index] for other_index in component[1:]]
+        mol_correspondances = base_molecule.merge_molecules(other_molecules)
+        for other_index, mol_correspondance in zip(component[1:], mol_correspondances):
             for before, after in mol_correspondance.items():
                 correspondance[(other_index, before)] = (new_index, after)
 
@@ -257,8 +260,10 @@ def pairs_under_threshold(molecules, threshold,
     that are closer than the given threshold. The molecules are given as a list
     of molecules, the selection is a list of nodes each of them a tuple
     ``(index of the molecule in the list, key of the node in the molecule)``.
-    The result of the function is a generator of node pairs followed by the
-    distance between the nodes, each node formated as in the selection.
+    The result of the function is a tuple of three arrays: the indices of the
+    first ends of the pairs in 'selection_a', the indices of the second ends
+    of the pairs in 'selection_b', and the distances between the nodes. Pairs
+    are ordered by index in 'selection_a', then by index in 'selection_b'.
 
     All nodes from the selection must have a position accessible under the key
     given as the 'attribute' argument. That key is 'position' by default.
@@ -274,10 +279,10 @@ def pairs_under_threshold(molecules, threshold,
     threshold: float
         A distance threshold in nm. Pairs are return if the nodes are closer
         than this threshold.
-    selection_a: collections.abc.Iterable[collections.abc.Hashable]
+    selection_a: collections.abc.Sequence[collections.abc.Hashable]
         List of nodes to consider at one end of the pairs. The format is
         described above.
-    selection_b: collections.abc.Iterable[collections.abc.Hashable]
+    selection_b: collections.abc.Sequence[collections.abc.Hashable]
         List of nodes to consider at the other end of the pairs. The format is
         described above.
     attribute: collections.abc.Hashable
@@ -287,11 +292,11 @@ def pairs_under_threshold(molecules, threshold,
         Do not select pairs that are connected by less than that number of
         edges.
 
-    Yields
-    ------
-    tuple[collections.abc.Hashable, collections.abc.Hashable, float]
-        Pairs of node closer than the threshold in the format described above
-        and the distance between the nodes.
+    Returns
+    -------
+    tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        Indices in 'selection_a', indices in 'selection_b', and distances of
+        the pairs closer than the threshold.
 
     Raises
     ------
@@ -303,39 +308,81 @@ def pairs_under_threshold(molecules, threshold,
 
     Symetric node pairs are not deduplicated.
     """
-    coordinates_a = []
-    for key in selection_a:
-        coordinates_a.append(molecules[key[0]].nodes[key[1]][attribute])
-    coordinates_b = []
-    for key in selection_b:
-        coordinates_b.append(molecules[key[0]].nodes[key[1]][attribute])
-    if not coordinates_a or not coordinates_b:
-        return
+    index_a = np.array([], dtype=int)
+    index_b = np.array([], dtype=int)
+    distances = np.array([], dtype=float)
+    if not len(selection_a) or not len(selection_b):
+        return index_a, index_b, distances
+
+    coordinates_a = [
+        molecules[key[0]].nodes[key[1]][attribute] for key in selection_a
+    ]
+    coordinates_b = [
+        molecules[key[0]].nodes[key[1]][attribute] for key in selection_b
+    ]
     kdtree_a = KDTree(coordinates_a)
     kdtree_b = KDTree(coordinates_b)
     sparse_distance_matrix = kdtree_a.sparse_distance_matrix(kdtree_b, threshold)
-    for (idx, jdx), distance_between in sparse_distance_matrix.items():
-        key_a = selection_a[idx]
-        key_b = selection_b[jdx]
-        node_a = molecules[key_a[0]].nodes[key_a[1]]
-        node_b = molecules[key_b[0]].nodes[key_b[1]]
-        if key_a != key_b and distance_between < threshold:
-            if not _are_close(min_edges, molecules, key_a, key_b):
-                yield (key_a, key_b, distance_between)
-
-
-def _are_close(threshold, molecules, key_a, key_b):
-    if not threshold:
-        return False
-    if key_a[0] == key_b[0]:
-        try:
-            length = nx.shortest_path_length(
-                molecules[key_a[0]], key_a[1], key_b[1]
-            )
-        except nx.exception.NetworkXNoPath:
-            return False
-        else:
-            return length < threshold
+    if sparse_distance_matrix:
+        pairs = sorted(sparse_distance_matrix.items())
+        index_a = np.array([pair[0][0] for pair in pairs], dtype=int)
+        index_b = np.array([pair[0][1] for pair in pairs], dtype=int)
+        distances = np.array([pair[1] for pair in pairs], dtype=float)
+
+    # Node keys are arbitrary hashables, we give each of them an integer
+    # identifier so we can compare the ends of the pairs as arrays.
+    identifiers = {}
+    ids_a = np.array([
+        identifiers.setdefault(tuple(key), len(identifiers))
+        for key in selection_a
+    ], dtype=int)
+    ids_b = np.array([
+        identifiers.setdefault(tuple(key), len(identifiers))
+        for key in selection_b
+    ], dtype=int)
+    keep = (ids_a[index_a] != ids_b[index_b]) & (distances < threshold)
+
+    if min_edges:
+        neighborhoods = {}
+        for pair_idx in np.flatnonzero(keep):
+            key_a = selection_a[index_a[pair_idx]]
+            key_b = selection_b[index_b[pair_idx]]
+            if key_a[0] != key_b[0]:
+                continue
+            neighborhood = neighborhoods.get(tuple(key_a))
+            if neighborhood is None:
+                neighborhood = _neighborhood(
+                    molecules[key_a[0]], key_a[1], min_edges - 1
+                )
+                neighborhoods[tuple(key_a)] = neighborhood
+            if key_b[1] in neighborhood:
+                keep[pair_idx] = False
+
+    return index_a[keep], index_b[keep], distances[keep]
+
+
+def _neighborhood(molecule, source, cutoff):
+    """
+    Find the nodes that are at most 'cutoff' edges away from 'source'.
+
+    The breadth first search stops at depth 'cutoff' so the cost does not
+    depend on the size of the molecule, but only on the size of the
+    neighborhood.
+
+    Parameters
+    ----------
+    molecule: networkx.Graph
+    source: collections.abc.Hashable
+        Node key to start the search from.
+    cutoff: int
+        Maximum number of edges between the source and the nodes returned.
+
+    Returns
+    -------
+    set[collections.abc.Hashable]
+        The keys of the nodes in the neighborhood, including 'source'.
+    """
+    return set(nx.single_source_shortest_path_length(molecule, source, cutoff))
 
 
 def select_nodes_multi(molecules, selector):
@@ -365,6 +412,66 @@ def select_nodes_multi(molecules, selector):
                 yield (molecule_idx, key)
 
 
+def select_nodes_multi_templates(molecules, *templates):
+    """
+    Find the nodes that match lists of templates among multiple molecules.
+
+    This is equivalent to running :func:`select_nodes_multi` with
+    :func:`vermouth.selectors.proto_multi_templates` as a selector once for
+    each list of templates, but all the lists are evaluated in a single pass
+    over the nodes. In addition, templates are only evaluated once for all the
+    nodes that have the same values for the attributes the templates refer to
+    (e.g. all the nodes with a given residue name and atom name).
+
+    Parameters
+    ----------
+    molecules: collections.abc.Iterable[Molecule]
+        A list of molecules.
+    *templates: list[dict]
+        Lists of templates; a node needs to match at least one template from a
+        list to be part of the corresponding selection.
+
+    Returns
+    -------
+    tuple[list[tuple[int, collections.abc.Hashable]]]
+        One selection per list of templates, in the same order as the
+        templates. The selections are formatted as in
+        :func:`select_nodes_multi`.
+    """
+    attributes = list(set(
+        attribute
+        for template_list in templates
+        for template in template_list
+        for attribute in template
+    ))
+    results = {}
+    selections = tuple([] for _ in templates)
+    for molecule_idx, molecule in enumerate(molecules):
+        for key, node in molecule.nodes.items():
+            signature = tuple(
+                node.get(attribute, _MISSING) for attribute in attributes
+            )
+            try:
+                selected = results[signature]
+            except KeyError:
+                selected = results[signature] = _match_templates(node, templates)
+            except TypeError:
+                # At least one of the attribute values is not hashable, we
+                # cannot reuse the result for that node.
+                selected = _match_templates(node, templates)
+            for is_selected, selection in zip(selected, selections):
+                if is_selected:
+                    selection.append((molecule_idx, key))
+    return selections
+
+
+def _match_templates(node, templates):
+    return tuple(
+        selectors.proto_multi_templates(node, template_list)
+        for template_list in templates
+    )
+
+
 def add_edges_threshold(molecules, threshold,
                         templates_a, templates_b,
                         attribute='position', min_edges=0):
@@ -398,20 +505,20 @@ def add_edges_threshold(molecules, threshold,
     list[vermouth.molecule.Molecule]
         A new list of molecules.
     """
-    selector_a = functools.partial(
-        selectors.proto_multi_templates, templates=templates_a
+    if templates_a is templates_b:
+        selection_a, = select_nodes_multi_templates(molecules, templates_a)
+        selection_b = selection_a
+    else:
+        selection_a, selection_b = select_nodes_multi_templates(
+            molecules, templates_a, templates_b
+        )
+    index_a, index_b, distances = pairs_under_threshold(
+        molecules, threshold, selection_a, selection_b,
+        attribute, min_edges=min_edges,
     )
-    selection_a = list(select_nodes_multi(molecules, selector_a))
-    selector_b = functools.partial(
-        selectors.proto_multi_templates, templates=templates_b
-    )
-    selection_b = list(select_nodes_multi(molecules, selector_b))
-    edges = pairs_under_threshold(molecules, threshold,
-                                  selection_a, selection_b,
-                                  attribute, min_edges=min_edges)
     edges = (
-        (node1, node2, {'distance': distance})
-        for node1, node2, distance in edges
+        (selection_a[idx], selection_b[jdx], {'distance': distance})
+        for idx, jdx, distance in zip(index_a, index_b, distances)
     )
     new_molecules = add_inter_molecule_edges(molecules, edges)
     return new_molecules
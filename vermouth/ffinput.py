@@ -26,6 +26,7 @@ import collections
 import copy
 import numbers
 import json
+import re
 from .molecule import (
     Block, Link,
     Interaction, DeleteInteraction,
@@ -44,6 +45,27 @@ PARAMETER_EFFECTORS = {
     'dihphase': ParamDihedralPhase,
 }
 
+# A token is either a set of atom attributes between brackets, or a run of
+# non-separator characters that ends before a bracket.
+_TOKEN = re.compile(r'\{[^{}]*\}|[^ \t\n{}]+')
+# A line that only contains such tokens and separators. A run of characters
+# has to be followed by a separator, a bracket, or the end of the line, so
+# there is only one way to match a line and no catastrophic backtracking.
+_SIMPLE_LINE = re.compile(
+    r'(?:[ \t\n]*(?:\{[^{}]*\}|[^ \t\n{}]+(?![^ \t\n{}])))*[ \t\n]*'
+)
+_MACRO = re.compile(r'\$([^ \t\n{}]*)')
+
+_INTERACTIONS_NATOMS = {
+    'bonds': 2,
+    'angles': 3,
+    'dihedrals': 4,
+    'impropers': 4,
+    'constraints': 2,
+    'virtual_sites2': 3,
+    'pairs': 2,
+}
+
 
 def _tokenize(line):
     """
@@ -141,6 +163,26 @@ def _tokenize(line):
     ----------
     line: str
 
+    Returns
+    -------
+    list of str
+    """
+    if _SIMPLE_LINE.fullmatch(line):
+        return _TOKEN.findall(line)
+    return _tokenize_brackets(line)
+
+
+def _tokenize_brackets(line):
+    """
+    Split a line into tokens, one character at a time.
+
+    This is the slow path of :func:`_tokenize` for the lines with nested or
+    unbalanced brackets.
+
+    Parameters
+    ----------
+    line: str
+
     Returns
     -------
     list of str
@@ -199,21 +241,35 @@ def _tokenize(line):
 
 
 def _substitute_macros(line, macros):
-    start = None
-    while start is None or 0 <= start < len(line):
-        start = line.find('$', start)
-        if start < 0:
-            break
-        for end, char in enumerate(line[start + 1:], start=start + 1):
-            if char in ' \t\n{}':
-                break
-        else: # no break
-            end += 1
-        macro_name = line[start + 1:end]
-        macro_value = macros[macro_name]
-        line = line[:start] + macro_value + line[end:]
-        end = start + len(macro_value)
-    return line
+    """
+    Replace every ``$name`` in a line by the value of the macro.
+
+    Macro values can refer to other macros, these are expanded as well.
+
+    Raises
+    ------
+    KeyError
+        A macro is not defined.
+    """
+    if '$' not in line:
+        return line
+    return _MACRO.sub(
+        lambda match: _substitute_macros(macros[match.group(1)], macros),
+        line
+    )
+
+
+def _merged(*mappings):
+    """
+    Merge dictionaries; the first ones have priority.
+
+    This is equivalent to ``dict(collections.ChainMap(*mappings))``, without
+    the overhead of the chain map.
+    """
+    merged = {}
+    for mapping in reversed(mappings):
+        merged.update(mapping)
+    return merged
 
 
 def _some_atoms_left(tokens, atoms, natoms):
@@ -258,10 +314,12 @@ def _get_atoms(tokens, natoms):
 
 
 def _treat_block_interaction_atoms(atoms, context, section):
-    atom_names = list(context.nodes)
+    atom_names = None
     for atom in atoms:
         reference = atom[0]
         if reference.isdigit():
+            if atom_names is None:
+                atom_names = list(context.nodes)
             # The indices in the file are 1-based
             reference = int(reference) - 1
             try:
@@ -553,7 +611,7 @@ def _base_parser(tokens, context, context_type, section, natoms=None, delete=Fal
     parameters = _parse_interaction_parameters(tokens)
 
     apply_to_all_interactions = context._apply_to_all_interactions[section]
-    meta = dict(collections.ChainMap(meta, apply_to_all_interactions))
+    meta = _merged(meta, apply_to_all_interactions)
 
     if delete:
         interaction = DeleteInteraction(
@@ -601,7 +659,7 @@ def _parse_block_atom(tokens, context):
         atom['charge'] = float(tokens.popleft())
     if tokens:
         atom['mass'] = float(tokens.popleft())
-    context.add_atom(dict(collections.ChainMap(attributes, atom)))
+    context.add_atom(_merged(attributes, atom))
 
 
 def _parse_link_atom(tokens, context, defaults=None, treat_prefix=True):
@@ -618,7 +676,7 @@ def _parse_link_atom(tokens, context, defaults=None, treat_prefix=True):
     else:
         prefixed_reference = reference
         attributes['atomname'] = reference
-    attributes = dict(collections.ChainMap(attributes, context._apply_to_all_nodes))
+    attributes = _merged(attributes, context._apply_to_all_nodes)
     node_attributes = context.nodes.get(prefixed_reference, {})
     for attr, value in attributes.items():
         if value != node_attributes.get(attr, value):
@@ -627,7 +685,7 @@ def _parse_link_atom(tokens, context, defaults=None, treat_prefix=True):
                    'to "{}" because it is already defined as "{}".')
             raise IOError(msg.format(attr, reference, value,
                                      node_attributes[node_attributes[attr]]))
-    full_attributes = dict(collections.ChainMap(attributes, node_attributes, defaults))
+    full_attributes = _merged(attributes, node_attributes, defaults)
 
     if prefixed_reference in context.nodes:
         context.nodes[prefixed_reference] = full_attributes
@@ -690,7 +748,7 @@ def _parse_edges(tokens, context, context_type, negate):
             apply_to_all_nodes = context._apply_to_all_nodes
         except AttributeError:
             apply_to_all_nodes = {}
-        full_attributes = dict(collections.ChainMap(attributes, apply_to_all_nodes))
+        full_attributes = _merged(attributes, apply_to_all_nodes)
         prefixed_atoms.append([prefixed_reference, full_attributes])
     if negate:
         context.non_edges.append([prefixed_atoms[0][0], prefixed_atoms[1][1]])
@@ -721,6 +779,128 @@ def _parse_features(tokens, context, context_type):
     context.features.extend(list(tokens))
 
 
+class _ReaderState:
+    """
+    What :func:`read_ff` knows about the file it reads so far.
+    """
+    def __init__(self, force_field):
+        self.force_field = force_field
+        self.macros = {}
+        self.blocks = {}
+        self.links = []
+        self.modifications = []
+        self.context_type = None
+        self.context = None
+        self.section = None
+        self.delete = False
+
+
+def _read_section_header(state, cleaned, line_num):
+    # We read a line that opens a section. We may have to open a new
+    # block or a new link.
+    if not cleaned.endswith(']'):
+        raise IOError('Misformated section header at line {}.'
+                      .format(line_num))
+    section = cleaned[1:-1].strip().lower()
+    if section.startswith('!'):
+        section = section[1:]
+        state.delete = True
+    else:
+        state.delete = False
+    state.section = section
+    if section == 'link':
+        state.context_type = 'link'
+        state.context = Link()
+        state.links.append(state.context)
+    elif section == 'modification':
+        state.context_type = 'modifications'
+        state.context = Link()
+        state.modifications.append(state.context)
+
+
+def _read_moleculetype(state, cleaned, tokens):
+    state.context_type = 'block'
+    state.context = Block(force_field=state.force_field)
+    name, nrexcl = cleaned.split()
+    state.context.name = name
+    state.context.nrexcl = int(nrexcl)
+    state.blocks[name] = state.context
+
+
+def _read_modification_name(state, cleaned, tokens):
+    state.context.name = cleaned
+
+
+def _read_macro(state, cleaned, tokens):
+    state.context = None
+    state.context_type = None
+    _parse_macro(tokens, state.macros)
+
+
+def _read_link_attribute(state, cleaned, tokens):
+    _parse_link_attribute(tokens, state.context, state.section)
+
+
+def _read_atom(state, cleaned, tokens):
+    if state.context_type == 'block':
+        _parse_block_atom(tokens, state.context)
+    elif state.context_type == 'link':
+        _parse_link_atom(tokens, state.context)
+    elif state.context_type == 'modifications':
+        _parse_link_atom(tokens, state.context,
+                         defaults={'PTM_atom': False},
+                         treat_prefix=False)
+
+
+def _read_non_edge(state, cleaned, tokens):
+    _parse_edges(tokens, state.context, state.context_type, negate=True)
+
+
+def _read_edge(state, cleaned, tokens):
+    _parse_edges(tokens, state.context, state.context_type, negate=False)
+
+
+def _read_pattern(state, cleaned, tokens):
+    _parse_patterns(tokens, state.context, state.context_type)
+
+
+def _read_feature(state, cleaned, tokens):
+    _parse_features(tokens, state.context, state.context_type)
+
+
+def _read_variable(state, cleaned, tokens):
+    if state.context is not None:
+        raise IOError('The [variables] section must be defined '
+                      'before the blocks and the links.')
+    _parse_variables(tokens, state.force_field, state.section)
+
+
+def _read_interaction(state, cleaned, tokens):
+    if tokens[0] == '#meta':
+        _parse_meta(tokens, state.context, state.context_type, state.section)
+    else:
+        natoms = _INTERACTIONS_NATOMS.get(state.section)
+        _base_parser(tokens, state.context, state.context_type, state.section,
+                     natoms=natoms, delete=state.delete)
+
+
+# How to read a line within a section. Any section that is not listed here
+# describes interactions.
+_SECTION_READERS = {
+    'moleculetype': _read_moleculetype,
+    'modification': _read_modification_name,
+    'macros': _read_macro,
+    'link': _read_link_attribute,
+    'molmeta': _read_link_attribute,
+    'atoms': _read_atom,
+    'non-edges': _read_non_edge,
+    'edges': _read_edge,
+    'patterns': _read_pattern,
+    'features': _read_feature,
+    'variables': _read_variable,
+}
+
+
 def read_ff(lines, force_field):
     """
     Read a .ff file and update the force field with its content.
@@ -732,100 +912,30 @@ def read_ff(lines, force_field):
     force_field: vermouth.forcefield.ForceField
         The force field to update.
     """
-    interactions_natoms = {
-        'bonds': 2,
-        'angles': 3,
-        'dihedrals': 4,
-        'impropers': 4,
-        'constraints': 2,
-        'virtual_sites2': 3,
-        'pairs': 2,
-    }
-
-    macros = {}
-    blocks = {}
-    links = []
-    modifications = []
-    context_type = None
-    context = None
-    section = None
-    delete = False
+    state = _ReaderState(force_field)
+    macros = state.macros
     for line_num, line in enumerate(lines, start=1):
-        cleaned = _substitute_macros(line.split(';', 1)[0].strip(), macros)
+        cleaned = line.split(';', 1)[0].strip()
+        if '$' in cleaned:
+            cleaned = _substitute_macros(cleaned, macros)
         if not cleaned:
             continue
 
-        tokens = collections.deque(_tokenize(cleaned))
         try:
-            # We read a line that opens a section. We may have to open a new
-            # block or a new link.
             if cleaned.startswith('['):
-                if not cleaned.endswith(']'):
-                    raise IOError('Misformated section header at line {}.'
-                                  .format(line_num))
-                section = cleaned[1:-1].strip().lower()
-                if section.startswith('!'):
-                    section = section[1:]
-                    delete = True
-                else:
-                    delete = False
-                if section == 'link':
-                    context_type = 'link'
-                    context = Link()
-                    links.append(context)
-                elif section == 'modification':
-                    context_type = 'modifications'
-                    context = Link()
-                    modifications.append(context)
-            # We read a line within a section.
-            elif section == 'moleculetype':
-                context_type = 'block'
-                context = Block(force_field=force_field)
-                name, nrexcl = cleaned.split()
-                context.name = name
-                context.nrexcl = int(nrexcl)
-                blocks[name] = context
-            elif section == 'modification':
-                context.name = cleaned
-            elif section == 'macros':
-                context = None
-                context_type = None
-                _parse_macro(tokens, macros)
-            elif section == 'link':
-                _parse_link_attribute(tokens, context, section)
-            elif section == 'molmeta':
-                _parse_link_attribute(tokens, context, section)
-            elif section == 'atoms':
-                if context_type == 'block':
-                    _parse_block_atom(tokens, context)
-                elif context_type == 'link':
-                    _parse_link_atom(tokens, context)
-                elif context_type == 'modifications':
-                    _parse_link_atom(tokens, context,
-                                     defaults={'PTM_atom': False},
-                                     treat_prefix=False)
-            elif section == 'non-edges':
-                _parse_edges(tokens, context, context_type, negate=True)
-            elif section == 'edges':
-                _parse_edges(tokens, context, context_type, negate=False)
-            elif section == 'patterns':
-                _parse_patterns(tokens, context, context_type)
-            elif section == 'features':
-                _parse_features(tokens, context, context_type)
-            elif section == 'variables':
-                if context is not None:
-                    raise IOError('The [variables] section must be defined '
-                                  'before the blocks and the links.')
-                _parse_variables(tokens, force_field, section)
-            elif tokens[0] == '#meta':
-                _parse_meta(tokens, context, context_type, section)
+                _read_section_header(state, cleaned, line_num)
             else:
-                natoms = interactions_natoms.get(section)
-                _base_parser(tokens, context, context_type, section,
-                             natoms=natoms, delete=delete)
+                # We read a line within a section.
+                tokens = collections.deque(_tokenize(cleaned))
+                reader = _SECTION_READERS.get(state.section, _read_interaction)
+                reader(state, cleaned, tokens)
         except Exception:
             raise IOError('Error while reading line {} in section {}.'
-                          .format(line_num, section))
+                          .format(line_num, state.section))
+
+    blocks = state.blocks
+    links = state.links
+    modifications = state.modifications
 
     # Finish the blocks and the links.
     # Because of hos they are described in gromacs, proper and improper
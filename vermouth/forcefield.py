@@ -16,11 +16,14 @@ Provides a class used to describe a forcefield and all associated data.
 """
 
 
+import collections.abc
 import itertools
 from glob import glob
 import os
 from .gmx.rtp import read_rtp
 from .ffinput import read_ff
+from .graph_utils import CompiledReference
+from .cache import load_cached
 from . import DATA_PATH
 
 FORCE_FIELD_PARSERS = {'.rtp': read_rtp, '.ff': read_ff}
@@ -46,6 +49,7 @@ class ForceField(object):
         self.modifications = []
         self.renamed_residues = {}
         self.variables = {}
+        self._compiled_references = {}
         self.name = None
         if directory is not None:
             self.read_from(directory)
@@ -80,6 +84,34 @@ class ForceField(object):
         """
         return self.blocks
 
+    def compiled_reference(self, name):
+        """
+        Get the reference graph for a residue, preprocessed for matching.
+
+        The preprocessing is done the first time a reference is requested,
+        and redone if the block got replaced since.
+
+        Parameters
+        ----------
+        name: str
+            The name of the residue.
+
+        Returns
+        -------
+        vermouth.graph_utils.CompiledReference
+
+        Raises
+        ------
+        KeyError
+            There is no reference graph for the residue.
+        """
+        reference = self.reference_graphs[name]
+        compiled = self._compiled_references.get(name)
+        if compiled is None or compiled.graph is not reference:
+            compiled = CompiledReference(reference)
+            self._compiled_references[name] = compiled
+        return compiled
+
     @property
     def features(self):
         """
@@ -107,9 +139,95 @@ class ForceField(object):
         return feature in self.features
 
 
+class ForceFieldRegistry(collections.abc.MutableMapping):
+    """
+    A dictionary of force fields that are parsed on first access.
+
+    Force field directories are registered with :meth:`add_directory`, which
+    does not read them. A force field is parsed the first time it is
+    accessed; testing if a force field is known does not parse it.
+
+    Force fields can also be set directly, as in a dictionary.
+    """
+    def __init__(self):
+        self._force_fields = {}
+        self._pending = {}
+
+    def add_directory(self, path, name=None):
+        """
+        Register a force field directory.
+
+        If the force field is already known, the content of the directory
+        will update it when it is accessed.
+
+        Parameters
+        ----------
+        path: str
+            The directory that contains the force field files.
+        name: str
+            The name of the force field. Defaults to the base name of the
+            directory.
+        """
+        if name is None:
+            name = os.path.basename(path)
+        self._pending.setdefault(name, []).append(path)
+
+    def __getitem__(self, name):
+        if name in self._pending:
+            force_field = self._force_fields.get(name)
+            for path in self._pending[name]:
+                try:
+                    if force_field is None:
+                        force_field = _read_force_field(path)
+                    else:
+                        force_field.read_from(path)
+                except IOError:
+                    msg = 'An error occured while reading the force field in  "{}".'
+                    raise IOError(msg.format(path))
+            del self._pending[name]
+            self._force_fields[name] = force_field
+        return self._force_fields[name]
+
+    def __setitem__(self, name, force_field):
+        self._pending.pop(name, None)
+        self._force_fields[name] = force_field
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._pending.pop(name, None)
+        self._force_fields.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._force_fields or name in self._pending
+
+    def __iter__(self):
+        yield from self._force_fields
+        for name in self._pending:
+            if name not in self._force_fields:
+                yield name
+
+    def __len__(self):
+        return len(set(self._force_fields) | set(self._pending))
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, sorted(self))
+
+
+def _read_force_field(path):
+    """
+    Read a force field from a directory, through the cache of parsed files.
+    """
+    return load_cached(
+        'force-field:' + os.path.abspath(path),
+        iter_force_field_files(path),
+        lambda: ForceField(path),
+    )
+
+
 def find_force_fields(directory, force_fields=None):
     """
-    Read all the force fields in the given directory.
+    Find all the force fields in the given directory.
 
     A force field is defined as a directory that contains at least one RTP
     file. The name of the force field is the base name of the directory.
@@ -119,6 +237,11 @@ def find_force_fields(directory, force_fields=None):
     values. The force fields in the dictionary will be updated if force fields
     with the same names are found in the directory.
 
+    With a :class:`ForceFieldRegistry`, as is created when no dictionary is
+    provided, the force fields are only parsed when they are accessed. Other
+    dictionaries are updated with parsed force fields. New force fields are
+    read through the cache of parsed files, see :mod:`vermouth.cache`.
+
     Parameters
     ----------
     directory: pathlib.Path or str
@@ -133,10 +256,10 @@ def find_force_fields(directory, force_fields=None):
         names as strings, and values are instances of :class:`ForceField`. If a
         dictionary was provided as the "force_fields" argument, then the
         returned dictionary is the same instance as the one provided but with
-        updated content.
+        updated content. Otherwise, it is a :class:`ForceFieldRegistry`.
     """
     if force_fields is None:
-        force_fields = {}
+        force_fields = ForceFieldRegistry()
     directory = str(directory)  # Py<3.6 compliance
     for name in os.listdir(directory):
         path = os.path.join(directory, name)
@@ -145,9 +268,12 @@ def find_force_fields(directory, force_fields=None):
         except StopIteration:
             pass
         else:
+            if isinstance(force_fields, ForceFieldRegistry):
+                force_fields.add_directory(path, name)
+                continue
             try:
                 if name not in force_fields:
-                    force_fields[name] = ForceField(path)
+                    force_fields[name] = _read_force_field(path)
                 else:
                     force_fields[name].read_from(path)
             except IOError:
@@ -18,6 +18,7 @@ Provides functionality to read and write GRO96 files.
 
 from functools import partial
 from itertools import chain
+import sys
 
 import numpy as np
 
@@ -46,7 +47,8 @@ def read_gro(file_name, exclude=('SOL',), ignh=False):
     """
     molecule = Molecule()
     idx = 0
-    field_types = [int, str, str, int, float, float, float]
+    # Residue and atom names are interned to be stored only once.
+    field_types = [int, sys.intern, sys.intern, int, float, float, float]
     field_names = ['resid', 'resname', 'atomname', 'atomid', 'x', 'y', 'z']
     field_widths = [5, 5, 5, 5]
 
@@ -17,8 +17,6 @@ Handle the RTP format from Gromacs.
 """
 
 import collections
-import itertools
-import networkx as nx
 
 from ..molecule import Block, Link, Interaction
 from .. import utils
@@ -230,16 +228,41 @@ def _parse_bondedtypes(section):
     return bondedtypes
 
 
-def _count_hydrogens(names):
-    return len([name for name in names if utils.first_alpha(name) == 'H'])
+def _generate_dihedrals(block):
+    """
+    Generate all the possible dihedral angles in a block, grouped by center.
+
+    This is equivalent to grouping the output of
+    :meth:`vermouth.molecule.Block.guess_dihedrals` by
+    :func:`_dihedral_sorted_center`, but walks a plain adjacency list in a
+    single traversal.
 
+    Parameters
+    ----------
+    block: vermouth.molecule.Block
 
-def _keep_dihedral(center, block, bondedtypes):
-    if (not bondedtypes.all_dihedrals) and block.has_dihedral_around(center):
-        return False
-    if bondedtypes.remove_dih and block.has_improper_around(center):
-        return False
-    return True
+    Returns
+    -------
+    dict[tuple, list[tuple]]
+        The dihedral angles, as tuples of 4 atom names, for each central
+        pair of atoms. Within a group, the dihedral angles are in the order
+        :meth:`~vermouth.molecule.Block.guess_dihedrals` generates them.
+    """
+    adjacency = {node: list(neighbors) for node, neighbors in block.adj.items()}
+    by_center = collections.defaultdict(list)
+    for a, a_neighbors in adjacency.items():
+        for b in a_neighbors:
+            b_neighbors = adjacency[b]
+            for c in b_neighbors:
+                if c == a:
+                    continue
+                group = None
+                for d in adjacency[c]:
+                    if d != a and d != b:
+                        if group is None:
+                            group = by_center[(b, c)]
+                        group.append((a, b, c, d))
+    return by_center
 
 
 def _complete_block(block, bondedtypes):
@@ -256,16 +279,29 @@ def _complete_block(block, bondedtypes):
     # RTP files are written assuming they will be generated. A RTP file
     # have some control over these dihedral angles through the bondedtypes
     # section.
+    dihedral_centers = {
+        tuple(_dihedral_sorted_center(dihedral.atoms))
+        for dihedral in block.interactions.get('dihedrals', [])
+    }
+    improper_centers = {
+        tuple(_dihedral_sorted_center(improper.atoms))
+        for improper in block.interactions.get('impropers', [])
+    }
+    hydrogens = {name: utils.first_alpha(name) == 'H' for name in block}
     all_dihedrals = []
-    for center, dihedrals in itertools.groupby(
-            sorted(block.guess_dihedrals(), key=_dihedral_sorted_center),
-            _dihedral_sorted_center):
-        if _keep_dihedral(center, block, bondedtypes):
-            # TODO: Also sort the dihedrals by index.
-            # See src/gromacs/gmxpreprocess/gen_add.cpp::dcomp in the
-            # Gromacs source code (see version 2016.3 for instance).
-            atoms = sorted(dihedrals, key=_count_hydrogens)[0]
-            all_dihedrals.append(Interaction(atoms=atoms, parameters=[], meta={}))
+    by_center = _generate_dihedrals(block)
+    for center in sorted(by_center):
+        if ((not bondedtypes.all_dihedrals and center in dihedral_centers)
+                or (bondedtypes.remove_dih and center in improper_centers)):
+            continue
+        # TODO: Also sort the dihedrals by index.
+        # See src/gromacs/gmxpreprocess/gen_add.cpp::dcomp in the
+        # Gromacs source code (see version 2016.3 for instance).
+        # `min` keeps the first of the dihedrals with the fewest hydrogens,
+        # like a stable sort would.
+        atoms = min(by_center[center],
+                    key=lambda atoms: sum(hydrogens[name] for name in atoms))
+        all_dihedrals.append(Interaction(atoms=atoms, parameters=[], meta={}))
     # TODO: Sort the dihedrals by index
     block.interactions['dihedrals'] = (
         block.interactions.get('dihedrals', []) + all_dihedrals
@@ -371,39 +407,36 @@ def _split_block_and_link(pre_block):
     for atom in pre_block.atoms:
         if not atom['atomname'].startswith('+-'):
             block.add_atom(atom)
-        link.add_node(atom['atomname'])
-
-    # Create the edges of the link and block based on the edges in the pre-block.
-    # This will create too many edges in the link, but the useless ones will be
-    # pruned latter.
-    link.add_edges_from(pre_block.edges)
     block.add_edges_from(edge for edge in pre_block.edges
                          if not any(node[0] in '+-' for node in edge))
 
     # Split the interactions from the pre-block between the block (for
     # intra-residue interactions) and the link (for inter-residues ones).
-    # The "relevant_atoms" set keeps track of what particles are
-    # involved in the link. This will allow to prune the link without
-    # iterating again through its interactions.
-    relevant_atoms = set()
+    # The "relevant_atoms" keeps track of what particles are involved in the
+    # link, in order of appearance.
+    relevant_atoms = {}
+    link_interactions = collections.defaultdict(list)
     for name, interactions in pre_block.interactions.items():
         for interaction in interactions:
             for_link = any(atom[0] in '+-' for atom in interaction.atoms)
             if for_link:
-                link.interactions[name].append(interaction)
-                relevant_atoms.update(interaction.atoms)
+                link_interactions[name].append(interaction)
+                relevant_atoms.update(dict.fromkeys(interaction.atoms))
             else:
                 block.interactions[name].append(interaction)
 
-    # Prune the link to keep only the edges and particles that are
-    # relevant.
-    nodes = set(link.nodes())
-    link.remove_nodes_from(nodes - relevant_atoms)
-    # Some interactions do not generate nodes (impropers for instance). If a
-    # node is only described in one of such interactions, then the node never
-    # appears in the link. Here we make sure these nodes exists even if they
-    # are note connected.
-    link.add_nodes_from(relevant_atoms)
+    # Only the particles involved in link interactions, and the edges between
+    # them, are part of the link. The link nodes are numbered following the
+    # atoms of the pre-block, then the particles from the neighboring residues
+    # in the order the edges reach them. Some interactions do not generate
+    # nodes (impropers for instance), so the particles only described in such
+    # interactions come last.
+    known_nodes = dict.fromkeys(atom['atomname'] for atom in pre_block.atoms)
+    for edge in pre_block.edges:
+        known_nodes.update(dict.fromkeys(edge))
+    node_order = [node for node in known_nodes if node in relevant_atoms]
+    node_order += [node for node in relevant_atoms if node not in known_nodes]
+    relabel_mapping = {node: idx for idx, node in enumerate(node_order)}
 
     # Atoms from a links are matched against a molecule based on its node
     # attributes. The name is a primary criterion, but other criteria can be
@@ -415,32 +448,28 @@ def _split_block_and_link(pre_block):
     # RTP files convey the order by prefixing the names with + or -. We need to
     # get rid of these prefixes.
     order = {'+': +1, '-': -1}
-    relabel_mapping = {}
-    for idx, node in enumerate(link.nodes()):
-        atomname = node
+    for node in node_order:
         if node[0] in '+-':
-            link.node[node]['order'] = order[node[0]]
-            atomname = atomname[1:]
+            attributes = {'order': order[node[0]], 'atomname': node[1:]}
         else:
-            link.node[node]['order'] = 0
-            link.node[node]['resname'] = block.name
-        link.node[node]['atomname'] = atomname
-        relabel_mapping[node] = idx
-    nx.relabel_nodes(link, relabel_mapping, copy=False)
-
-    # By relabelling the nodes, we lost the relations between interactions and
-    # nodes, so we need to relabel the atoms in the interactions
-    new_interactions = collections.defaultdict(list)
-    for name, interactions in link.interactions.items():
+            attributes = {'order': 0, 'resname': block.name, 'atomname': node}
+        link.add_node(relabel_mapping[node], **attributes)
+    link.add_edges_from(
+        (relabel_mapping[node1], relabel_mapping[node2])
+        for node1, node2 in pre_block.edges
+        if node1 in relevant_atoms and node2 in relevant_atoms
+    )
+
+    # The link refers to its atoms by index, so we need to relabel the atoms
+    # in the interactions
+    for name, interactions in link_interactions.items():
         for interaction in interactions:
             atoms = tuple(relabel_mapping[atom] for atom in interaction.atoms)
-            new_interactions[name].append(Interaction(
+            link.interactions[name].append(Interaction(
                 atoms=atoms,
                 parameters=interaction.parameters,
                 meta=interaction.meta
             ))
-    link.interactions = new_interactions
-
 
     # Revert the interactions back to regular dicts to avoid creating
     # keys when querying them.
@@ -14,7 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple, OrderedDict
 import itertools
 import networkx as nx
 
@@ -83,81 +83,234 @@ def categorical_maximum_common_subgraph(graph1, graph2, attributes=tuple()):
     return matches
 
 
-def maximum_common_subgraph(graph1, graph2, attributes=tuple()):
-    product = nx.Graph()
-    # First, find the MCS between all nodes of degree != 1, such as the carbons
-    # Nothing new or exciting here.
-    for g1_node, g2_node in itertools.product(graph1, graph2):
-        node1 = graph1.nodes[g1_node]
-        node2 = graph2.nodes[g2_node]
-        if all(attr in node1 and attr in node2 and node1[attr] == node2[attr] for attr in attributes):
-            if graph1.degree(g1_node) != 1 and graph2.degree(g2_node) != 1:
-                product.add_node((g1_node, g2_node))
-    for (g1_node1, g2_node1), (g1_node2, g2_node2) in itertools.combinations(product.nodes(), 2):
-        both_edge = graph1.has_edge(g1_node1, g1_node2) and graph2.has_edge(g2_node1, g2_node2)
-        neither_edge = not graph1.has_edge(g1_node1, g1_node2) and not graph2.has_edge(g2_node1, g2_node2)
-        # Effectively: not (graph1.has_edge(g1_node1, g1_node2) xor graph2.has_edge(g2_node1, g2_node2))
-        if g1_node1 != g1_node2 and g2_node1 != g2_node2 and (both_edge or neither_edge):
-            product.add_edge((g1_node1, g2_node1), (g1_node2, g2_node2))
-    cliques = nx.find_cliques(product)
-#    largest = maxes(cliques, key=len)
-    # We can't do maxes, because it might still grow to be as large. Does make
-    # things slower though... We could say that it can grow to be at most the
-    # current size plus the number of degree-1 nodes.
-    largest = cliques
-
-    # Add an empty match in case nothing of degree > 1 matches. In that case we
-    # still need to do the loop below.
-    largest = itertools.chain([[]], largest)
-
-    # Now, for every MCS we found, look at the nodes of degree 1. The
-    # attributes still need to match. In addition, they need to have the same
-    # (mapped) neighbour, or the neighbour must be missing from the graph2 graph
-    all_cliques = []
-    for clique in largest:
-        match = dict(clique)
-        product = nx.Graph()
-        product.add_nodes_from(clique)
-        for g1_node, g2_node in itertools.product(graph1, graph2):
-            node1 = graph1.nodes[g1_node]
-            node2 = graph2.nodes[g2_node]
-            # We can't do this above, because we need the match to translate
-            # nodes from graph graph1 to graph graph2 to see whether their neighbours
-            # correspond.
-            if (graph1.degree(g1_node) <= 1 or graph2.degree(g2_node) <= 1) and\
-                    all(attr in node1 and attr in node2 and node1[attr] == node2[attr] for attr in attributes):
-                g1_neighbors = [match.get(n, None) for n in graph1.neighbors(g1_node)]
-                # If no neighbors are found for g1_node, or if any of them are
-                # the same in graph2, they're compatible.
-
-                # FIXME?
-                # This eliminates some nodes from the MCS, since it's possible
-                # the MCS does not include *all* nodes in match. This means
-                # that some nodes should be considered compatible, even if they
-                # have different neighbours, but only if that neighbor is not
-                # part of the final MCS. This makes testing a little tricky,
-                # since categorical_maximum_common_subgraph *does* find them.
-                # It'll be a cornercase anyway.
-                if not g1_neighbors or None in g1_neighbors or any(n in g1_neighbors for n in graph2.neighbors(g2_node)):
-                    product.add_node((g1_node, g2_node))
-        for (g1_node1, g2_node1), (g1_node2, g2_node2) in itertools.combinations(product.nodes(), 2):
-            both_edge = graph1.has_edge(g1_node1, g1_node2) and graph2.has_edge(g2_node1, g2_node2)
-            neither_edge = not graph1.has_edge(g1_node1, g1_node2) and not graph2.has_edge(g2_node1, g2_node2)
-            # Effectively: not (graph1.has_edge(g1_node1, g1_node2) xor graph2.has_edge(g2_node1, g2_node2))
-            if g1_node1 != g1_node2 and g2_node1 != g2_node2 and (both_edge or neither_edge):
-                product.add_edge((g1_node1, g2_node1), (g1_node2, g2_node2))
-        # TODO: This duplicates a lot of effort. Maybe create the compatibility
-        # graph first from all cliques, and find the cliques only once?
-        this_pass = nx.find_cliques(product)
-        all_cliques.append(this_pass)
-    # And finally, find the largest MCS in all cliques graph2.
-    largest = maxes(itertools.chain(*all_cliques), key=len)
-    matches = set(frozenset(m) for m in largest)  # remove duplicates
-    matches = [dict(clique) for clique in matches]
+def _label_classes(graph, attributes):
+    """
+    Group the nodes of a graph by their values for `attributes`.
 
+    Nodes that lack any of the attributes cannot be matched, and are left out.
+
+    Returns
+    -------
+    list[tuple[tuple, list[int]]]
+        The label, and the positions of the nodes in `graph` with that label.
+    """
+    classes = []
+    for position, node in enumerate(graph.nodes.values()):
+        if not all(attr in node for attr in attributes):
+            continue
+        label = tuple(node[attr] for attr in attributes)
+        # The labels may not be hashable, so they are compared one by one.
+        for class_label, positions in classes:
+            if class_label == label:
+                positions.append(position)
+                break
+        else:  # no break
+            classes.append((label, [position]))
+    return classes
+
+
+class _MCSSearch:
+    """
+    Branch and bound search for all the maximum common induced subgraphs of
+    two graphs, in the style of McSplit.
+
+    The candidate nodes are kept in classes of a graph1 set and a graph2 set
+    that can be matched to each other. A class groups nodes with the same
+    label, and the same adjacency to every node matched so far. Matching a
+    pair of nodes splits every class in the part adjacent to that pair and the
+    part that is not; which guarantees that the edges between matched nodes
+    agree in both graphs. A class can add at most the size of its smaller set
+    to the match, which bounds the search.
+
+    If the search runs out of steps, `complete` is set to ``False``.
+    """
+    def __init__(self, graph1, graph2, attributes, max_steps=None):
+        self.nodes1 = list(graph1)
+        self.nodes2 = list(graph2)
+        self.adjacency1 = self._adjacency(graph1, self.nodes1)
+        self.adjacency2 = self._adjacency(graph2, self.nodes2)
+        classes2 = _label_classes(graph2, attributes)
+        self.classes = []
+        for label, positions1 in _label_classes(graph1, attributes):
+            for label2, positions2 in classes2:
+                if label == label2:
+                    self.classes.append((frozenset(positions1), frozenset(positions2)))
+                    break
+        self.max_steps = max_steps
+        self.steps = 0
+        self.complete = True
+        self.best_size = 0
+        self.solutions = []
+
+    @staticmethod
+    def _adjacency(graph, nodes):
+        positions = {node: position for position, node in enumerate(nodes)}
+        return [
+            frozenset(positions[neighbor] for neighbor in graph[node] if neighbor != node)
+            for node in nodes
+        ]
+
+    def run(self):
+        """
+        Run the search.
+
+        Returns
+        -------
+        list[dict]
+            The largest matches found, as graph1 node keys to graph2 node keys.
+        """
+        self._search([], self.classes)
+        return [
+            {self.nodes1[pos1]: self.nodes2[pos2] for pos1, pos2 in match}
+            for match in self.solutions
+        ]
+
+    def _search(self, match, classes):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.complete = False
+            return
+        bound = len(match) + sum(min(len(left), len(right)) for left, right in classes)
+        if bound < self.best_size:
+            return
+        if not classes:
+            if len(match) > self.best_size:
+                self.best_size = len(match)
+                self.solutions = []
+            if match:
+                self.solutions.append(list(match))
+            return
+
+        # Branch on the class with the fewest options, and on its graph1 node
+        # with the most neighbours.
+        class_idx = min(range(len(classes)),
+                        key=lambda idx: max(len(classes[idx][0]), len(classes[idx][1])))
+        left, right = classes[class_idx]
+        pos1 = max(sorted(left), key=lambda pos: len(self.adjacency1[pos]))
+        neighbors1 = self.adjacency1[pos1]
+        for pos2 in sorted(right):
+            neighbors2 = self.adjacency2[pos2]
+            new_classes = []
+            for other_left, other_right in classes:
+                other_left = other_left - {pos1}
+                other_right = other_right - {pos2}
+                adjacent = (other_left & neighbors1, other_right & neighbors2)
+                if adjacent[0] and adjacent[1]:
+                    new_classes.append(adjacent)
+                apart = (other_left - neighbors1, other_right - neighbors2)
+                if apart[0] and apart[1]:
+                    new_classes.append(apart)
+            match.append((pos1, pos2))
+            self._search(match, new_classes)
+            match.pop()
+
+        # Or leave the graph1 node out of the match.
+        new_classes = list(classes)
+        remaining = left - {pos1}
+        if remaining:
+            new_classes[class_idx] = (remaining, right)
+        else:
+            del new_classes[class_idx]
+        self._search(match, new_classes)
+
+
+def maximum_common_subgraph(graph1, graph2, attributes=tuple(), max_steps=None,
+                            return_complete=False):
+    """
+    Find all the maximum common induced subgraphs of two graphs.
+
+    Nodes can be matched if they have equal values for all `attributes`. The
+    common subgraphs are induced: two pairs of matched nodes are either
+    connected in both graphs, or in neither. The subgraphs do not need to be
+    connected.
+
+    The search is a branch and bound in the style of McSplit [#]_, and does
+    not build the modular product of the graphs like
+    :func:`categorical_maximum_common_subgraph` does.
+
+    Parameters
+    ----------
+    graph1: networkx.Graph
+    graph2: networkx.Graph
+    attributes: collections.abc.Iterable[collections.abc.Hashable]
+        The node attributes that must be equal for nodes to match.
+    max_steps: int or None
+        The maximum number of steps of the search. If the search runs out of
+        steps, the largest matches found so far are returned; they may not be
+        maximum. `None` means the search is complete.
+    return_complete: bool
+        Whether to also return if the search was complete.
+
+    Returns
+    -------
+    list[dict]
+        The largest matches, as graph1 node keys to graph2 node keys.
+    bool
+        Whether the search was complete, so that the matches are maximum.
+        Only returned if `return_complete` is ``True``.
+
+    References
+    ----------
+    .. [#] C. McCreesh, P. Prosser, J. Trimble, A Partitioning Algorithm for
+       Maximum Common Subgraph Problems, Proceedings of IJCAI 2017, 712-719.
+    """
+    search = _MCSSearch(graph1, graph2, tuple(attributes), max_steps)
+    matches = search.run()
+    if return_complete:
+        return matches, search.complete
     return matches
 
 
+def _hydrogen_groups(graph, node):
+    """
+    Group the neighbours of degree 1 of a node by atom name.
+    """
+    h_names = defaultdict(list)
+    for idx in graph[node]:
+        if graph.degree(idx) == 1:
+            h_names[graph.nodes[idx]['atomname']].append(idx)
+    return dict(h_names)
+
+
+class CompiledReference:
+    """
+    A graph, preprocessed to be matched by :func:`isomorphism`.
+
+    The preprocessing only depends on the graph, so it can be done once for a
+    reference graph and reused for every residue matched against it. The
+    graph must not be modified after it is compiled. Elements are guessed with
+    :func:`add_element_attr` if needed.
+
+    Parameters
+    ----------
+    graph: networkx.Graph
+
+    Attributes
+    ----------
+    graph: networkx.Graph
+        The compiled graph.
+    elements: dict
+        The element of each node.
+    degrees: dict
+        The degree of each node.
+    hydrogens: list
+        The nodes of degree 1, that are matched after the heavy atoms.
+    heavy_graph: networkx.Graph
+        A copy of the graph without the nodes of degree 1.
+    hydrogens_by_parent: dict[collections.abc.Hashable, dict[str, list]]
+        For each node, its neighbours of degree 1 grouped by atom name.
+    """
+    def __init__(self, graph):
+        add_element_attr(graph)
+        self.graph = graph
+        self.elements = dict(graph.nodes(data='element'))
+        self.degrees = dict(graph.degree)
+        self.hydrogens = [idx for idx in graph if self.degrees[idx] == 1]
+        self.heavy_graph = nx.Graph(graph).copy()
+        self.heavy_graph.remove_nodes_from(self.hydrogens)
+        self.hydrogens_by_parent = {idx: _hydrogen_groups(graph, idx) for idx in graph}
+
+
 def isomorphism(reference, residue):
     """
     Finds matching atoms between ``reference`` and ``residue``. ``residue`` should be
@@ -179,11 +332,14 @@ def isomorphism(reference, residue):
     in that case you should have a proper 'element' header, and the subgraph
     will be matched correctly.
 
+    Either graph can be given as a :class:`CompiledReference` to reuse its
+    preprocessing.
+
     Parameters
     ----------
-    reference : networkx.Graph
+    reference : networkx.Graph or CompiledReference
         The reference graph.
-    residue : networkx.Graph
+    residue : networkx.Graph or CompiledReference
         The graph to match to ``reference``.
     Returns
     -------
@@ -194,10 +350,19 @@ def isomorphism(reference, residue):
     """
     # TODO: refactor this thing to accept node and edge compatibility checkers
     matches = []
-#    H_idxs = [idx for idx in residue if residue.node[idx]['element'] == 'H']
-    H_idxs = [idx for idx in residue if residue.degree(idx) == 1]
-    heavy_res = nx.Graph(residue).copy()
-    heavy_res.remove_nodes_from(H_idxs)
+    compiled_reference = None
+    if isinstance(reference, CompiledReference):
+        compiled_reference = reference
+        reference = compiled_reference.graph
+    if isinstance(residue, CompiledReference):
+        H_idxs = residue.hydrogens
+        heavy_res = residue.heavy_graph
+        residue = residue.graph
+    else:
+#        H_idxs = [idx for idx in residue if residue.node[idx]['element'] == 'H']
+        H_idxs = [idx for idx in residue if residue.degree(idx) == 1]
+        heavy_res = nx.Graph(residue).copy()
+        heavy_res.remove_nodes_from(H_idxs)
 
 #    ref_H_idxs = [idx for idx in reference if reference.degree(idx) == 1]
 #    heavy_ref = nx.Graph(reference).copy()
@@ -220,11 +385,10 @@ def isomorphism(reference, residue):
             if res_neighbor not in reverse_match:
                 continue
             ref_neighbor = reverse_match[res_neighbor]
-            H_names = defaultdict(list)
-            for idx in reference[ref_neighbor]:
-                if reference.degree(idx) == 1:
-                    H_names[reference.nodes[idx]['atomname']].append(idx)
-            H_names = dict(H_names)
+            if compiled_reference is not None:
+                H_names = compiled_reference.hydrogens_by_parent[ref_neighbor]
+            else:
+                H_names = _hydrogen_groups(reference, ref_neighbor)
             res_H_name = residue.nodes[res_H_idx]['atomname']
             if res_H_name in H_names:
                 if len(H_names[res_H_name]) != 1:
@@ -377,6 +541,88 @@ def rate_match(residue, bead, match):
                for rdx, bdx in match.items())
 
 
+class ResidueIndex(namedtuple('ResidueIndex', 'keys residues node_residue adjacency')):
+    """
+    Describes how the atoms of a molecule are grouped in residues.
+
+    Residues are identified by the tuple (chain identifier, residue index,
+    residue name), and are sorted by these identifiers.
+
+    Attributes
+    ----------
+    keys: list[tuple]
+        The (chain, resid, resname) identifier of each residue.
+    residues: list[tuple]
+        The keys of the atoms of each residue, in the order of the nodes.
+    node_residue: dict
+        The index of the residue of each atom.
+    adjacency: list[tuple[int]]
+        The indices of the residues connected to each residue by at least one
+        edge. Neighbours are in the order in which
+        :func:`make_residue_graph` adds them.
+    """
+    __slots__ = ()
+
+    def edges(self):
+        """
+        Iterate over the pairs of connected residues.
+
+        The pairs are yielded in the same order as the edges of the graph
+        built by :func:`make_residue_graph`.
+
+        Yields
+        ------
+        tuple[int, int]
+        """
+        for res_idx, neighbours in enumerate(self.adjacency):
+            for res_jdx in neighbours:
+                if res_jdx > res_idx:
+                    yield res_idx, res_jdx
+
+
+def make_residue_index(mol):
+    """
+    Group the atoms of a molecule in residues, in a single pass over the atoms
+    and the edges.
+
+    :class:`~vermouth.molecule.Molecule` caches the result as
+    :attr:`~vermouth.molecule.Molecule.residue_index`.
+
+    Parameters
+    ----------
+    mol: networkx.Graph
+        The atomistic graph. Required node attributes:
+
+            :chain: The chain identifier.
+            :resid: The residue index.
+            :resname: The residue name.
+
+    Returns
+    -------
+    ResidueIndex
+    """
+    groups = {}
+    for node_idx, node in mol.nodes.items():
+        key = (node['chain'], node['resid'], node['resname'])
+        groups.setdefault(key, []).append(node_idx)
+    keys = sorted(groups)
+    residues = [tuple(groups[key]) for key in keys]
+    node_residue = {
+        node_idx: res_idx
+        for res_idx, residue in enumerate(residues)
+        for node_idx in residue
+    }
+    adjacency = [OrderedDict() for _ in residues]
+    for node_idx, node_jdx in mol.edges:
+        res_idx = node_residue[node_idx]
+        res_jdx = node_residue[node_jdx]
+        if res_idx != res_jdx:
+            adjacency[res_idx][res_jdx] = None
+            adjacency[res_jdx][res_idx] = None
+    adjacency = [tuple(neighbours) for neighbours in adjacency]
+    return ResidueIndex(keys, residues, node_residue, adjacency)
+
+
 def make_residue_graph(mol):
     """
     Creates a graph with one node per residue; as identified by the tuple
@@ -404,19 +650,38 @@ def make_residue_graph(mol):
             :resid: The residue index.
             :resname: The residue name.
             :atomname: The residue name.
+
+    See Also
+    --------
+    make_residue_index
+        Groups the atoms in residues without building the subgraphs.
     """
-    def keyfunc(node_idx):
-        return mol.node[node_idx]['chain'], mol.node[node_idx]['resid'], mol.node[node_idx]['resname']
-    nodes = sorted(mol.node, key=keyfunc)
-    keys = []
-    grps = []
-    for key, grp in itertools.groupby(nodes, keyfunc):
-        keys.append(key)
-        grps.append(list(grp))
-    if keys:
-        chain, resids, resnames = map(list, zip(*keys))
-    else:
-        chain, resids, resnames = [], [], []
-    res_graph = blockmodel(mol, grps, chain=chain, resid=resids,
-                           resname=resnames, atomname=resnames)
+    index = getattr(mol, 'residue_index', None)
+    if index is None:
+        index = make_residue_index(mol)
+    # This builds the same graph as blockmodel, but reuses the partition
+    # from the index rather than testing every edge against the residues.
+    res_graph = nx.Graph()
+    for res_idx, ((chain, resid, resname), residue) in enumerate(zip(index.keys, index.residues)):
+        subgraph = mol.subgraph(residue)
+        res_graph.add_node(
+            res_idx,
+            graph=subgraph,
+            chain=chain,
+            resid=resid,
+            resname=resname,
+            atomname=resname,
+            nnodes=subgraph.number_of_nodes(),
+            nedges=subgraph.number_of_edges(),
+            density=nx.density(subgraph),
+        )
+    for node_idx, node_jdx, weight in mol.edges(data='weight', default=1.0):
+        res_idx = index.node_residue[node_idx]
+        res_jdx = index.node_residue[node_jdx]
+        if res_idx == res_jdx:
+            continue
+        if res_graph.has_edge(res_idx, res_jdx):
+            res_graph[res_idx][res_jdx]['weight'] += weight
+        else:
+            res_graph.add_edge(res_idx, res_jdx, weight=weight)
     return res_graph
@@ -20,8 +20,11 @@ Read force field to force field mappings.
 
 from pathlib import Path
 import collections
+import os
 import itertools
 
+from .cache import load_cached
+
 
 def read_mapping_file(lines):
     """
@@ -304,6 +307,9 @@ def read_mapping_directory(directory):
     atom names in the origin force field and the values are lists of names in
     the destination force field.
 
+    The parsed mappings are read through the cache of parsed files, see
+    :mod:`vermouth.cache`.
+
     Parameters
     ----------
     directory: str
@@ -318,8 +324,30 @@ def read_mapping_directory(directory):
     directory = Path(directory)
     if not directory.is_dir():
         raise NotADirectoryError('"{}" is not a directory.'.format(directory))
+    paths = list(directory.glob('**/*.map'))
+    return load_cached(
+        'mappings:' + os.path.abspath(str(directory)),
+        [str(path) for path in paths],
+        lambda: _read_mapping_files(paths),
+    )
+
+
+def _read_mapping_files(paths):
+    """
+    Read and combine the mappings from a list of files.
+
+    Parameters
+    ----------
+    paths: list[pathlib.Path]
+        The mapping files to read, in order.
+
+    Returns
+    -------
+    dict
+        A collection of mappings.
+    """
     mappings = collections.defaultdict(lambda: collections.defaultdict(dict))
-    for path in directory.glob('**/*.map'):
+    for path in paths:
         with open(str(path)) as infile:
             try:
                 new_mappings = read_mapping_file(infile)
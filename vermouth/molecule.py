@@ -14,6 +14,7 @@
 # limitations under the License.
 
 from collections import defaultdict, OrderedDict, namedtuple
+from collections.abc import Mapping, MutableMapping
 import copy
 from functools import partial
 
@@ -27,6 +28,21 @@ from . import geometry
 Interaction = namedtuple('Interaction', 'atoms parameters meta')
 DeleteInteraction = namedtuple('DeleteInteraction',
                                'atoms atom_attrs parameters meta')
+MoleculeSummary = namedtuple('MoleculeSummary',
+                             'resnames chains n_atoms')
+MoleculeSummary.__doc__ = """
+Molecule-level description of the atoms of a molecule.
+
+Attributes
+----------
+resnames: frozenset
+    The residue names of the atoms, including ``None`` if an atom has no
+    residue name.
+chains: frozenset
+    The chains of the atoms, including ``None`` if an atom has no chain.
+n_atoms: int
+    The number of atoms.
+"""
 
 
 class LinkPredicate:
@@ -303,6 +319,268 @@ class ParamDihedralPhase(LinkParameterEffector):
         return np.degrees(angle)
 
 
+def _interaction_version(interaction):
+    return interaction.meta.get('version', 0)
+
+
+def _remove_identical(sequence, item):
+    """
+    Remove the first element of a list that *is* the given item.
+
+    Interactions are compared by identity rather than equality as distinct
+    interactions can be equal.
+    """
+    for idx, element in enumerate(sequence):
+        if element is item:
+            del sequence[idx]
+            return
+
+
+class _InteractionIndex:
+    """
+    Secondary index over a list of interactions of a given type.
+
+    The index gives access to the interactions involving given atoms in a given
+    order, to the interactions involving a given atom, and to the position of
+    an interaction in the list. It is kept in sync by the methods of
+    :class:`Molecule`. Interactions appended directly to the list are indexed
+    the next time :meth:`sync` is called, any other direct modification of the
+    list that changes its length requires the index to be rebuilt.
+
+    Parameters
+    ----------
+    interactions: list[Interaction]
+        The indexed list of interactions. The index keeps a reference to it.
+    """
+    def __init__(self, interactions):
+        self.interactions = interactions
+        self.by_atoms = defaultdict(list)
+        self.by_atom = defaultdict(list)
+        self.length = 0
+        self._positions = None
+        self.sync(interactions)
+
+    def sync(self, interactions):
+        """
+        Index the interactions that were appended to the list.
+
+        Parameters
+        ----------
+        interactions: list[Interaction]
+            The current list of interactions for the type.
+
+        Returns
+        -------
+        bool
+            ``False`` if the index cannot be updated and must be rebuilt
+            because the list got replaced or shortened.
+        """
+        if interactions is not self.interactions or len(interactions) < self.length:
+            return False
+        for position in range(self.length, len(interactions)):
+            interaction = interactions[position]
+            self._add(interaction)
+            if self._positions is not None:
+                self._positions[id(interaction)] = position
+        self.length = len(interactions)
+        return True
+
+    def _add(self, interaction):
+        atoms = tuple(interaction.atoms)
+        self.by_atoms[atoms].append(interaction)
+        for atom in set(atoms):
+            self.by_atom[atom].append(interaction)
+
+    def _discard(self, interaction):
+        atoms = tuple(interaction.atoms)
+        _remove_identical(self.by_atoms[atoms], interaction)
+        if not self.by_atoms[atoms]:
+            del self.by_atoms[atoms]
+        for atom in set(atoms):
+            _remove_identical(self.by_atom[atom], interaction)
+            if not self.by_atom[atom]:
+                del self.by_atom[atom]
+
+    def position(self, interaction):
+        """
+        Get the position of an indexed interaction in the list.
+        """
+        if self._positions is not None:
+            position = self._positions.get(id(interaction))
+            # Identifiers are not preserved when the molecule is copied or
+            # pickled, so we make sure the position is still correct.
+            if (position is not None and position < len(self.interactions)
+                    and self.interactions[position] is interaction):
+                return position
+        self._positions = {
+            id(indexed): position
+            for position, indexed in enumerate(self.interactions)
+        }
+        return self._positions[id(interaction)]
+
+    def replace(self, old, new):
+        """
+        Replace an interaction in place by one involving the same atoms.
+        """
+        position = self.position(old)
+        self.interactions[position] = new
+        atoms = tuple(old.atoms)
+        buckets = [self.by_atoms[atoms]] + [self.by_atom[atom] for atom in set(atoms)]
+        for bucket in buckets:
+            for idx, element in enumerate(bucket):
+                if element is old:
+                    bucket[idx] = new
+                    break
+        del self._positions[id(old)]
+        self._positions[id(new)] = position
+
+    def remove(self, interaction):
+        """
+        Remove an indexed interaction from the list.
+        """
+        del self.interactions[self.position(interaction)]
+        self._discard(interaction)
+        self.length -= 1
+        self._positions = None
+
+    def remove_many(self, interactions):
+        """
+        Remove several indexed interactions from the list in one pass.
+        """
+        to_remove = {id(interaction) for interaction in interactions}
+        if not to_remove:
+            return
+        self.interactions[:] = [
+            interaction for interaction in self.interactions
+            if id(interaction) not in to_remove
+        ]
+        for interaction in interactions:
+            self._discard(interaction)
+        self.length = len(self.interactions)
+        self._positions = None
+
+
+class _MutationCounter:
+    """
+    Counts the modifications of the atoms of a molecule.
+    """
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+
+class _NodeAttributes(dict):
+    """
+    Node attribute dictionary that reports its modifications to the molecule
+    it belongs to.
+
+    Only the modifications of the dictionary itself are counted; modifying a
+    mutable value in place, such as a position array, is not.
+    """
+    __slots__ = ('_counter',)
+
+    def __init__(self, counter=None):
+        super().__init__()
+        self._counter = counter
+
+    def _modified(self):
+        # The slot is not set yet while a pickled dictionary is filled.
+        counter = getattr(self, '_counter', None)
+        if counter is not None:
+            counter.count += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._modified()
+
+    def update(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        super().update(*args, **kwargs)
+        self._modified()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._modified()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):  # pylint: disable=arguments-differ
+        self._modified()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._modified()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self._modified()
+
+    def __copy__(self):
+        # Like dict.copy, a copy is a plain dictionary that does not belong to
+        # any molecule.
+        return dict(self)
+
+    def __reduce__(self):
+        return (_restore_node_attributes, (self._counter, dict(self)))
+
+
+def _restore_node_attributes(counter, attributes):
+    node_attributes = _NodeAttributes(counter)
+    dict.update(node_attributes, attributes)
+    return node_attributes
+
+
+def _summarize(molecule):
+    """
+    Build the :class:`MoleculeSummary` of a molecule.
+    """
+    nodes = molecule.nodes
+    return MoleculeSummary(
+        resnames=frozenset(node.get('resname') for node in nodes.values()),
+        chains=frozenset(node.get('chain') for node in nodes.values()),
+        n_atoms=len(nodes),
+    )
+
+
+def _copy_graph_data(molecule, source):
+    """
+    Set copies of the nodes, edges, and interactions of `source` to `molecule`.
+
+    The copy is equivalent to :meth:`Molecule.subgraph` with all the nodes,
+    but the edges keep their order.
+    """
+    nodes = molecule.node_dict_factory()
+    adjacency = molecule.adjlist_outer_dict_factory()
+    for key, attributes in source._node.items():
+        node = molecule.node_attr_dict_factory()
+        node.update(attributes)
+        nodes[key] = node
+        adjacency[key] = molecule.adjlist_inner_dict_factory()
+    for key, neighbors in source._adj.items():
+        for neighbor, edge in neighbors.items():
+            # Both directions of an edge share the same attribute dictionary.
+            edge_copy = adjacency[neighbor].get(key)
+            if edge_copy is None:
+                edge_copy = molecule.edge_attr_dict_factory()
+                edge_copy.update(edge)
+            adjacency[key][neighbor] = edge_copy
+    interactions = defaultdict(list)
+    for interaction_type, interactions_of_type in source.interactions.items():
+        kept = [
+            interaction for interaction in interactions_of_type
+            if all(atom in nodes for atom in interaction.atoms)
+        ]
+        if kept:
+            interactions[interaction_type] = kept
+    molecule._node = nodes
+    molecule._adj = adjacency
+    molecule.interactions = interactions
+
+
 class Molecule(nx.Graph):
     """
     Represents a molecule as per a specific force field. Consists of atoms
@@ -316,8 +594,14 @@ class Molecule(nx.Graph):
         self.meta = kwargs.pop('meta', {})
         self._force_field = kwargs.pop('force_field', None)
         self.nrexcl = kwargs.pop('nrexcl', None)
+        self._mutations = _MutationCounter()
+        self._edge_mutations = 0
+        self._summary = None
+        self._residue_index = None
+        self.node_attr_dict_factory = partial(_NodeAttributes, self._mutations)
         super().__init__(*args, **kwargs)
         self.interactions = defaultdict(list)
+        self._interaction_indices = {}
 
     @property
     def force_field(self):
@@ -347,20 +631,77 @@ class Molecule(nx.Graph):
             node_attr = self.node[node]
             yield node, node_attr
 
+    @property
+    def summary(self):
+        """
+        Residue names and chains of the atoms of the molecule.
+
+        The summary is computed once, and computed again only after atoms
+        are added or removed, or after atom attributes are set or deleted.
+        Positions are left out: an array can be modified in place without the
+        molecule noticing.
+
+        Returns
+        -------
+        MoleculeSummary
+        """
+        count = self._mutations.count
+        if self._summary is None or self._summary[0] != count:
+            self._summary = (count, _summarize(self))
+        return self._summary[1]
+
+    @property
+    def residue_index(self):
+        """
+        How the atoms are grouped in residues.
+
+        The index is built once, and built again only after atoms or edges
+        are added or removed, or after atom attributes are set or deleted.
+
+        Returns
+        -------
+        vermouth.graph_utils.ResidueIndex
+
+        See Also
+        --------
+        vermouth.graph_utils.make_residue_index
+        """
+        state = (self._mutations.count, self._edge_mutations)
+        if self._residue_index is None or self._residue_index[0] != state:
+            self._residue_index = (state, graph_utils.make_residue_index(self))
+        return self._residue_index[1]
+
     def copy(self):
         """
         Creates a copy of the molecule.
 
+        The attributes of the atoms and edges, and the lists of interactions
+        are copied; the interactions themselves are shared. Unlike
+        :meth:`subgraph`, the edges keep their order.
+
+        The copy is made right away, in a single pass over the atoms, edges,
+        and interactions; its cost in time and memory grows with the size of
+        the molecule. Nothing is shared with the original molecule but the
+        attribute values and the interactions.
+
         Returns
         -------
         Molecule
         """
-        return self.subgraph(self.nodes)
+        new = self.__class__()
+        new.meta = copy.copy(self.meta)
+        new._force_field = self._force_field
+        new.nrexcl = self.nrexcl
+        _copy_graph_data(new, self)
+        return new
 
     def subgraph(self, nodes):
         """
         Creates a subgraph from the molecule.
 
+        The interactions involving only atoms of the subgraph are found with
+        the per-atom index of the interactions, so the cost depends on the
+        size of the subgraph rather than on the size of the molecule.
 
         Returns
         -------
@@ -383,10 +724,21 @@ class Molecule(nx.Graph):
         #]
         subgraph.add_edges_from(self.edges_between(nodes, nodes, data=True))
 
-        for interaction_type, interactions in self.interactions.items():
-            for interaction in interactions:
-                if all(atom in nodes for atom in interaction.atoms):
-                    subgraph.interactions[interaction_type].append(interaction)
+        for interaction_type in self.interactions:
+            index = self._interaction_index(interaction_type)
+            # Each interaction is found from its first atom, so interactions
+            # are listed once even if they involve several atoms of the
+            # subgraph.
+            interactions = [
+                interaction
+                for node in nodes
+                for interaction in index.by_atom.get(node, ())
+                if interaction.atoms[0] == node
+                and all(atom in nodes for atom in interaction.atoms)
+            ]
+            if interactions:
+                interactions.sort(key=index.position)
+                subgraph.interactions[interaction_type] = interactions
 
         return subgraph
 
@@ -448,13 +800,14 @@ class Molecule(nx.Graph):
         """
         if meta is None:
             meta = {}
-        for idx, interaction in enumerate(self.interactions[type_]):
-            if (interaction.atoms == tuple(atoms)
-                    and interaction.meta.get('version', 0) == meta.get('version', 0)):
+        atoms = tuple(atoms)
+        index = self._interaction_index(type_)
+        for interaction in index.by_atoms.get(atoms, []):
+            if _interaction_version(interaction) == meta.get('version', 0):
                 new_interaction = Interaction(
-                    atoms=tuple(atoms), parameters=parameters, meta=meta,
+                    atoms=atoms, parameters=parameters, meta=meta,
                 )
-                self.interactions[type_][idx] = new_interaction
+                index.replace(interaction, new_interaction)
                 break
         else:  # no break
             self.add_interaction(type_, atoms, parameters, meta)
@@ -495,15 +848,15 @@ class Molecule(nx.Graph):
         KeyError
             If the specified interaction could not be found
         """
-        idx = 0
-        for idx, interaction in enumerate(self.interactions[type_]):
-            if interaction.atoms == atoms and interaction.meta.get('version', 0):
+        index = self._interaction_index(type_)
+        for interaction in index.by_atoms.get(tuple(atoms), []):
+            if _interaction_version(interaction) == version:
+                index.remove(interaction)
                 break
         else:  # no break
             msg = ("Can't find interaction of type {} between atoms {} "
                    "and with version {}")
             raise KeyError(msg.format(type_, atoms, version))
-        del self.interactions[type_][idx]
 
     def remove_matching_interaction(self, type_, template_interaction):
         """
@@ -519,13 +872,34 @@ class Molecule(nx.Graph):
         --------
         :func:`interaction_match`
         """
-        for idx, interaction in enumerate(self.interactions[type_]):
+        index = self._interaction_index(type_)
+        candidates = index.by_atoms.get(tuple(template_interaction.atoms), [])
+        for interaction in candidates:
             if interaction_match(self, interaction, template_interaction):
-                del self.interactions[type_][idx]
+                index.remove(interaction)
                 break
         else:  # no break
             raise ValueError('Cannot find a matching interaction.')
 
+    def _interaction_index(self, type_):
+        """
+        Get the up to date secondary index for an interaction type.
+
+        Parameters
+        ----------
+        type_: collections.abc.Hashable
+
+        Returns
+        -------
+        _InteractionIndex
+        """
+        interactions = self.interactions[type_]
+        index = self._interaction_indices.get(type_)
+        if index is None or not index.sync(interactions):
+            index = _InteractionIndex(interactions)
+            self._interaction_indices[type_] = index
+        return index
+
     def find_atoms(self, **attrs):
         """
         Yields all indices of atoms that match `attrs`
@@ -577,19 +951,58 @@ class Molecule(nx.Graph):
         dict
             A dict mapping the node indices of the added `molecule` to their
             new indices in this molecule.
+
+        See Also
+        --------
+        :meth:`merge_molecules`
         """
-        if self.force_field != molecule.force_field:
-            raise ValueError(
-                'Cannot merge molecules with different force fields.'
-            )
-        if self.nrexcl is None and not self:
-            self.nrexcl = molecule.nrexcl
-        if self.nrexcl != molecule.nrexcl:
-            raise ValueError(
-                'Cannot merge molecules with different nrexcl. '
-                'This molecule has nrexcl={}, while the other has nrexcl={}.'
-                .format(self.nrexcl, molecule.nrexcl)
-            )
+        return self.merge_molecules([molecule])[0]
+
+    def merge_molecules(self, molecules):
+        """
+        Add the atoms and the interactions of several molecules at the end of
+        this one.
+
+        The result is the same as calling :meth:`merge_molecule` for each
+        molecule in turn, but the offsets are computed once for all the
+        molecules and the nodes, edges, and interactions are added in bulk.
+        The molecules are all validated before this molecule is modified.
+
+        Parameters
+        ----------
+        molecules: collections.abc.Iterable[Molecule]
+            The molecules to merge at the end, in order.
+
+        Returns
+        -------
+        list[dict]
+            For each molecule, a dict mapping its node indices to their new
+            indices in this molecule.
+
+        Raises
+        ------
+        ValueError
+            If a molecule has a different force field, or a different nrexcl.
+        """
+        molecules = list(molecules)
+        nrexcl = self.nrexcl
+        is_empty = not self
+        for molecule in molecules:
+            if self.force_field != molecule.force_field:
+                raise ValueError(
+                    'Cannot merge molecules with different force fields.'
+                )
+            if nrexcl is None and is_empty:
+                nrexcl = molecule.nrexcl
+            if nrexcl != molecule.nrexcl:
+                raise ValueError(
+                    'Cannot merge molecules with different nrexcl. '
+                    'This molecule has nrexcl={}, while the other has nrexcl={}.'
+                    .format(nrexcl, molecule.nrexcl)
+                )
+            is_empty = is_empty and not molecule
+        self.nrexcl = nrexcl
+
         if self.nodes():
             # We assume that the last id is always the largest.
             last_node_idx = max(self)
@@ -600,22 +1013,47 @@ class Molecule(nx.Graph):
             offset = 0
             residue_offset = 0
             offset_charge_group = 0
-        correspondence = {}
-        for idx, node in enumerate(molecule.nodes(), start=offset + 1):
-            correspondence[node] = idx
-            new_atom = copy.copy(molecule.nodes[node])
-            new_atom['resid'] = (new_atom.get('resid', 1) + residue_offset)
-            new_atom['charge_group'] = (new_atom.get('charge_group', 1)
-                                        + offset_charge_group)
-            self.add_node(idx, **new_atom)
-        for name, interactions in molecule.interactions.items():
-            for interaction in interactions:
-                atoms = tuple(correspondence[atom] for atom in interaction.atoms)
-                self.add_interaction(name, atoms, interaction.parameters, interaction.meta)
-        for node1, node2 in molecule.edges:
-            if correspondence[node1] != correspondence[node2]:
-                self.add_edge(correspondence[node1], correspondence[node2])
-        return correspondence
+
+        correspondences = []
+        new_nodes = []
+        new_edges = []
+        for molecule in molecules:
+            correspondence = {}
+            new_atom = None
+            for idx, node in enumerate(molecule.nodes(), start=offset + 1):
+                correspondence[node] = idx
+                new_atom = copy.copy(molecule.nodes[node])
+                new_atom['resid'] = (new_atom.get('resid', 1) + residue_offset)
+                new_atom['charge_group'] = (new_atom.get('charge_group', 1)
+                                            + offset_charge_group)
+                new_nodes.append((idx, new_atom))
+            if new_atom is not None:
+                # The last atom of this molecule is the reference for the
+                # offsets of the next one.
+                offset += len(correspondence)
+                residue_offset = new_atom['resid']
+                offset_charge_group = new_atom['charge_group']
+            for name, interactions in molecule.interactions.items():
+                if not interactions:
+                    continue
+                self.interactions[name].extend(
+                    Interaction(
+                        atoms=tuple(correspondence[atom] for atom in interaction.atoms),
+                        parameters=interaction.parameters,
+                        meta=interaction.meta,
+                    )
+                    for interaction in interactions
+                )
+            new_edges.extend(
+                (correspondence[node1], correspondence[node2])
+                for node1, node2 in molecule.edges
+                if correspondence[node1] != correspondence[node2]
+            )
+            correspondences.append(correspondence)
+
+        self.add_nodes_from(new_nodes)
+        self.add_edges_from(new_edges)
+        return correspondences
 
     def share_moltype_with(self, other):
         """
@@ -642,8 +1080,7 @@ class Molecule(nx.Graph):
         -------
         collections.abc.Generator
         """
-        residue_graph = graph_utils.make_residue_graph(self)
-        return (tuple(residue_graph.nodes[res]['graph'].nodes) for res in residue_graph.nodes)
+        return iter(self.residue_index.residues)
 
     def edges_between(self, n_bunch1, n_bunch2, data=False):
         """
@@ -673,6 +1110,26 @@ class Molecule(nx.Graph):
                 else:
                     yield (node1, node2, self.edges[node1, node2])
 
+    def _remove_interactions_with_nodes(self, nodes):
+        """
+        We find the interactions where the atoms to be deleted are present
+        using the interaction index, and remove them. Further we also delete
+        the entire interaction_type if it is empty after all the necessary
+        interactions have been deleted.
+        """
+        for name in list(self.interactions):
+            index = self._interaction_index(name)
+            to_remove = {}
+            for node in nodes:
+                for interaction in index.by_atom.get(node, []):
+                    to_remove[id(interaction)] = interaction
+            index.remove_many(list(to_remove.values()))
+
+        for interaction_type in list(self.interactions):
+            if not self.interactions[interaction_type]:
+                self.interactions.pop(interaction_type)
+                self._interaction_indices.pop(interaction_type, None)
+
     def _remove_interactions_with_node(self, node):
         """
         We iterate through the different interactions we have and
@@ -680,14 +1137,7 @@ class Molecule(nx.Graph):
         Further we also delete the entire interaction_type if it is
         empty after all the necessary interactions have been deleted.
         """
-        for name, interactions in self.interactions.items():
-            for interaction in interactions:
-                if node in interaction.atoms:
-                    self.interactions[name].remove(interaction)
-
-        for interaction_type in list(self.interactions):
-            if not self.interactions[interaction_type]:
-                self.interactions.pop(interaction_type)
+        self._remove_interactions_with_nodes([node])
 
     def remove_node(self, node):
         """
@@ -697,6 +1147,7 @@ class Molecule(nx.Graph):
         get deleted.
         """
         super().remove_node(node)
+        self._mutations.count += 1
         self._remove_interactions_with_node(node)
 
     def remove_nodes_from(self, nodes):
@@ -706,9 +1157,32 @@ class Molecule(nx.Graph):
         interactions list separately which is not a part of
         the graph and hence does not get deleted.
         """
+        nodes = list(nodes)
         super().remove_nodes_from(nodes)
-        for node in nodes:
-            self._remove_interactions_with_node(node)
+        self._mutations.count += 1
+        self._remove_interactions_with_nodes(nodes)
+
+    def clear(self):
+        super().clear()
+        self._mutations.count += 1
+        self._edge_mutations += 1
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        super().add_edge(u_of_edge, v_of_edge, **attr)
+        self._edge_mutations += 1
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        super().add_edges_from(ebunch_to_add, **attr)
+        self._edge_mutations += 1
+
+    def remove_edge(self, u, v):
+        super().remove_edge(u, v)
+        self._edge_mutations += 1
+
+    def remove_edges_from(self, ebunch):
+        super().remove_edges_from(ebunch)
+        self._edge_mutations += 1
+
 
 class Block(Molecule):
     """
@@ -997,6 +1471,192 @@ class Link(Block):
         self._apply_to_all_nodes = {}
 
 
+class _LazyNodeAttributes(MutableMapping):
+    """
+    Attributes of a node of a :class:`LazySubgraph`.
+
+    The attributes are read from the source molecule, or from the snapshot,
+    as long as the subgraph is not built. Modifying them builds the subgraph
+    first, so the source molecule is never modified.
+    """
+    __slots__ = ('_lazy', '_key')
+
+    def __init__(self, lazy, key):
+        self._lazy = lazy
+        self._key = key
+
+    def _attributes(self):
+        return self._lazy._node_attributes(self._key)
+
+    def __getitem__(self, name):
+        return self._attributes()[name]
+
+    def __iter__(self):
+        return iter(self._attributes())
+
+    def __len__(self):
+        return len(self._attributes())
+
+    def __setitem__(self, name, value):
+        self._lazy.materialize().nodes[self._key][name] = value
+
+    def __delitem__(self, name):
+        del self._lazy.materialize().nodes[self._key][name]
+
+    def __repr__(self):
+        return repr(self._attributes())
+
+
+class _SubgraphNodes(Mapping):
+    """
+    View on the node attributes of a :class:`LazySubgraph` that is not built
+    yet.
+
+    Like :attr:`networkx.Graph.nodes`, the view can be called to get the node
+    keys, or the node keys and attributes.
+    """
+    __slots__ = ('_lazy',)
+
+    def __init__(self, lazy):
+        self._lazy = lazy
+
+    def __getitem__(self, key):
+        if key not in self._lazy.node_keys:
+            raise KeyError(key)
+        return _LazyNodeAttributes(self._lazy, key)
+
+    def __iter__(self):
+        return iter(self._lazy.node_keys)
+
+    def __len__(self):
+        return len(self._lazy.node_keys)
+
+    def __call__(self, data=False, default=None):
+        if data is False:
+            return self
+        keys = self._lazy.node_keys
+        if data is True:
+            return [(key, _LazyNodeAttributes(self._lazy, key)) for key in keys]
+        return [(key, self._lazy._node_attributes(key).get(data, default))
+                for key in keys]
+
+
+class LazySubgraph:
+    """
+    Reference to a subgraph of a molecule, built only when it is needed.
+
+    A lazy subgraph is cheap to create: it stores a reference to the source
+    molecule and the keys of the selected nodes. It is mostly used to record
+    where a node comes from under its 'graph' attribute. The node attributes
+    can be read through :attr:`nodes` without building anything; any other
+    attribute, including the private attributes of :class:`networkx.Graph`
+    that networkx functions use, builds the subgraph with
+    :meth:`Molecule.subgraph` the first time it is accessed, and is then read
+    from that subgraph. Modifying a node attribute through :attr:`nodes` also
+    builds the subgraph first, so the source molecule is never modified.
+
+    The source molecule must not be modified after the reference is created,
+    unless `snapshot` is set. Then, the node attributes are copied right away,
+    so that the source nodes can be modified or removed. The edges,
+    interactions, and molecule attributes are still read from the source
+    molecule when the subgraph is built.
+
+    Until the subgraph is built, the reference keeps the source molecule
+    alive. Building the subgraph, for instance with :meth:`materialize`,
+    releases it.
+
+    Parameters
+    ----------
+    source: Molecule
+        The molecule the subgraph is part of.
+    nodes: collections.abc.Iterable
+        The keys of the nodes in the subgraph.
+    snapshot: bool
+        Whether to copy the node attributes immediately.
+
+    Attributes
+    ----------
+    source: Molecule or None
+        The source molecule, or ``None`` once the subgraph is built.
+    node_keys: tuple
+    """
+    __slots__ = ('source', 'node_keys', '_attributes', '_subgraph')
+
+    def __init__(self, source, nodes, snapshot=False):
+        self.source = source
+        self.node_keys = tuple(nodes)
+        self._attributes = None
+        if snapshot:
+            self._attributes = {key: copy.copy(source.nodes[key])
+                                for key in self.node_keys}
+        self._subgraph = None
+
+    @property
+    def nodes(self):
+        """
+        The node attributes of the subgraph.
+        """
+        if self._subgraph is not None:
+            return self._subgraph.nodes
+        return _SubgraphNodes(self)
+
+    def _node_attributes(self, key):
+        if self._subgraph is not None:
+            return self._subgraph.nodes[key]
+        if self._attributes is not None:
+            return self._attributes[key]
+        return self.source.nodes[key]
+
+    def materialize(self):
+        """
+        Build the subgraph if needed.
+
+        Returns
+        -------
+        Molecule
+        """
+        if self._subgraph is None:
+            if self._attributes is None:
+                subgraph = self.source.subgraph(self.node_keys)
+            else:
+                # The snapshot nodes may have been removed from the source
+                # since; they are then kept without their edges.
+                subgraph = self.source.subgraph(
+                    [key for key in self.node_keys if key in self.source]
+                )
+                for key, attributes in self._attributes.items():
+                    if key in subgraph:
+                        subgraph.nodes[key].clear()
+                    subgraph.add_node(key, **attributes)
+            self._subgraph = subgraph
+            self.source = None
+            self._attributes = None
+        return self._subgraph
+
+    def __getattr__(self, name):
+        # Attributes that are not set yet, such as the slots while the object
+        # is unpickled, or special methods looked up on the instance must not
+        # build the subgraph.
+        if name in LazySubgraph.__slots__ or (name.startswith('__') and name.endswith('__')):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __len__(self):
+        return len(self.node_keys)
+
+    def __iter__(self):
+        return iter(self.node_keys)
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+    def __getitem__(self, key):
+        return self.materialize()[key]
+
+    def __repr__(self):
+        return '<{} of {} nodes>'.format(self.__class__.__name__, len(self))
+
+
 def attributes_match(attributes, template_attributes, ignore_keys=()):
     """
     Compare a dict of attributes from a molecule with one from a link.
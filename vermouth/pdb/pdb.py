@@ -17,6 +17,7 @@ Provides functions for reading and writing PDB files.
 """
 
 from functools import partial
+import sys
 
 import numpy as np
 
@@ -239,7 +240,11 @@ def read_pdb(file_name, exclude=('SOL',), ignh=False, model=0):
     idx = 0
 
     field_widths = (-6, 5, -1, 4, 1, 4, 1, 4, 1, -3, 8, 8, 8, 6, 6, -10, 2, 2)
-    field_types = (int, str, str, str, str, int, str, float, float, float, float, float, str, str)
+    # The same names appear many times, so the strings are interned to be
+    # stored only once.
+    field_types = (int, sys.intern, sys.intern, sys.intern, sys.intern, int,
+                   sys.intern, float, float, float, float, float, sys.intern,
+                   sys.intern)
     field_names = ('atomid', 'atomname', 'altloc', 'resname', 'chain', 'resid',
                    'insertion_code', 'x', 'y', 'z', 'occupancy', 'temp_factor',
                    'element', 'charge')
@@ -17,12 +17,11 @@
 Provides a processor that adds interactions from blocks to molecules.
 """
 # TODO: Move all this functionality to do_mapping?
-from collections import ChainMap
-from itertools import product
+from collections import ChainMap, defaultdict
 
 from .processor import Processor
-from ..graph_utils import make_residue_graph
-from ..molecule import Molecule
+from ..graph_utils import make_residue_index
+from ..molecule import LazySubgraph, Molecule
 
 
 def apply_blocks(molecule, blocks):
@@ -47,7 +46,9 @@ def apply_blocks(molecule, blocks):
         force_field=molecule.force_field,
         meta=molecule.meta.copy()
     )
-    residue_graph = make_residue_graph(molecule)
+    residue_index = getattr(molecule, 'residue_index', None)
+    if residue_index is None:
+        residue_index = make_residue_index(molecule)
 
     # nrexcl may not be defined, but if it is we probably want to keep it
     try:
@@ -56,12 +57,11 @@ def apply_blocks(molecule, blocks):
         graph_out.nrexcl = None
 
     old_to_new_idxs = {}
+    # (resid, resname, atomname) -> atoms of graph_out, in order
+    atom_index = defaultdict(list)
     at_idx = 0
     charge_group_offset = 0
-    for res_idx in residue_graph:
-        residue = residue_graph.nodes[res_idx]
-        res_graph = residue['graph']
-        resname = residue['resname']
+    for (_, resid, resname), res_nodes in zip(residue_index.keys, residue_index.residues):
         block = blocks[resname]
         atname_to_idx = {}
 
@@ -74,17 +74,24 @@ def apply_blocks(molecule, blocks):
                     and block.nrexcl != graph_out.nrexcl):
                 raise ValueError('Not all blocks share the same value for "nrexcl".')
 
+        res_atnames = defaultdict(list)
+        for node_idx in res_nodes:
+            res_atnames[molecule.nodes[node_idx].get('atomname')].append(node_idx)
+
         for block_idx in block:
             atname = block.nodes[block_idx]['atomname']
-            atom = list(res_graph.find_atoms(atomname=atname))
+            atom = res_atnames.get(atname, [])
             assert len(atom) == 1, (block.name, atname, atom)
             old_to_new_idxs[atom[0]] = at_idx
             atname_to_idx[atname] = at_idx
             attrs = molecule.nodes[atom[0]]
             graph_out.add_node(at_idx, **ChainMap(block.nodes[atname], attrs))
-            graph_out.nodes[at_idx]['graph'] = molecule.subgraph(atom)
+            graph_out.nodes[at_idx]['graph'] = LazySubgraph(molecule, atom)
             graph_out.nodes[at_idx]['charge_group'] += charge_group_offset
             graph_out.nodes[at_idx]['resid'] = attrs['resid']
+            new_atom = graph_out.nodes[at_idx]
+            atom_index[(new_atom.get('resid'), new_atom.get('resname'),
+                        new_atom.get('atomname'))].append(at_idx)
             at_idx += 1
         charge_group_offset = graph_out.nodes[at_idx - 1]['charge_group']
         for idx, jdx, data in block.edges(data=True):
@@ -95,16 +102,13 @@ def apply_blocks(molecule, blocks):
             for interaction in interactions:
                 atom_idxs = []
                 for atom_name in interaction.atoms:
-                    atom_index = graph_out.find_atoms(atomname=atom_name,
-                                                      resname=residue['resname'],
-                                                      resid=residue['resid'])
-                    atom_index = list(atom_index)
-                    if not atom_index:
+                    atom_key = (resid, resname, atom_name)
+                    if not atom_index.get(atom_key):
                         msg = ('Could not find a atom named "{}" '
                                'with resname being "{}" '
                                'and resid being "{}".')
-                        raise ValueError(msg.format(atom_name, residue['resname'], residue['resid']))
-                    atom_idxs.extend(atom_index)
+                        raise ValueError(msg.format(atom_name, resname, resid))
+                    atom_idxs.extend(atom_index[atom_key])
                 interactions = interaction._replace(atoms=atom_idxs)
                 graph_out.add_interaction(inter_type, *interactions)
 
@@ -112,16 +116,25 @@ def apply_blocks(molecule, blocks):
     # come from the blocks and we need them to find the links locations.
     # TODO This should not be done here, but by do_mapping, which might *also*
     #      do it at the moment
-    for res_idx, res_jdx in residue_graph.edges():
-        for old_idx, old_jdx in product(residue_graph.nodes[res_idx]['graph'],
-                                        residue_graph.nodes[res_jdx]['graph']):
-            try:
-                # Usually termini, PTMs, etc
-                idx = old_to_new_idxs[old_idx]
-                jdx = old_to_new_idxs[old_jdx]
-            except KeyError:
-                continue
-            if molecule.has_edge(old_idx, old_jdx):
+    # The edges are added in the same order as if all the pairs of atoms of
+    # adjacent residues were tested, but only the actual edges are visited.
+    for res_idx, res_jdx in residue_index.edges():
+        res_jdx_atoms = {
+            old_jdx: position
+            for position, old_jdx in enumerate(residue_index.residues[res_jdx])
+        }
+        for old_idx in residue_index.residues[res_idx]:
+            neighbors = sorted(
+                (old_jdx for old_jdx in molecule[old_idx] if old_jdx in res_jdx_atoms),
+                key=res_jdx_atoms.__getitem__,
+            )
+            for old_jdx in neighbors:
+                try:
+                    # Usually termini, PTMs, etc
+                    idx = old_to_new_idxs[old_idx]
+                    jdx = old_to_new_idxs[old_jdx]
+                except KeyError:
+                    continue
                 graph_out.add_edge(idx, jdx)
     return graph_out
 
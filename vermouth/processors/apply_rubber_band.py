@@ -14,13 +14,13 @@
 """
 Provides a processor that adds a rubber band elastic network.
 """
-import itertools
 
 import numpy as np
 import networkx as nx
 
 from .processor import Processor
 from .. import selectors
+from ..utils import ReadOnlyDict
 
 DEFAULT_BOND_TYPE = 6
 
@@ -134,18 +134,18 @@ def build_connectivity_matrix(graph, separation, selection=None):
         # array.
         return nx.to_numpy_matrix(graph, nodelist=selection).astype(bool)
     subgraph = graph.subgraph(selection)
+    node_indices = {key: idx for idx, key in enumerate(subgraph.nodes)}
     connectivity = np.zeros((len(subgraph), len(subgraph)), dtype=bool)
-    for (idx, key_idx), (jdx, key_jdx) in itertools.combinations(enumerate(subgraph.nodes), 2):
-        try:
-            shortest_path = len(nx.shortest_path(subgraph, key_idx, key_jdx))
-        except nx.NetworkXNoPath:
-            # There is no path between key_i and key_j so they are not
-            # connected; which is the default.
-            pass
-        else:
-            # The source and the target are counted in the shortest path
-            connectivity[idx, jdx] = shortest_path <= separation + 2
-            connectivity[jdx, idx] = connectivity[idx, jdx]
+    for key_idx, idx in node_indices.items():
+        # A separation of n nodes is a path of n + 1 edges. Only the
+        # neighbourhood within that distance is explored, rather than
+        # looking for a path between every pair of nodes.
+        lengths = nx.single_source_shortest_path_length(
+            subgraph, key_idx, cutoff=separation + 1
+        )
+        for key_jdx in lengths:
+            if key_jdx != key_idx:
+                connectivity[idx, node_indices[key_jdx]] = True
     return connectivity
 
 
@@ -235,18 +235,21 @@ def apply_rubber_band(molecule, selector,
     # matrix by the oposite (OR) of the connectivity matrix.
     constants *= ~connectivity
     distance_matrix = distance_matrix.round(5)  # For compatibility with legacy
-    for from_idx, to_idx in zip(*np.triu_indices_from(constants)):
-        from_key = selection[from_idx]
-        to_key = selection[to_idx]
-        force_constant = constants[from_idx, to_idx]
-        length = distance_matrix[from_idx, to_idx]
-        if force_constant > minimum_force:
-            molecule.add_interaction(
-                type_='bonds',
-                atoms=(from_key, to_key),
-                parameters=[bond_type, length, force_constant],
-                meta={'group': 'Rubber band'},
-            )
+    # np.nonzero gives the pairs of the upper triangle in the same order as
+    # np.triu_indices_from, but without going through the discarded pairs.
+    from_idxs, to_idxs = np.nonzero(np.triu(constants > minimum_force))
+    # All the bonds of the network share the same meta dictionary, as there
+    # can be many of them. It is read-only so it cannot be modified for all
+    # the bonds by mistake.
+    meta = ReadOnlyDict({'group': 'Rubber band'})
+    for from_idx, to_idx in zip(from_idxs, to_idxs):
+        molecule.add_interaction(
+            type_='bonds',
+            atoms=(selection[from_idx], selection[to_idx]),
+            parameters=[bond_type, distance_matrix[from_idx, to_idx],
+                        constants[from_idx, to_idx]],
+            meta=meta,
+        )
 
 
 class ApplyRubberBand(Processor):
@@ -20,17 +20,22 @@ protonations, and canonicalizes their attributes based on modifications known
 in the forcefield.
 """
 
-from collections import defaultdict
+from collections import defaultdict, Counter
 import itertools
+import weakref
 
 import networkx as nx
 
 from .processor import Processor
 from ..log_helpers import StyleAdapter, get_logger
+from ..molecule import LazySubgraph
 from ..utils import format_atom_string
 
 LOGGER = StyleAdapter(get_logger(__name__))
 
+# Force field -> _ModificationLibrary
+_LIBRARIES = weakref.WeakKeyDictionary()
+
 
 def ptm_node_matcher(node1, node2):
     """
@@ -50,6 +55,81 @@ def ptm_node_matcher(node1, node2):
         return False
 
 
+def _ptm_node_key(node):
+    """
+    Summarize what a node can be matched against by :func:`ptm_node_matcher`.
+
+    Two nodes can only match if they have the same key: PTM atoms are
+    identified by their element, and other atoms by their atom name.
+    """
+    is_ptm = node.get('PTM_atom', False)
+    if is_ptm:
+        return (is_ptm, node.get('element'))
+    return (is_ptm, node.get('atomname'))
+
+
+def _node_histogram(graph):
+    """
+    Count the nodes of a graph per :func:`_ptm_node_key`.
+    """
+    return Counter(_ptm_node_key(node) for node in graph.nodes.values())
+
+
+class _ModificationLibrary:
+    """
+    The modifications of a force field, with the node histograms used to rule
+    them out before any subgraph search.
+
+    The histograms count the PTM atoms of a modification per element, and its
+    anchor atoms per atom name. A modification can only be a subgraph of a
+    residue if the residue has at least as many atoms for every count.
+
+    Parameters
+    ----------
+    modifications: list[vermouth.molecule.Link]
+    """
+    def __init__(self, modifications):
+        self.modifications = modifications
+        self.snapshot = list(modifications)
+        self.histograms = [_node_histogram(modification)
+                           for modification in modifications]
+
+    def is_current(self, modifications):
+        """
+        Tell if the library still describes the given modifications.
+        """
+        return (modifications is self.modifications
+                and len(modifications) == len(self.snapshot)
+                and all(new is old for new, old in zip(modifications, self.snapshot)))
+
+
+def _modification_library(force_field):
+    """
+    Get the compiled modification library of a force field.
+
+    The library is built the first time it is requested for a force field,
+    and rebuilt if the modifications of the force field changed since.
+
+    Parameters
+    ----------
+    force_field: vermouth.forcefield.ForceField
+
+    Returns
+    -------
+    _ModificationLibrary
+    """
+    modifications = force_field.modifications
+    try:
+        library = _LIBRARIES.get(force_field)
+    except TypeError:
+        # The force field cannot be weakly referenced, so it cannot be cached.
+        return _ModificationLibrary(modifications)
+    if library is None or not library.is_current(modifications):
+        library = _ModificationLibrary(modifications)
+        _LIBRARIES[force_field] = library
+    return library
+
+
 def find_ptm_atoms(molecule):
     """
     Finds all atoms in molecule that have the node attribute ``PTM_atom`` set
@@ -160,11 +240,16 @@ def identify_ptms(residue, residue_ptms, known_ptms):
     return _cover_graph(residue, to_cover, known_ptms)
 
 
-def _cover_graph(graph, to_cover, fragments):
+def _cover_graph(graph, to_cover, fragments, fragment_matches=None):
     # BASECASE: to_cover is empty
     if not to_cover:
         return []
 
+    # The matches of a fragment do not depend on what is left to cover, so
+    # they are enumerated only once and shared by all the recursion levels.
+    if fragment_matches is None:
+        fragment_matches = {}
+
     # All non-PTM atoms in residue are always available for matching...
     available = set(n_idx for n_idx in graph
                     if not graph.nodes[n_idx].get('PTM_atom', False))
@@ -175,7 +260,9 @@ def _cover_graph(graph, to_cover, fragments):
     # COMBINATION: add the applied option to the output.
     for idx, option in enumerate(fragments):
         graphlet, matcher = option
-        matches = list(matcher.subgraph_isomorphisms_iter())
+        if matcher not in fragment_matches:
+            fragment_matches[matcher] = list(matcher.subgraph_isomorphisms_iter())
+        matches = fragment_matches[matcher]
         # Matches: [{graph_idxs: fragment_idxs}, {...}, ...]
         for match in matches:
             matching = set(match.keys())
@@ -186,17 +273,21 @@ def _cover_graph(graph, to_cover, fragments):
                 # Continue with the remaining ptm atoms, and try just this
                 # option and all smaller.
                 try:
-                    rest_cover = _cover_graph(graph, to_cover - matching, fragments[idx:])
+                    rest_cover = _cover_graph(graph, to_cover - matching,
+                                              fragments[idx:], fragment_matches)
                 except KeyError:
                     continue
                 return [(graphlet, match)] + rest_cover
     raise KeyError('Could not identify PTM')
 
 
-def allowed_ptms(residue, res_ptms, known_ptms):
+def allowed_ptms(residue, res_ptms, known_ptms, histograms=None):
     """
     Finds all PTMs in ``known_ptms`` which might be relevant for ``residue``.
 
+    PTMs that have more atoms of an element, or more anchors with a given atom
+    name, than ``residue`` are ruled out without a subgraph search.
+
     Parameters
     ----------
     residue : networkx.Graph
@@ -207,19 +298,132 @@ def allowed_ptms(residue, res_ptms, known_ptms):
 
     known_ptms : collections.abc.Iterable[networkx.Graph]
 
+    histograms : collections.abc.Iterable[collections.Counter] or None
+        The node histograms of ``known_ptms``, in the same order, as
+        computed by a :class:`_ModificationLibrary`. Computed if not given.
+
     Yields
     ------
     tuple[networkx.Graph, networkx.isomorphism.GraphMatcher]
         All graphs in known_ptms which are subgraphs of residue.
     """
-    # TODO: filter by element count first
-    for ptm in known_ptms:
+    if histograms is None:
+        histograms = (_node_histogram(ptm) for ptm in known_ptms)
+    residue_histogram = _node_histogram(residue)
+    for ptm, histogram in zip(known_ptms, histograms):
+        if any(residue_histogram[key] < count for key, count in histogram.items()):
+            continue
         ptm_graph_matcher = nx.isomorphism.GraphMatcher(residue, ptm, node_match=ptm_node_matcher)
         if ptm_graph_matcher.subgraph_is_isomorphic():
             yield ptm, ptm_graph_matcher
 
 
-def fix_ptm(molecule):
+def _residue_graph(molecule, ordered_nodes):
+    """
+    Build the graph of a group of residues, with its nodes in a given order.
+
+    The nodes of the graph are in the order of ``ordered_nodes``, and the
+    neighbours of each node follow from that order and from the order of the
+    neighbours in the molecule. Unlike with :meth:`Molecule.subgraph`, the
+    order does not depend on the values of the node keys.
+
+    Parameters
+    ----------
+    molecule : networkx.Graph
+    ordered_nodes : list
+        The nodes of the residues, in a reproducible order.
+
+    Returns
+    -------
+    networkx.Graph
+    """
+    residue = nx.Graph()
+    residue.add_nodes_from(
+        (node, molecule.nodes[node].copy()) for node in ordered_nodes
+    )
+    residue.add_edges_from(
+        (node, neighbor, attrs)
+        for node in ordered_nodes
+        for neighbor, attrs in molecule.adj[node].items()
+        if neighbor in residue
+    )
+    return residue
+
+
+def _residue_signature(residue, ordered_nodes, residue_ptms):
+    """
+    Describe the residues and PTM atoms to identify, up to the node keys.
+
+    Two groups of residues with the same signature have the same PTMs
+    identified, and the matches for one translate to the other through the
+    positions of the nodes in ``ordered_nodes``. The order of the neighbours
+    of each node is part of the signature since the subgraph search finds
+    the matches in that order.
+
+    Parameters
+    ----------
+    residue : networkx.Graph
+        The residues, with their nodes in the order of ``ordered_nodes``, as
+        built by :func:`_residue_graph`.
+    ordered_nodes : list
+        The nodes of ``residue`` in a reproducible order.
+    residue_ptms : list[tuple[set, set]]
+        As returned by ``find_PTM_atoms``, but only those relevant for
+        ``residue``.
+
+    Returns
+    -------
+    tuple or None
+        The signature, or `None` if the PTM atoms are not all in ``residue``.
+    """
+    positions = {node: position for position, node in enumerate(ordered_nodes)}
+    first_resid = residue.nodes[ordered_nodes[0]]['resid']
+    nodes = tuple(
+        (
+            attrs.get('resid') - first_resid,
+            attrs.get('resname'),
+            attrs.get('atomname'),
+            attrs.get('element'),
+            attrs.get('PTM_atom', False),
+            # The neighbours are kept in adjacency order as it drives the
+            # order in which the matches are found.
+            tuple(positions[neighbor] for neighbor in residue[node]),
+        )
+        for node, attrs in ((node, residue.nodes[node]) for node in ordered_nodes)
+    )
+    try:
+        ptms = tuple(
+            (tuple(sorted(positions[idx] for idx in atoms)),
+             tuple(sorted(positions[idx] for idx in anchors)))
+            for atoms, anchors in residue_ptms
+        )
+    except KeyError:
+        return None
+    return nodes, ptms
+
+
+def _identify_residue_ptms(molecule, residue, res_ptms, library, resids, resid_to_idxs):
+    """
+    Identify the PTMs of a group of residues, and log the failures.
+    """
+    options = allowed_ptms(residue, res_ptms, library.modifications,
+                           library.histograms)
+    # TODO/FIXME: This includes anchors in sorting by size.
+    options = sorted(options, key=lambda opt: len(opt[0]), reverse=True)
+    try:
+        return identify_ptms(residue, res_ptms, options)
+    except KeyError:
+        LOGGER.exception('Could not identify the modifications for'
+                         ' residues {}, involving atoms {}',
+                         ['{resname}{resid}'.format(**molecule.nodes[resid_to_idxs[resid][0]])
+                          for resid in sorted(set(resids))],
+                         ['{atomid}-{atomname}'.format(**molecule.nodes[idx])
+                          for idxs in res_ptms for idx in idxs[0]],
+                         type='unknown-input')
+        raise
+
+
+def fix_ptm(molecule, cache=None, cache_stats=None):
     '''
     Canonizes all PTM atoms in molecule, and labels the relevant residues with
     which PTMs were recognized. Modifies ``molecule`` such that atomnames of
@@ -232,6 +436,12 @@ def fix_ptm(molecule):
         Must not have missing atoms, and atomnames must be correct. Atoms which
         could not be recognized must be labeled with the attribute
         PTM_atom=True.
+    cache : dict or None
+        If given, the PTMs identified for a group of residues are stored in
+        it, and reused for the groups of residues with the same signature.
+        The cache can be shared between molecules.
+    cache_stats : collections.Counter or None
+        If given, counts the ``'hits'`` and ``'misses'`` of the cache.
     '''
     ptm_atoms = find_ptm_atoms(molecule)
 
@@ -247,7 +457,9 @@ def fix_ptm(molecule):
         resid_to_idxs[residx].append(n_idx)
     resid_to_idxs = dict(resid_to_idxs)
 
-    known_ptms = molecule.force_field.modifications
+    library = _modification_library(molecule.force_field)
+    if cache_stats is None:
+        cache_stats = Counter()
 
     for resids, res_ptms in itertools.groupby(ptm_atoms, key_func):
         # How to solve this graph covering problem
@@ -265,26 +477,36 @@ def fix_ptm(molecule):
         # option in identify_ptms
 
         res_ptms = list(res_ptms)
-        n_idxs = set()
-        for resid in resids:
-            n_idxs.update(resid_to_idxs[resid])
+        ordered_nodes = []
+        for resid in sorted(set(resids), key=resids.index):
+            ordered_nodes.extend(resid_to_idxs[resid])
+        n_idxs = set(ordered_nodes)
         # TODO: Maybe use graph_utils.make_residue_graph? Or rewrite that
         #       function?
-        residue = molecule.subgraph(n_idxs)
-        options = allowed_ptms(residue, res_ptms, known_ptms)
-        # TODO/FIXME: This includes anchors in sorting by size.
-        options = sorted(options, key=lambda opt: len(opt[0]), reverse=True)
-        try:
-            identified = identify_ptms(residue, res_ptms, options)
-        except KeyError:
-            LOGGER.exception('Could not identify the modifications for'
-                             ' residues {}, involving atoms {}',
-                             ['{resname}{resid}'.format(**molecule.nodes[resid_to_idxs[resid][0]])
-                              for resid in sorted(set(resids))],
-                             ['{atomid}-{atomname}'.format(**molecule.nodes[idx])
-                              for idxs in res_ptms for idx in idxs[0]],
-                             type='unknown-input')
-            raise
+        residue = _residue_graph(molecule, ordered_nodes)
+        signature = None
+        if cache is not None:
+            signature = _residue_signature(residue, ordered_nodes, res_ptms)
+        if signature is not None and (library, signature) in cache:
+            cache_stats['hits'] += 1
+            identified = [
+                (ptm, {ordered_nodes[position]: ptm_idx
+                       for position, ptm_idx in match.items()})
+                for ptm, match in cache[(library, signature)]
+            ]
+        else:
+            identified = _identify_residue_ptms(
+                molecule, residue, res_ptms, library, resids, resid_to_idxs
+            )
+            if signature is not None:
+                cache_stats['misses'] += 1
+                positions = {node: position
+                             for position, node in enumerate(ordered_nodes)}
+                cache[(library, signature)] = [
+                    (ptm, {positions[mol_idx]: ptm_idx
+                           for mol_idx, ptm_idx in match.items()})
+                    for ptm, match in identified
+                ]
         # Why this mess? There can be multiple PTMs for a single (set of)
         # residue(s); and a single PTM can span multiple residues.
         LOGGER.info("Identified the modifications {} on residues {}",
@@ -299,7 +521,7 @@ def fix_ptm(molecule):
                 # non PTM atoms attributes need to change.
                 # Nodes with 'replace': {'atomname': None} will be removed.
                 if ptm_node['PTM_atom'] or 'replace' in ptm_node:
-                    mol_node['graph'] = molecule.subgraph([mol_idx]).copy()
+                    mol_node['graph'] = LazySubgraph(molecule, [mol_idx], snapshot=True)
                     to_replace = ptm_node.copy()
                     if 'replace' in to_replace:
                         del to_replace['replace']
@@ -325,6 +547,27 @@ def fix_ptm(molecule):
 
 
 class CanonicalizeModifications(Processor):
+    """
+    Identify and canonicalize the PTMs of the molecules.
+
+    The PTMs identified for a group of residues are reused for every other
+    group of residues with the same atoms, bonds, and PTM atoms, across all
+    the molecules processed by the same instance.
+
+    Attributes
+    ----------
+    cache: dict
+        The identified PTMs per residue signature.
+    cache_stats: collections.Counter
+        The number of ``'hits'`` and ``'misses'`` of the cache.
+    """
+    def __init__(self):
+        self.cache = {}
+        self.cache_stats = Counter()
+
     def run_molecule(self, molecule):
-        fix_ptm(molecule)
+        fix_ptm(molecule, cache=self.cache, cache_stats=self.cache_stats)
+        if self.cache_stats:
+            LOGGER.debug('Modification identification cache: {} hits, {} misses.',
+                         self.cache_stats['hits'], self.cache_stats['misses'])
         return molecule
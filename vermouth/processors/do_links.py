@@ -14,14 +14,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from itertools import combinations
+from collections import defaultdict, namedtuple, Counter
 import numbers
 
 import networkx as nx
 from numpy import sign
 
-from ..molecule import attributes_match
+from ..molecule import attributes_match, Choice, LinkPredicate
 from .processor import Processor
+from ..log_helpers import StyleAdapter, get_logger
+
+LOGGER = StyleAdapter(get_logger(__name__))
+
+# Node attributes used to rule out links before trying to match them.
+_PREFILTER_ATTRIBUTES = ('resname', 'atomname', 'secstruct')
+
+# What DoLinks needs to know about a link, computed once per link.
+_CompiledLink = namedtuple('_CompiledLink', 'atomnames requirements')
 
 
 def _atoms_match(node1, node2):
@@ -209,44 +218,223 @@ def match_order(order1, resid1, order2, resid2):
     return True
 
 
-def match_link(molecule, link):
+class _LinkGraphMatcher(nx.isomorphism.GraphMatcher):
+    """
+    Subgraph matcher between a molecule and a link.
+
+    The search is seeded from the given candidate molecule nodes for the link
+    node VF2 starts from (see :func:`_seed_link_node`), and the "order"
+    constraints of the link are checked while a match is being built rather
+    than once it is complete.
+
+    Parameters
+    ----------
+    molecule: networkx.Graph
+    link: vermouth.molecule.Link
+    candidates: collections.abc.Iterable or None
+        Molecule nodes that may match the seed node of the link, in molecule
+        order. If `None`, all the molecule nodes are tried.
+    """
+    def __init__(self, molecule, link, candidates=None):
+        super().__init__(molecule, link, node_match=_atoms_match)
+        self.candidates = candidates
+        self.seed_link_node = _seed_link_node(link)
+
+    def candidate_pairs_iter(self):
+        # VF2 starts by trying one node of the link against every node of the
+        # molecule. Restricting that first step to the candidates keeps the
+        # search local without changing the order of the matches.
+        if self.candidates is not None and not self.core_1:
+            for mol_node in self.candidates:
+                if mol_node in self.G1_nodes:
+                    yield mol_node, self.seed_link_node
+            return
+        yield from super().candidate_pairs_iter()
+
+    def semantic_feasibility(self, G1_node, G2_node):
+        if not super().semantic_feasibility(G1_node, G2_node):
+            return False
+        order = self.G2.nodes[G2_node].get('order')
+        if order is None:
+            return True
+        resid = self.G1.nodes[G1_node]['resid']
+        for mol_node, link_node in self.core_1.items():
+            other_order = self.G2.nodes[link_node].get('order')
+            if other_order is None:
+                continue
+            other_resid = self.G1.nodes[mol_node]['resid']
+            if other_order == order:
+                # All atoms with the same order must be in the same residue.
+                if other_resid != resid:
+                    return False
+            elif not match_order(other_order, other_resid, order, resid):
+                return False
+        return True
+
+
+def _seed_link_node(link):
+    """
+    The link node the VF2 search starts from.
+
+    Depending on the version of networkx, VF2 starts either from the first
+    node of the pattern graph, or from the node with the smallest key. The
+    matcher is asked directly so the matches keep the order networkx gives.
+
+    Returns
+    -------
+    collections.abc.Hashable
+        The key of the seed node, or `None` if the link is empty.
+    """
+    if not link:
+        return None
+    matcher = nx.isomorphism.GraphMatcher(link, link)
+    return next(matcher.candidate_pairs_iter())[1]
+
+
+def _first_node_atomnames(link):
+    """
+    Atom names the seed node of a link can match.
+
+    Returns
+    -------
+    tuple[str] or None
+        The possible atom names, or `None` if the seed node of the link does
+        not constrain the atom name in a way that can be looked up.
+    """
+    if not link:
+        return None
+    atomname = link.nodes[_seed_link_node(link)].get('atomname')
+    if isinstance(atomname, Choice):
+        return tuple(atomname.value)
+    if atomname is None or isinstance(atomname, LinkPredicate):
+        return None
+    return (atomname,)
+
+
+def _index_atomnames(molecule):
+    """
+    Group the molecule nodes by atom name, keeping the molecule order.
+    """
+    index = defaultdict(list)
+    for key, atomname in molecule.nodes(data='atomname'):
+        index[atomname].append(key)
+    return index
+
+
+def _link_requirements(link):
+    """
+    List the attribute values a molecule must contain for a link to match.
+
+    Each node of the link that sets one of the :data:`_PREFILTER_ATTRIBUTES`
+    to a plain value or to a :class:`~vermouth.molecule.Choice` requires at
+    least one node of the molecule to have that value, or one of the choices.
+
+    Returns
+    -------
+    list[tuple[str, frozenset]]
+        The attribute names and the sets of acceptable values.
+    """
+    requirements = set()
+    for attributes in link.nodes.values():
+        for key in _PREFILTER_ATTRIBUTES:
+            value = attributes.get(key)
+            if isinstance(value, Choice):
+                values = value.value
+            elif value is None or isinstance(value, LinkPredicate):
+                continue
+            else:
+                values = (value,)
+            try:
+                requirements.add((key, frozenset(values)))
+            except TypeError:
+                # Unhashable values cannot be looked up.
+                continue
+    return sorted(requirements, key=lambda requirement: len(requirement[1]))
+
+
+def _attribute_values(molecule):
+    """
+    Collect the values the molecule nodes have for the prefilter attributes.
+    """
+    present = {key: set() for key in _PREFILTER_ATTRIBUTES}
+    for attributes in molecule.nodes.values():
+        for key, values in present.items():
+            value = attributes.get(key)
+            if value is not None:
+                try:
+                    values.add(value)
+                except TypeError:
+                    continue
+    return present
+
+
+def _link_can_match(molecule, link, requirements, present):
+    """
+    Tell if a link may match the molecule.
+
+    `False` means the link cannot match the molecule; `True` means the link
+    must be matched to know.
+    """
+    if not attributes_match(molecule.meta, link.molecule_meta):
+        return False
+    return all(not values.isdisjoint(present[key])
+               for key, values in requirements)
+
+
+def _link_candidates(molecule, atomnames, atomname_index):
+    if atomnames is None:
+        return None
+    if len(atomnames) == 1:
+        return atomname_index.get(atomnames[0], [])
+    candidates = set()
+    for atomname in atomnames:
+        candidates.update(atomname_index.get(atomname, []))
+    return [key for key in molecule if key in candidates]
+
+
+def match_link(molecule, link, atomname_index=None, atomnames=None):
+    """
+    Find the matches of a link in a molecule.
+
+    Parameters
+    ----------
+    molecule: vermouth.molecule.Molecule
+    link: vermouth.molecule.Link
+    atomname_index: dict[str, list] or None
+        Molecule nodes grouped by atom name, in molecule order. If provided,
+        only the nodes with a suitable atom name are tried as a match for the
+        seed node of the link.
+    atomnames: tuple[str] or None
+        The atom names the seed node of the link can match, as given by
+        :func:`_first_node_atomnames`. Computed if not provided.
+
+    Yields
+    ------
+    dict
+        The matches as link node keys to molecule node keys.
+    """
     if not attributes_match(molecule.meta, link.molecule_meta):
         return
 
-    GM = nx.isomorphism.GraphMatcher(molecule, link, node_match=_atoms_match)
+    candidates = None
+    if atomname_index is not None:
+        if atomnames is None:
+            atomnames = _first_node_atomnames(link)
+        candidates = _link_candidates(molecule, atomnames, atomname_index)
+    GM = _LinkGraphMatcher(molecule, link, candidates)
 
     raw_matches = GM.subgraph_isomorphisms_iter()
     for raw_match in raw_matches:
         # raw_match: mol -> link
         # rev_raw_match: link -> mol
+        # The order constraints are already enforced by the matcher.
         rev_raw_match = {value: key for key, value in raw_match.items()}
         if not _is_valid_non_edges(molecule, link, rev_raw_match):
             continue
         any_pattern_match = _any_pattern_match(molecule, link.patterns, rev_raw_match)
         if link.patterns and (not any_pattern_match):
             continue
-        order_match = {}
-        for mol_idx, link_idx in raw_match.items():
-            mol_node = molecule.nodes[mol_idx]
-            link_node = link.nodes[link_idx]
-            if 'order' in link_node:
-                order = link_node['order']
-                resid = mol_node['resid']
-                if order not in order_match:
-                    order_match[order] = resid
-                # Assert all orders correspond to the same resid
-                elif order in order_match and order_match[order] != resid:
-                    break
-        else:  # No break
-            for ((order1, resid1), (order2, resid2)) in combinations(order_match.items(), 2):
-                # Assert the differences between resids correspond to what
-                # the orders require.
-                if not match_order(order1, resid1, order2, resid2):
-                    break
-            else:  # No break
-                # raw_match is molecule -> link. The other way around is more
-                # useful
-                yield {v: k for k, v in raw_match.items()}
+        yield rev_raw_match
 
 
 def _build_link_interaction_from(molecule, interaction, match):
@@ -263,11 +451,50 @@ def _build_link_interaction_from(molecule, interaction, match):
 
 
 class DoLinks(Processor):
+    """
+    Apply the links of the force field to the molecules.
+
+    Links that cannot match a molecule, because of the molecule meta or
+    because the molecule lacks a residue name, atom name, or secondary
+    structure the link requires, are skipped without being matched.
+
+    Attributes
+    ----------
+    link_counts: collections.Counter
+        How many links were "tested" against the molecules, and how many were
+        "skipped" by the pre-filter.
+    """
+    def __init__(self):
+        # Links are compiled once and reused for every molecule.
+        self._compiled_links = {}
+        self.link_counts = Counter()
+
+    def _compile_link(self, link):
+        try:
+            return self._compiled_links[link]
+        except KeyError:
+            compiled = _CompiledLink(
+                atomnames=_first_node_atomnames(link),
+                requirements=_link_requirements(link),
+            )
+            self._compiled_links[link] = compiled
+            return compiled
+
     def run_molecule(self, molecule):
         links = molecule.force_field.links
         _nodes_to_remove = []
+        atomname_index = None
+        present = _attribute_values(molecule)
+        skipped = 0
         for link in links:
-            matches = match_link(molecule, link)
+            compiled = self._compile_link(link)
+            if not _link_can_match(molecule, link, compiled.requirements, present):
+                skipped += 1
+                continue
+            if atomname_index is None:
+                atomname_index = _index_atomnames(molecule)
+            matches = match_link(molecule, link, atomname_index,
+                                 compiled.atomnames)
             for match in matches:
                 for node, node_attrs in link.nodes.items():
                     if 'replace' in node_attrs:
@@ -276,6 +503,14 @@ class DoLinks(Processor):
                         else:
                             node_mol = molecule.nodes[match[node]]
                             node_mol.update(node_attrs['replace'])
+                            for key, values in present.items():
+                                value = node_attrs['replace'].get(key)
+                                if value is not None:
+                                    values.add(value)
+                            if 'atomname' in node_attrs['replace']:
+                                # Renamed atoms must be looked up under their
+                                # new name by the next links.
+                                atomname_index = None
                 for inter_type, interactions in link.removed_interactions.items():
                     for interaction in interactions:
                         interaction = _build_link_interaction_from(molecule, interaction, match)
@@ -289,4 +524,8 @@ class DoLinks(Processor):
                         molecule.add_or_replace_interaction(inter_type, *interaction)
 
             molecule.remove_nodes_from(_nodes_to_remove)
+        self.link_counts['tested'] += len(links)
+        self.link_counts['skipped'] += skipped
+        LOGGER.debug('Skipped {} out of {} links that cannot match the molecule.',
+                     skipped, len(links))
         return molecule
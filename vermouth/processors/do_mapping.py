@@ -23,7 +23,7 @@ from itertools import product, combinations
 
 import networkx as nx
 
-from ..molecule import Molecule
+from ..molecule import LazySubgraph, Molecule
 from .processor import Processor
 from ..utils import are_all_equal, format_atom_string
 from ..log_helpers import StyleAdapter, get_logger
@@ -288,15 +288,15 @@ def do_mapping(molecule, mappings, to_ff, attribute_keep=()):
                 mol_to_out[mol_idx].append(out_idx)
 
             # Keep track of what bead comes from where
-            subgraph = molecule.subgraph(mol_idxs)
-            graph_out.nodes[out_idx]['graph'] = subgraph
+            graph_out.nodes[out_idx]['graph'] = LazySubgraph(molecule, mol_idxs)
             weights = {block_to_mol[from_idx]: mapping.weights[to_idx][from_idx]
                        for from_idx in from_idxs}
             graph_out.nodes[out_idx]['mapping_weights'] = weights
             # We drop the node keys, since those are not super relevant. We are
             # just interested in values of the node attributes, and whether
             # they're all equal.
-            attrs = {name: list(nx.get_node_attributes(subgraph, name).values())
+            attrs = {name: [molecule.nodes[mol_idx][name] for mol_idx in mol_idxs
+                            if name in molecule.nodes[mol_idx]]
                      for name in attribute_keep}
             for attr, vals in attrs.items():
                 if not are_all_equal(vals):
@@ -46,18 +46,18 @@ def merge_chains(system, chains):
     chains = set(chains)
     merged = Molecule()
     merged._force_field = system.force_field
-    has_merged = False
+    to_merge = []
     new_molecules = []
     for molecule in system.molecules:
         molecule_chains = set(node.get('chain') for node in molecule.nodes.values())
         if molecule_chains.issubset(chains):
-            if not has_merged:
+            if not to_merge:
                 merged.nrexcl = molecule.nrexcl
                 new_molecules.append(merged)
-            merged.merge_molecule(molecule)
-            has_merged = True
+            to_merge.append(molecule)
         else:
             new_molecules.append(molecule)
+    merged.merge_molecules(to_merge)
 
     system.molecules = new_molecules
 
@@ -16,17 +16,220 @@
 """
 Provides a processor that repairs a graph based on a reference.
 """
+import multiprocessing
+
 import networkx as nx
 
 from .processor import Processor
 from ..graph_utils import *
 from ..log_helpers import StyleAdapter, get_logger
+from ..molecule import LazySubgraph
 from ..utils import format_atom_string
 
 LOGGER = StyleAdapter(get_logger(__name__))
 
+# The maximum number of steps of the maximum common subgraph search for a
+# residue. Residues with many equivalent atoms, such as hydrogens, can have
+# a very large number of maximum common subgraphs; the budget keeps the time
+# spent on them to a few seconds at most.
+MCS_MAX_STEPS = 1000000
+
+
+def _compact_residue(residue):
+    """
+    Copy the parts of a residue graph needed to match it against its
+    reference: the connectivity, and the element and atom name of the nodes.
+
+    The copy is cheap to send to an other process. The nodes, and the
+    neighbours of every node, are in the same order as in `residue`, so that
+    matching the copy gives the same result as matching `residue`.
+
+    Parameters
+    ----------
+    residue: networkx.Graph
+
+    Returns
+    -------
+    networkx.Graph
+    """
+    compact = nx.Graph()
+    for idx in residue:
+        node = residue.nodes[idx]
+        compact.add_node(idx, element=node['element'],
+                         atomname=node.get('atomname'))
+    # Graph.add_edge appends to the adjacency of both nodes, which would not
+    # keep the neighbours of every node in the order of `residue`. The
+    # adjacency is filled node by node instead; both directions of an edge
+    # share the same, empty, attribute dict like add_edge does.
+    adjacency = compact._adj
+    for idx, neighbors in residue.adjacency():
+        compact_neighbors = adjacency[idx]
+        for jdx in neighbors:
+            edge_data = adjacency[jdx].get(idx)
+            compact_neighbors[jdx] = {} if edge_data is None else edge_data
+    return compact
+
+
+def _match_residue(resname, residue, compiled_reference):
+    """
+    Find the best ways to match a residue against its reference.
+
+    Parameters
+    ----------
+    resname: str
+        The residue name, used in error messages.
+    residue: networkx.Graph
+        The residue, as produced by :func:`_compact_residue`.
+    compiled_reference: vermouth.graph_utils.CompiledReference
+        The reference for the residue.
+
+    Returns
+    -------
+    matches: list[dict]
+        The best scoring matches, from reference node keys to residue node
+        keys. The list is empty if no match could be found.
+    used_mcs: bool
+        Whether the matches had to be found through a maximum common
+        subgraph.
+    mcs_complete: bool
+        ``False`` if the maximum common subgraph search ran out of steps, so
+        that the matches may not be the best ones.
+
+    Raises
+    ------
+    ValueError
+        The residue and its reference do not have any common subgraph.
+    """
+    reference = compiled_reference.graph
+    used_mcs = False
+    mcs_complete = True
+    # Assume reference >= residue
+    matches = isomorphism(compiled_reference, residue)
+    if not matches:
+        # Maybe reference < residue? I.e. PTM or protonation
+        matches = isomorphism(residue, compiled_reference)
+        matches = [{v: k for k, v in match.items()} for match in matches]
+    if not matches:
+        used_mcs = True
+        # The problem is that some residues (termini in particular) will
+        # contain more atoms than they should according to the reference.
+        # Furthermore they will have too little atoms because X-Ray is
+        # supposedly hard. This means we can't do the subgraph isomorphism
+        # like we're used to. Instead, identify the atoms in the largest
+        # common subgraph, and do the subgraph isomorphism/alignment on
+        # those. MCS is ridiculously expensive, so we only do it when we
+        # have to.
+        mcs_matches, mcs_complete = maximum_common_subgraph(
+            reference, residue, ['element'],
+            max_steps=MCS_MAX_STEPS, return_complete=True,
+        )
+        try:
+            mcs_match = max(mcs_matches,
+                            key=lambda m: rate_match(reference, residue, m))
+        except ValueError:
+            raise ValueError('No common subgraph found between {} and '
+                             'reference {}.'.format(resname, resname))
+        # We could seed the isomorphism calculation with the knowledge from
+        # the mcs_match, but thats to much effort for now.
+        # TODO: see above
+        res = residue.subgraph(mcs_match.values())
+        matches = isomorphism(compiled_reference, res)
+    # TODO: matches is sorted by isomorphism. So we should probably use
+    #       that with e.g. itertools.takewhile.
+    if matches:
+        matches = maxes(matches, key=lambda m: rate_match(reference, residue, m))
+    return matches, used_mcs, mcs_complete
+
+
+# The compiled references available to the worker processes of
+# `make_reference`. They are sent once per worker by `_init_worker` rather
+# than with every residue.
+_WORKER_REFERENCES = {}
+
+
+def _init_worker(compiled_references):
+    _WORKER_REFERENCES.clear()
+    _WORKER_REFERENCES.update(compiled_references)
+
+
+def _match_residue_in_worker(job):
+    resname, residue = job
+    return _match_residue(resname, residue, _WORKER_REFERENCES[resname])
+
+
+def _make_pool(compiled_references, processes):
+    """
+    Start a pool of worker processes to match residues against references.
+
+    Parameters
+    ----------
+    compiled_references: dict[str, vermouth.graph_utils.CompiledReference]
+        The references the workers can match residues against, per residue
+        name.
+    processes: int or None
+        The number of worker processes. With `None`, as many workers as
+        there are CPUs are used.
+
+    Returns
+    -------
+    multiprocessing.pool.Pool
+    """
+    return multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(compiled_references,))
+
 
-def make_reference(mol):
+def _system_references(molecules):
+    """
+    Collect the compiled references for all the residue names in `molecules`.
+
+    Residue names without a reference are left out; :func:`make_reference`
+    reports them when it gets to them.
+
+    Returns
+    -------
+    dict[str, vermouth.graph_utils.CompiledReference]
+    """
+    compiled_references = {}
+    for molecule in molecules:
+        for resname in set(resname for _, resname in molecule.nodes(data='resname')):
+            if resname in compiled_references:
+                continue
+            try:
+                compiled_references[resname] = molecule.force_field.compiled_reference(resname)
+            except KeyError:
+                continue
+    return compiled_references
+
+
+def _match_residues(jobs, compiled_references, pool=None):
+    """
+    Run :func:`_match_residue` for every residue in `jobs`.
+
+    Parameters
+    ----------
+    jobs: list[tuple[str, networkx.Graph]]
+        The residue name and compact residue graph of each residue.
+    compiled_references: dict[str, vermouth.graph_utils.CompiledReference]
+        The reference for each residue name in `jobs`.
+    pool: multiprocessing.pool.Pool or None
+        A pool from :func:`_make_pool` whose workers have the references for
+        every residue name in `jobs`. If `None`, the residues are matched in
+        this process.
+
+    Returns
+    -------
+    list[tuple[list[dict], bool, bool]]
+        The output of :func:`_match_residue` for each job, in order.
+    """
+    if pool is None or len(jobs) < 2:
+        return [_match_residue(resname, residue, compiled_references[resname])
+                for resname, residue in jobs]
+    # Pool.map keeps the order of the jobs, so the outcome does not depend on
+    # the scheduling of the workers.
+    return pool.map(_match_residue_in_worker, jobs)
+
+
+def make_reference(mol, processes=1, pool=None):
     """
     Takes an molecule graph (e.g. as read from a PDB file), and finds and
     returns the graph how it should look like, including all matching nodes
@@ -38,6 +241,16 @@ def make_reference(mol):
         The match between hydrogren atoms need not be perfect. See the
         documentation of ``isomorphism``.
 
+        If a residue is not a subgraph of its reference, nor the other way
+        around, it is matched through a maximum common subgraph. That search
+        is limited to :data:`MCS_MAX_STEPS` steps per residue, after which
+        the largest common subgraphs found so far are used, and a warning is
+        issued.
+
+        The residues are matched independently of each other. With more than
+        one process, the matching is distributed over a pool of worker
+        processes; the result is the same as with a single process.
+
     Parameters
     ----------
     mol : networkx.Graph
@@ -48,6 +261,13 @@ def make_reference(mol):
         :chain: The chain identifier.
         :element: The element.
         :atomname: The atomname.
+    processes : int or None
+        The number of processes used to match the residues against their
+        reference. `None` uses as many processes as there are CPUs. Ignored
+        if `pool` is given.
+    pool : multiprocessing.pool.Pool or None
+        A pool of worker processes to reuse, as started by
+        :func:`_make_pool` with the references of all the residues in `mol`.
 
     Returns
     -------
@@ -66,55 +286,46 @@ def make_reference(mol):
     reference_graph = nx.Graph()
     residues = make_residue_graph(mol)
 
+    # TODO: Merge degree 1 nodes (hydrogens!) with the parent node. And
+    # check whether the node degrees match?
+    compiled_references = {}
+    jobs = []
     for residx in residues:
-        # TODO: make separate function for just one residue.
-        # TODO: multiprocess this loop?
-        # TODO: Merge degree 1 nodes (hydrogens!) with the parent node. And
-        # check whether the node degrees match?
-
+        resname = residues.node[residx]['resname']
+        residue = residues.node[residx]['graph']
+        if resname not in compiled_references:
+            compiled_references[resname] = mol.force_field.compiled_reference(resname)
+        add_element_attr(residue)
+        jobs.append((resname, _compact_residue(residue)))
+
+    if pool is not None or processes == 1:
+        outcomes = _match_residues(jobs, compiled_references, pool)
+    else:
+        pool = _make_pool(compiled_references, processes)
+        try:
+            outcomes = _match_residues(jobs, compiled_references, pool)
+        finally:
+            pool.terminate()
+
+    for residx, (matches, used_mcs, mcs_complete) in zip(residues, outcomes):
         resname = residues.node[residx]['resname']
         resid = residues.node[residx]['resid']
         chain = residues.node[residx]['chain']
         residue = residues.node[residx]['graph']
-        reference = mol.force_field.reference_graphs[resname]
-        add_element_attr(reference)
-        add_element_attr(residue)
-        # Assume reference >= residue
-        matches = isomorphism(reference, residue)
-        if not matches:
-            # Maybe reference < residue? I.e. PTM or protonation
-            matches = isomorphism(residue, reference)
-            matches = [{v: k for k, v in match.items()} for match in matches]
-        if not matches:
-            LOGGER.debug('Doing MCS matching for residue {}{}', resname, resid,
+        reference = compiled_references[resname].graph
+        if used_mcs:
+            LOGGER.debug('Did MCS matching for residue {}{}', resname, resid,
                          type='performance')
-            # The problem is that some residues (termini in particular) will
-            # contain more atoms than they should according to the reference.
-            # Furthermore they will have too little atoms because X-Ray is
-            # supposedly hard. This means we can't do the subgraph isomorphism
-            # like we're used to. Instead, identify the atoms in the largest
-            # common subgraph, and do the subgraph isomorphism/alignment on
-            # those. MCS is ridiculously expensive, so we only do it when we
-            # have to.
-            try:
-                mcs_match = max(maximum_common_subgraph(reference, residue, ['element']),
-                                key=lambda m: rate_match(reference, residue, m))
-            except ValueError:
-                raise ValueError('No common subgraph found between {} and '
-                                 'reference {}.'.format(resname, resname))
-            # We could seed the isomorphism calculation with the knowledge from
-            # the mcs_match, but thats to much effort for now.
-            # TODO: see above
-            res = residue.subgraph(mcs_match.values())
-            matches = isomorphism(reference, res)
-        # TODO: matches is sorted by isomorphism. So we should probably use
-        #       that with e.g. itertools.takewhile.
+        if not mcs_complete:
+            LOGGER.warning('The maximum common subgraph search for residue '
+                           '{}{} stopped after {} steps. Its atoms may not be '
+                           'matched in the best way against the reference.',
+                           resname, resid, MCS_MAX_STEPS, type='performance')
         if not matches:
             LOGGER.error("Can't find isomorphism between {}{} and its "
                          "reference.", resname, resid, type='inconsistent-data')
             continue
 
-        matches = maxes(matches, key=lambda m: rate_match(reference, residue, m))
         if len(matches) > 1:
             LOGGER.warning("More than one way to fit {}{} on it's reference."
                            " I'm picking one arbitrarily. You might want to"
@@ -148,7 +359,7 @@ def repair_residue(molecule, ref_residue, include_graph):
             res_idx = match[ref_idx]
             node = molecule.nodes[res_idx]
             if include_graph:
-                node['graph'] = molecule.subgraph([res_idx])
+                node['graph'] = LazySubgraph(molecule, [res_idx], snapshot=True)
             node.update(reference.nodes[ref_idx])
             # Update found as well to keep found and molecule in line. It would
             # be better to try and figure why found is not a reference, but meh
@@ -286,29 +497,43 @@ def repair_graph(molecule, reference_graph, include_graph=True):
 
 
 class RepairGraph(Processor):
-    def __init__(self, delete_unknown=False, include_graph=True):
+    def __init__(self, delete_unknown=False, include_graph=True, processes=1):
         super().__init__()
         self.delete_unknown = delete_unknown
         self.include_graph=include_graph
+        self.processes = processes
 
-    def run_molecule(self, molecule):
+    def _repair_molecule(self, molecule, pool=None):
         molecule = molecule.copy()
-        reference_graph = make_reference(molecule)
+        reference_graph = make_reference(molecule, processes=self.processes,
+                                         pool=pool)
         repair_graph(molecule, reference_graph, include_graph=self.include_graph)
         return molecule
 
+    def run_molecule(self, molecule):
+        return self._repair_molecule(molecule)
+
     def run_system(self, system):
+        # The worker processes are started once for the whole system, rather
+        # than for every molecule.
+        pool = None
+        if self.processes != 1:
+            pool = _make_pool(_system_references(system.molecules), self.processes)
         mols = []
-        for idx, molecule in enumerate(system.molecules):
-            try:
-                new_molecule = self.run_molecule(molecule)
-            except KeyError as err:
-                if not self.delete_unknown:
-                    raise err
+        try:
+            for idx, molecule in enumerate(system.molecules):
+                try:
+                    new_molecule = self._repair_molecule(molecule, pool)
+                except KeyError as err:
+                    if not self.delete_unknown:
+                        raise err
+                    else:
+                        LOGGER.warning("Cannot recognize residue {} in  molecule {}. "
+                                       "Deleting the molecule.",
+                                       str(err), idx, type='unknown-residue')
                 else:
-                    LOGGER.warning("Cannot recognize residue {} in  molecule {}. "
-                                   "Deleting the molecule.",
-                                   str(err), idx, type='unknown-residue')
-            else:
-                mols.append(new_molecule)
+                    mols.append(new_molecule)
+        finally:
+            if pool is not None:
+                pool.terminate()
         system.molecules = mols
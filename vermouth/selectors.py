@@ -32,7 +32,9 @@ def is_protein(molecule):
     Return True if all the residues in the molecule are protein residues.
 
     The function tests if the residue name of all the atoms in the input
-    molecule are in ``PROTEIN_RESIDUES``.
+    molecule are in ``PROTEIN_RESIDUES``. For a
+    :class:`~vermouth.molecule.Molecule`, the residue names are read from the
+    cached :attr:`~vermouth.molecule.Molecule.summary`.
 
     Parameters
     ----------
@@ -43,6 +45,9 @@ def is_protein(molecule):
     -------
     bool
     """
+    summary = getattr(molecule, 'summary', None)
+    if summary is not None:
+        return summary.resnames <= PROTEIN_RESIDUES
     return all(
         molecule.nodes[n_idx].get('resname') in PROTEIN_RESIDUES
         for n_idx in molecule
@@ -85,6 +90,38 @@ def selector_has_position(atom):
     return position is not None and np.all(np.isfinite(position))
 
 
+def _select_positioned(molecule):
+    """
+    Select the atoms of a molecule that have a position.
+
+    This is :func:`selector_has_position` applied to every atom, with the
+    positions checked all at once. The positions are read at every call, so
+    that arrays modified in place are accounted for.
+
+    Parameters
+    ----------
+    molecule: networkx.Graph
+
+    Returns
+    -------
+    list
+        The keys of the atoms with a position, in the order of the nodes.
+    """
+    keys = []
+    positions = []
+    for key, position in molecule.nodes(data='position'):
+        if position is not None:
+            keys.append(key)
+            positions.append(position)
+    try:
+        positions = np.array(positions, dtype=float)
+    except (TypeError, ValueError):
+        # The positions do not stack in an array of numbers.
+        return [key for key in keys if selector_has_position(molecule.nodes[key])]
+    finite = np.isfinite(positions).reshape(len(keys), -1).all(axis=1)
+    return [key for key, is_finite in zip(keys, finite) if is_finite]
+
+
 def proto_select_attribute_in(node, attribute, values):
     """
     Return True if the given attribute of the node is in a list of values.
@@ -162,6 +199,9 @@ def filter_minimal(molecule, selector):
              filter_minimal(molecule, selector_function)
         )
 
+    :func:`selector_has_position` checks the positions of all the atoms at
+    once rather than one atom at a time.
+
     Parameters
     ----------
     molecule: Molecule
@@ -172,6 +212,9 @@ def filter_minimal(molecule, selector):
     keys:
         Keys of the atoms that match the selection.
     """
+    if selector is selector_has_position:
+        yield from _select_positioned(molecule)
+        return
     for name, atom in molecule.nodes.items():
         if selector(atom):
             yield name
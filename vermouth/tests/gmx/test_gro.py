@@ -581,6 +581,18 @@ def test_read_gro(gro_reference, exclude, ignh):  # pylint: disable=redefined-ou
     assert_molecule_equal(molecule, reference)
 
 
+def test_read_gro_interned(gro_reference):  # pylint: disable=redefined-outer-name
+    """
+    Test that the GRO reader stores each residue and atom name once.
+    """
+    filename, _ = gro_reference
+    molecule = gro.read_gro(filename, exclude=())
+    names = {}
+    for node in molecule.nodes.values():
+        for key in ('resname', 'atomname'):
+            assert names.setdefault(node[key], node[key]) is node[key]
+
+
 def test_read_gro_wrong_atom_number(gro_wrong_length):  # pylint: disable=redefined-outer-name
     """
     Test that the GRO reader raises an exception if the number of atoms is not
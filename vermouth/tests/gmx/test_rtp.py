@@ -0,0 +1,157 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the reading of RTP files.
+"""
+
+import itertools
+import pickle
+import textwrap
+
+import pytest
+
+import vermouth
+import vermouth.forcefield
+from vermouth.gmx import rtp
+
+RTP_TEMPLATE = textwrap.dedent("""
+    [ bondedtypes ]
+    ; bondtype angletype dihedraltype impropertype all_dih nrexcl HH14 bRemoveDih
+         1       5            9            2         {all_dih}       3     1       {remove_dih}
+
+    [ GLY ]
+     [ atoms ]
+        N    NH1   -0.47  0
+        HN   H      0.31  1
+        CA   CT2   -0.02  2
+        HA1  HB     0.09  3
+        HA2  HB     0.09  4
+        C    C      0.51  5
+        O    O     -0.51  6
+     [ bonds ]
+        N    HN
+        N    CA
+        CA   HA1
+        CA   HA2
+        CA   C
+        C    O
+        -C   N
+     [ impropers ]
+        O    CA   C    +N
+""")
+
+
+def _read(all_dih=0, remove_dih=0):
+    force_field = vermouth.forcefield.ForceField(name='test')
+    lines = RTP_TEMPLATE.format(all_dih=all_dih, remove_dih=remove_dih).splitlines()
+    rtp.read_rtp(lines, force_field)
+    return force_field
+
+
+def _dihedral_centers(block):
+    return {tuple(dihedral.atoms[1:-1]): tuple(dihedral.atoms)
+            for dihedral in block.interactions['dihedrals']}
+
+
+def test_generate_dihedrals():
+    """
+    The generated dihedrals are those of Block.guess_dihedrals, grouped by
+    center.
+    """
+    block = _read().blocks['GLY']
+    by_center = rtp._generate_dihedrals(block)
+    expected = {
+        center: list(dihedrals)
+        for center, dihedrals in itertools.groupby(
+            sorted(block.guess_dihedrals(), key=rtp._dihedral_sorted_center),
+            rtp._dihedral_sorted_center
+        )
+    }
+    assert by_center == expected
+
+
+def test_fewest_hydrogens():
+    """
+    Only one dihedral is kept per center, the one with the fewest hydrogens.
+    """
+    block = _read().blocks['GLY']
+    centers = _dihedral_centers(block)
+    assert centers[('CA', 'C')] == ('N', 'CA', 'C', 'O')
+    assert centers[('C', 'CA')] == ('O', 'C', 'CA', 'N')
+    assert len(centers) == len(block.interactions['dihedrals'])
+
+
+@pytest.mark.parametrize('remove_dih, expected', ((0, True), (1, False)))
+def test_remove_dihedrals(remove_dih, expected):
+    """
+    Dihedrals around the center of an improper are removed if requested.
+    """
+    block = _read(remove_dih=remove_dih).blocks['GLY']
+    assert (('CA', 'C') in _dihedral_centers(block)) == expected
+
+
+def test_link_interactions():
+    """
+    The inter-residue interactions end up in the link, referring to the link
+    nodes.
+    """
+    link = _read().links[0]
+    atoms = {
+        name: [
+            tuple((link.nodes[atom]['atomname'], link.nodes[atom]['order'])
+                  for atom in interaction.atoms)
+            for interaction in interactions
+        ]
+        for name, interactions in link.interactions.items()
+    }
+    assert atoms['bonds'] == [(('C', -1), ('N', 0))]
+    assert atoms['impropers'] == [(('O', 0), ('CA', 0), ('C', 0), ('N', 1))]
+    assert sorted(link.nodes) == list(range(len(link)))
+
+
+def test_link_applied():
+    """
+    The links of the universal force field add the inter-residue interactions
+    to a molecule.
+    """
+    force_field = vermouth.forcefield.FORCE_FIELDS['universal']
+    block = force_field.blocks['GLY']
+    molecule = block.to_molecule()
+    molecule.merge_molecules([block.to_molecule(), block.to_molecule()])
+    keys = {(node['resid'], node['atomname']): key
+            for key, node in molecule.nodes.items()}
+    molecule.add_edge(keys[(1, 'C')], keys[(2, 'N')])
+    molecule.add_edge(keys[(2, 'C')], keys[(3, 'N')])
+    molecule = vermouth.DoLinks().run_molecule(molecule)
+    # The link spans the previous and the next residues, so it only matches
+    # around the middle residue.
+    bonds = [interaction.atoms for interaction in molecule.interactions['bonds']]
+    assert (keys[(2, 'C')], keys[(3, 'N')]) in bonds
+    assert [interaction.atoms for interaction in molecule.interactions['cmap']] == [
+        (keys[(1, 'C')], keys[(2, 'N')], keys[(2, 'CA')], keys[(2, 'C')], keys[(3, 'N')])
+    ]
+
+
+def test_pickle():
+    """
+    Force fields read from RTP files can go in the cache of parsed files.
+    """
+    force_field = _read()
+    copied = pickle.loads(pickle.dumps(force_field))
+    block = force_field.blocks['GLY']
+    copied_block = copied.blocks['GLY']
+    assert list(copied_block.nodes(data=True)) == list(block.nodes(data=True))
+    assert copied_block.interactions == block.interactions
+    assert copied.links[0].interactions == force_field.links[0].interactions
@@ -0,0 +1,82 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Test the ApplyBlocks processor.
+"""
+
+import pytest
+
+from vermouth.molecule import Molecule, Block, Interaction
+from vermouth.processors.apply_blocks import apply_blocks
+
+
+@pytest.fixture
+def blocks():
+    """
+    A block with a backbone and a side chain bead, bonded together.
+    """
+    block = Block(name='ALA')
+    block.add_nodes_from((
+        ('BB', {'atomname': 'BB', 'resname': 'ALA', 'charge_group': 1}),
+        ('SC1', {'atomname': 'SC1', 'resname': 'ALA', 'charge_group': 2}),
+    ))
+    block.add_edge('BB', 'SC1')
+    block.interactions['bonds'] = [
+        Interaction(atoms=('BB', 'SC1'), parameters=['1'], meta={}),
+    ]
+    return {'ALA': block}
+
+
+@pytest.fixture
+def molecule():
+    """
+    A linear chain of 3 residues with a BB and a SC1 bead each.
+    """
+    molecule = Molecule()
+    for resid in range(1, 4):
+        bb_key = 10 * resid
+        molecule.add_node(bb_key, atomname='BB', resname='ALA', resid=resid, chain='A')
+        molecule.add_node(bb_key + 1, atomname='SC1', resname='ALA', resid=resid, chain='A')
+        molecule.add_edge(bb_key, bb_key + 1)
+        if resid > 1:
+            molecule.add_edge(bb_key - 10, bb_key)
+    return molecule
+
+
+def test_apply_blocks(molecule, blocks):
+    """
+    The atoms, edges and interactions of the blocks are applied to every
+    residue, and the edges between residues are kept.
+    """
+    graph_out = apply_blocks(molecule, blocks)
+    assert [graph_out.nodes[idx]['atomname'] for idx in graph_out] \
+        == ['BB', 'SC1'] * 3
+    assert [graph_out.nodes[idx]['resid'] for idx in graph_out] == [1, 1, 2, 2, 3, 3]
+    assert [graph_out.nodes[idx]['charge_group'] for idx in graph_out] \
+        == [1, 2, 3, 4, 5, 6]
+    assert sorted(tuple(sorted(edge)) for edge in graph_out.edges) \
+        == [(0, 1), (0, 2), (2, 3), (2, 4), (4, 5)]
+    assert [bond.atoms for bond in graph_out.interactions['bonds']] \
+        == [(0, 1), (2, 3), (4, 5)]
+
+
+def test_apply_blocks_missing_atom(molecule, blocks):
+    """
+    An interaction involving an atom that is not in the block fails.
+    """
+    blocks['ALA'].interactions['angles'] = [
+        Interaction(atoms=('BB', 'SC1', 'SC2'), parameters=[], meta={}),
+    ]
+    with pytest.raises(ValueError):
+        apply_blocks(molecule, blocks)
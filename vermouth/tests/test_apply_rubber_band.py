@@ -0,0 +1,110 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Test the creation of elastic networks.
+"""
+
+import itertools
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import vermouth
+from vermouth.processors import apply_rubber_band as rubber_band
+
+PARAMETERS = {
+    'lower_bound': 0, 'upper_bound': 0.9, 'decay_factor': 0, 'decay_power': 0,
+    'base_constant': 500, 'minimum_force': 0, 'bond_type': 6,
+}
+
+
+def _helix_molecule(n_beads):
+    """
+    A chain of beads along an helix, so that most beads are within the upper
+    bound of many others.
+    """
+    molecule = vermouth.molecule.Molecule()
+    for idx in range(n_beads):
+        angle = np.radians(100 * idx)
+        position = np.array([0.23 * np.cos(angle), 0.23 * np.sin(angle), 0.15 * idx])
+        molecule.add_node(idx, atomname='BB', resname='ALA', resid=idx + 1,
+                          chain='A', position=position)
+        if idx:
+            molecule.add_edge(idx - 1, idx)
+    return molecule
+
+
+def _expected_bonds(molecule, res_min_dist=3):
+    """
+    Build the elastic network pair by pair.
+    """
+    coordinates = np.stack([node['position'] for node in molecule.nodes.values()])
+    distances = rubber_band.self_distance_matrix(coordinates)
+    constants = rubber_band.compute_force_constants(
+        distances, PARAMETERS['lower_bound'], PARAMETERS['upper_bound'],
+        PARAMETERS['decay_factor'], PARAMETERS['decay_power'],
+        PARAMETERS['base_constant'], PARAMETERS['minimum_force'],
+    )
+    keys = list(molecule.nodes)
+    connectivity = rubber_band.build_connectivity_matrix(
+        molecule, res_min_dist - 1, selection=keys
+    )
+    constants *= ~connectivity
+    distances = distances.round(5)
+    return [
+        ((keys[idx], keys[jdx]),
+         [PARAMETERS['bond_type'], distances[idx, jdx], constants[idx, jdx]])
+        for idx, jdx in zip(*np.triu_indices_from(constants))
+        if constants[idx, jdx] > PARAMETERS['minimum_force']
+    ]
+
+
+def test_apply_rubber_band():
+    """
+    The bonds are the pairs close enough, in order, and share their meta.
+    """
+    molecule = _helix_molecule(12)
+    rubber_band.apply_rubber_band(molecule, lambda node: True, **PARAMETERS)
+    bonds = molecule.interactions['bonds']
+    expected = _expected_bonds(molecule)
+    assert expected
+    assert [(bond.atoms, bond.parameters) for bond in bonds] == expected
+    assert bonds[0].meta == {'group': 'Rubber band'}
+    assert all(bond.meta is bonds[0].meta for bond in bonds)
+    with pytest.raises(TypeError):
+        bonds[0].meta['comment'] = 'modified'
+
+
+@pytest.mark.parametrize('separation', (1, 2, 4))
+def test_build_connectivity_matrix(separation):
+    """
+    Selected nodes are connected when the shortest path between them, through
+    selected nodes, is short enough.
+    """
+    graph = nx.lollipop_graph(4, 6)
+    graph.add_edge(20, 21)
+    molecule = vermouth.molecule.Molecule(graph)
+    selection = [9, 0, 3, 5, 4, 7, 2, 8, 6, 21, 20]
+    connectivity = rubber_band.build_connectivity_matrix(
+        molecule, separation, selection=selection
+    )
+    selected = graph.subgraph(selection)
+    for (idx, key_idx), (jdx, key_jdx) in itertools.product(enumerate(selection), repeat=2):
+        try:
+            n_nodes = len(nx.shortest_path(selected, key_idx, key_jdx))
+        except nx.NetworkXNoPath:
+            n_nodes = float('inf')
+        expected = key_idx != key_jdx and n_nodes <= separation + 2
+        assert connectivity[idx, jdx] == expected
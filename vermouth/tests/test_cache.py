@@ -0,0 +1,238 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Test the persistent cache of parsed files.
+"""
+# pylint: disable=redefined-outer-name
+
+import os
+import textwrap
+
+import pytest
+
+import vermouth.cache
+import vermouth.forcefield
+from vermouth.cache import load_cached, read_cached, store_cached
+
+
+class CountingLoader:
+    """
+    Read a file, and count how many times it has been read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        with open(self.path) as infile:
+            return {'content': infile.read()}
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    """
+    Use an empty cache directory.
+    """
+    directory = str(tmpdir.mkdir('cache'))
+    monkeypatch.setenv('VERMOUTH_CACHE_DIR', directory)
+    return directory
+
+
+@pytest.fixture
+def source(tmpdir):
+    path = str(tmpdir.join('source.txt'))
+    with open(path, 'w') as outfile:
+        outfile.write('first')
+    return path
+
+
+def test_load_cached(cache_dir, source):
+    """
+    The loader is only called on a cache miss, and the cached value is a copy.
+    """
+    loader = CountingLoader(source)
+    first = load_cached('test', [source], loader)
+    second = load_cached('test', [source], loader)
+    assert loader.calls == 1
+    assert first == second == {'content': 'first'}
+    assert first is not second
+    assert os.listdir(cache_dir)
+
+
+def test_load_cached_modified(cache_dir, source):
+    """
+    A modified file invalidates the cache, a touched file does not.
+    """
+    loader = CountingLoader(source)
+    load_cached('test', [source], loader)
+    stat = os.stat(source)
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_cached('test', [source], loader)
+    assert loader.calls == 1
+
+    with open(source, 'w') as outfile:
+        outfile.write('second')
+    value = load_cached('test', [source], loader)
+    assert loader.calls == 2
+    assert value == {'content': 'second'}
+
+
+def test_load_cached_keys(cache_dir, source, tmpdir):
+    """
+    The cache depends on the key and on the list of files.
+    """
+    other = str(tmpdir.join('other.txt'))
+    with open(other, 'w') as outfile:
+        outfile.write('other')
+    loader = CountingLoader(source)
+    load_cached('test', [source], loader)
+    load_cached('other test', [source], loader)
+    assert loader.calls == 2
+    load_cached('test', [source, other], loader)
+    assert loader.calls == 3
+
+
+def test_load_cached_corrupted(cache_dir, source):
+    """
+    A corrupted cache file is ignored.
+    """
+    loader = CountingLoader(source)
+    load_cached('test', [source], loader)
+    for name in os.listdir(cache_dir):
+        with open(os.path.join(cache_dir, name), 'wb') as outfile:
+            outfile.write(b'not a pickle')
+    assert load_cached('test', [source], loader) == {'content': 'first'}
+    assert loader.calls == 2
+
+
+def test_load_cached_disabled(monkeypatch, source):
+    """
+    An empty VERMOUTH_CACHE_DIR disables the cache.
+    """
+    monkeypatch.setenv('VERMOUTH_CACHE_DIR', '')
+    loader = CountingLoader(source)
+    load_cached('test', [source], loader)
+    load_cached('test', [source], loader)
+    assert loader.calls == 2
+
+
+def test_find_force_fields_cached(cache_dir, tmpdir):
+    """
+    Force fields read from the cache are the same as the parsed ones.
+    """
+    ff_dir = tmpdir.mkdir('force_fields').mkdir('dummy')
+    ff_dir.join('dummy.ff').write(textwrap.dedent("""
+        [ moleculetype ]
+        ABC 1
+        [ atoms ]
+        1 P1 1 ABC A 1 0
+        2 P2 1 ABC B 2 0
+        [ bonds ]
+        A B 1 0.3 1000
+    """))
+    path = os.path.dirname(str(ff_dir))
+    parsed = vermouth.forcefield.find_force_fields(path)
+    cached = vermouth.forcefield.find_force_fields(path)
+    assert parsed['dummy'] is not cached['dummy']
+    assert cached['dummy'].name == 'dummy'
+    parsed_block = parsed['dummy'].blocks['ABC']
+    cached_block = cached['dummy'].blocks['ABC']
+    assert dict(cached_block.nodes(data=True)) == dict(parsed_block.nodes(data=True))
+    assert cached_block.interactions == parsed_block.interactions
+    assert cached_block.force_field is cached['dummy']
+
+
+def test_store_cached(cache_dir):
+    """
+    Objects stored under a key can be read back.
+    """
+    assert read_cached('test') == (False, None)
+    store_cached('test', ['value'])
+    assert read_cached('test') == (True, ['value'])
+    assert read_cached('other') == (False, None)
+
+
+def test_prune_stale_entries(cache_dir, source, tmpdir):
+    """
+    Storing the first entry of a process removes the entries whose files
+    changed, and keeps the others.
+    """
+    other = str(tmpdir.join('other.txt'))
+    with open(other, 'w') as outfile:
+        outfile.write('other')
+    load_cached('stale', [source], CountingLoader(source))
+    load_cached('valid', [other], CountingLoader(other))
+    store_cached('stored', ['value'])
+    assert len(os.listdir(cache_dir)) == 3
+
+    with open(source, 'w') as outfile:
+        outfile.write('second')
+    # The directory was pruned already when the first entry was stored.
+    load_cached('ignored', [other], CountingLoader(other))
+    assert len(os.listdir(cache_dir)) == 4
+
+    vermouth.cache._PRUNED_DIRECTORIES.clear()
+    load_cached('new', [other], CountingLoader(other))
+    assert len(os.listdir(cache_dir)) == 4
+    loader = CountingLoader(other)
+    assert load_cached('valid', [other], loader) == {'content': 'other'}
+    assert loader.calls == 0
+    assert read_cached('stored') == (True, ['value'])
+
+
+def test_code_files_once(cache_dir, source, monkeypatch):
+    """
+    The source files of vermouth are only listed once per process.
+    """
+    vermouth.cache._code_files()
+
+    def failing_walk(*args, **kwargs):
+        raise AssertionError('The package is walked again.')
+    monkeypatch.setattr(vermouth.cache.os, 'walk', failing_walk)
+    loader = CountingLoader(source)
+    load_cached('test', [source], loader)
+    load_cached('test', [source], loader)
+    assert loader.calls == 1
+
+
+def test_stored_code_changed(cache_dir, tmpdir, monkeypatch):
+    """
+    Objects stored under a key are invalid once the source code changes.
+    """
+    code = str(tmpdir.join('code.py'))
+    with open(code, 'w') as outfile:
+        outfile.write('first')
+    monkeypatch.setattr(vermouth.cache, '_code_files', lambda: (code,))
+    store_cached('test', ['value'])
+    assert read_cached('test') == (True, ['value'])
+    with open(code, 'w') as outfile:
+        outfile.write('second!')
+    assert read_cached('test') == (False, None)
+
+
+def test_stored_expired(cache_dir, monkeypatch):
+    """
+    Objects stored under a key expire, and are pruned once expired.
+    """
+    store_cached('old', ['value'])
+    assert read_cached('old') == (True, ['value'])
+    now = vermouth.cache.time.time()
+    monkeypatch.setattr(vermouth.cache.time, 'time',
+                        lambda: now + vermouth.cache.STORED_MAX_AGE + 1)
+    assert read_cached('old') == (False, None)
+    vermouth.cache._PRUNED_DIRECTORIES.clear()
+    store_cached('new', ['value'])
+    assert len(os.listdir(cache_dir)) == 1
+    assert read_cached('new') == (True, ['value'])
@@ -18,6 +18,8 @@ Test the functions required to use DSSP.
 
 import os
 import itertools
+import sys
+import textwrap
 
 import pytest
 
@@ -33,6 +35,34 @@ DSSP_EXECUTABLE = os.environ.get('VERMOUTH_TEST_DSSP', 'dssp')
 SECSTRUCT_1BTA = list('CEEEEETTTCCSHHHHHHHHHHHHTCCTTCCCSHHHHHHHHTTT'
                       'SCSSEEEEEESTTHHHHTTTSSHHHHHHHHHHHHHTTCCEEEEEC')
 
+# Stands in for DSSP. It assigns a helix to the odd residues and a strand to
+# the even ones, and records when it starts and stops in a log directory.
+FAKE_DSSP = textwrap.dedent('''\
+    #!{executable}
+    import os
+    import sys
+    import time
+
+    log_dir = {log_dir!r}
+    start = time.time()
+    residues = []
+    for line in sys.stdin:
+        if line.startswith('ATOM'):
+            key = (line[21], int(line[22:26]))
+            if not residues or residues[-1] != key:
+                residues.append(key)
+    if {fail!r}:
+        sys.stderr.write('Fake failure')
+        sys.exit(1)
+    time.sleep({sleep!r})
+    print('==== Fake DSSP')
+    print('  #  RESIDUE AA STRUCTURE')
+    for idx, (chain, resid) in enumerate(residues, start=1):
+        print('{{:>5d}}{{:>5d}} {{}} X  {{}}'.format(idx, resid, chain, 'HE'[resid % 2]))
+    with open(os.path.join(log_dir, str(os.getpid())), 'w') as outfile:
+        outfile.write('{{}} {{}}'.format(start, time.time()))
+''')
+
 
 # TODO: The code is very repetitive. There may be a way to refactor it with
 # clever use of parametrize and fixtures.
@@ -349,3 +379,182 @@ def test_run_dssp(savefile, tmpdir):
     else:
         # Is the directory empty?
         assert not os.listdir(str(tmpdir))
+
+
+@pytest.fixture
+def fake_dssp(tmpdir):
+    """
+    Build a fake DSSP executable.
+
+    Returns a function that takes the duration of each fake DSSP run, and
+    whether the runs fail, and returns the path to the executable and the
+    directory where the runs are logged.
+    """
+    def make_fake_dssp(sleep=0, fail=False):
+        log_dir = tmpdir.mkdir('log')
+        path = tmpdir.join('fake_dssp')
+        path.write(FAKE_DSSP.format(executable=sys.executable,
+                                    log_dir=str(log_dir),
+                                    sleep=sleep, fail=fail))
+        path.chmod(0o755)
+        return str(path), log_dir
+    return make_fake_dssp
+
+
+def _max_overlap(log_dir):
+    """
+    The maximum number of fake DSSP processes that ran at the same time.
+    """
+    events = []
+    for path in log_dir.listdir():
+        start, end = map(float, path.read().split())
+        events.extend(((start, 1), (end, -1)))
+    running = 0
+    max_running = 0
+    for _, change in sorted(events):
+        running += change
+        max_running = max(max_running, running)
+    return max_running
+
+
+def _protein_system(lengths):
+    """
+    Build a system with a fragment of 1bta of the given number of residues
+    per molecule. Each molecule is a different chain.
+    """
+    full = read_pdb(str(PDB_PROTEIN))
+    system = vermouth.System()
+    for chain, length in zip('ABCDEFGH', lengths):
+        molecule = full.subgraph(
+            key for key, node in full.nodes.items() if node['resid'] <= length
+        )
+        for node in molecule.nodes.values():
+            node['chain'] = chain
+        system.add_molecule(molecule)
+    return system
+
+
+@pytest.mark.parametrize('processes', (1, 3, None))
+def test_annotate_dssp_system(fake_dssp, processes):
+    """
+    DSSP runs on all the molecules of a system, with at most the requested
+    number of processes at the same time, and each molecule gets its own
+    secondary structure.
+    """
+    executable, log_dir = fake_dssp(sleep=0.5)
+    lengths = (3, 5, 7, 4, 6)
+    system = _protein_system(lengths)
+    processor = dssp.AnnotateDSSP(executable=executable, processes=processes)
+    processor.run_system(system)
+
+    assert len(log_dir.listdir()) == len(lengths)
+    limit = processes or os.cpu_count()
+    if limit == 1:
+        assert _max_overlap(log_dir) == 1
+    else:
+        assert 1 < _max_overlap(log_dir) <= limit
+    for molecule, length in zip(system.molecules, lengths):
+        assert len({node['resid'] for node in molecule.nodes.values()}) == length
+        for node in molecule.nodes.values():
+            assert node['secstruct'] == 'HE'[node['resid'] % 2]
+
+
+def test_annotate_dssp_system_default(fake_dssp):
+    """
+    By default, DSSP runs on one molecule at a time.
+    """
+    executable, log_dir = fake_dssp(sleep=0.2)
+    system = _protein_system((3, 5, 4))
+    dssp.AnnotateDSSP(executable=executable).run_system(system)
+    assert len(log_dir.listdir()) == 3
+    assert _max_overlap(log_dir) == 1
+
+
+@pytest.mark.parametrize('processes', (1, 3))
+def test_annotate_dssp_system_savedir(fake_dssp, tmpdir, processes):
+    """
+    DSSP outputs are saved per chain.
+    """
+    executable, _ = fake_dssp()
+    savedir = tmpdir.mkdir('save')
+    system = _protein_system((3, 4))
+    dssp.AnnotateDSSP(executable=executable, savedir=str(savedir),
+                      processes=processes).run_system(system)
+    assert sorted(path.basename for path in savedir.listdir()) == [
+        'chain_A.ssd', 'chain_B.ssd'
+    ]
+
+
+@pytest.mark.parametrize('processes', (1, 3))
+def test_annotate_dssp_system_error(fake_dssp, processes):
+    """
+    A failing DSSP raises an error and leaves the molecules untouched.
+    """
+    executable, _ = fake_dssp(fail=True)
+    system = _protein_system((3, 4))
+    with pytest.raises(dssp.DSSPError):
+        dssp.AnnotateDSSP(executable=executable,
+                          processes=processes).run_system(system)
+    for molecule in system.molecules:
+        assert all('secstruct' not in node for node in molecule.nodes.values())
+
+
+def test_dssp_cache_key():
+    """
+    The cache key depends on the backbone only.
+    """
+    system = _protein_system((3, 4))
+    reference = dssp.dssp_cache_key(system)
+    molecule = system.molecules[1]
+    side_chain = [key for key, node in molecule.nodes.items()
+                  if node['atomname'] == 'CB'][0]
+    molecule.nodes[side_chain]['position'] += 1
+    assert dssp.dssp_cache_key(system) == reference
+
+    backbone = [key for key, node in molecule.nodes.items()
+                if node['atomname'] == 'CA'][0]
+    molecule.nodes[backbone]['position'] += 0.001
+    assert dssp.dssp_cache_key(system) != reference
+
+
+@pytest.mark.parametrize('processes', (1, 3))
+def test_annotate_dssp_cached(fake_dssp, tmpdir, processes):
+    """
+    DSSP does not run on molecules with a known backbone.
+    """
+    executable, log_dir = fake_dssp()
+    cache = dssp.DSSPCache()
+    assert cache.hit_rate is None
+    processor = dssp.AnnotateDSSP(executable=executable, processes=processes,
+                                  cache=cache)
+    processor.run_system(_protein_system((3, 4)))
+    assert len(log_dir.listdir()) == 2
+    assert cache.hit_rate == 0
+
+    savedir = tmpdir.mkdir('save')
+    processor.savedir = str(savedir)
+    system = _protein_system((3, 5))
+    processor.run_system(system)
+    assert len(log_dir.listdir()) == 3
+    assert (cache.hits, cache.misses) == (1, 3)
+    assert cache.hit_rate == 0.25
+    assert len(savedir.listdir()) == 2
+    for molecule in system.molecules:
+        for node in molecule.nodes.values():
+            assert node['secstruct'] == 'HE'[node['resid'] % 2]
+
+
+def test_dssp_cache_on_disk(fake_dssp, tmpdir):
+    """
+    DSSP outputs can be kept on disk to be used by a later run.
+    """
+    executable, log_dir = fake_dssp()
+    directory = str(tmpdir.mkdir('cache'))
+    dssp.AnnotateDSSP(executable=executable,
+                      cache=dssp.DSSPCache(directory)).run_system(_protein_system((3,)))
+    cache = dssp.DSSPCache(directory)
+    system = _protein_system((3,))
+    dssp.AnnotateDSSP(executable=executable, cache=cache).run_system(system)
+    assert len(log_dir.listdir()) == 1
+    assert cache.hit_rate == 1
+    assert all('secstruct' in node for node in system.molecules[0].nodes.values())
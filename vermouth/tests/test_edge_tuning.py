@@ -23,12 +23,13 @@ Unit tests for the :mod:`vermouth.edge_tuning` module.
 # pylint: disable=redefined-outer-name
 
 import copy
+import functools
 import pytest
 import numpy as np
 import networkx as nx
 import vermouth
 from vermouth import edge_tuning
-from vermouth.molecule import Choice
+from vermouth.molecule import Choice, NotDefinedOrNot
 from vermouth.utils import distance
 
 
@@ -401,8 +402,11 @@ class TestPairsUnderThreshold:
             [3, 1],
             [5, 4],
         ]
-        return edge_tuning.pairs_under_threshold(
-            multi_molecules, 2.0, selection, selection, attribute='coords'
+        return _selected_pairs(
+            selection, selection,
+            edge_tuning.pairs_under_threshold(
+                multi_molecules, 2.0, selection, selection, attribute='coords'
+            )
         )
 
     @staticmethod
@@ -422,8 +426,11 @@ class TestPairsUnderThreshold:
             [2, 5],
             [5, 4],
         ]
-        return edge_tuning.pairs_under_threshold(
-            multi_molecules, 2.0, selection_a, selection_b, attribute='coords'
+        return _selected_pairs(
+            selection_a, selection_b,
+            edge_tuning.pairs_under_threshold(
+                multi_molecules, 2.0, selection_a, selection_b, attribute='coords'
+            )
         )
 
     @staticmethod
@@ -486,9 +493,37 @@ class TestPairsUnderThreshold:
         Make sure :func:`edge_tuning.pairs_under_threshold` is not failing on
         empty selections.
         """
-        assert not list(edge_tuning.pairs_under_threshold(
+        index_a, index_b, distances = edge_tuning.pairs_under_threshold(
             multi_molecules, 2.0, [], [], attribute='coords'
-        ))
+        )
+        assert not len(index_a)
+        assert not len(index_b)
+        assert not len(distances)
+
+    @staticmethod
+    @pytest.mark.parametrize('min_edges, expected', (
+        (0, 2),
+        (3, 2),
+        (4, 0),
+        (5, 0),
+    ))
+    def test_min_edges(min_edges, expected):
+        """
+        Make sure :func:`edge_tuning.pairs_under_threshold` excludes the pairs
+        that are connected by too short a path.
+        """
+        molecule = vermouth.molecule.Molecule()
+        molecule.add_nodes_from(
+            (idx, {'coords': np.array([0, 0, idx * 0.1])})
+            for idx in range(5)
+        )
+        molecule.add_edges_from(zip(range(4), range(1, 5)))
+        selection = [(0, 0), (0, 3)]
+        index_a, _, _ = edge_tuning.pairs_under_threshold(
+            [molecule], 1.0, selection, selection,
+            attribute='coords', min_edges=min_edges,
+        )
+        assert len(index_a) == expected
 
 
 class TestAddEdgesThreshold:
@@ -526,6 +561,45 @@ class TestAddEdgesThreshold:
         assert total_nedges == 4
 
 
+@pytest.mark.parametrize('templates', (
+    [[{'serial': Choice([1, 10, 19])}, {'name': 'not there'}]],
+    [[{'atomid': 2}], [{'atomid': Choice([0, 5])}, {'serial': 34}]],
+    [[{'name': None}], [{'name': NotDefinedOrNot(None)}]],
+    [[{'tags': ['a']}], [{'atomid': 3}, {'tags': ['b']}]],
+))
+def test_select_nodes_multi_templates(multi_molecules, templates):
+    """
+    Test that :func:`edge_tuning.select_nodes_multi_templates` selects the same
+    nodes as :func:`edge_tuning.select_nodes_multi`.
+    """
+    multi_molecules[2].nodes[4]['name'] = None
+    # Unhashable attribute values cannot be used to share the results.
+    multi_molecules[1].nodes[0]['tags'] = ['a']
+    multi_molecules[3].nodes[5]['tags'] = ['b']
+    selections = edge_tuning.select_nodes_multi_templates(
+        multi_molecules, *templates
+    )
+    assert len(selections) == len(templates)
+    for selection, template_list in zip(selections, templates):
+        selector = functools.partial(
+            vermouth.selectors.proto_multi_templates, templates=template_list
+        )
+        expected = list(edge_tuning.select_nodes_multi(multi_molecules, selector))
+        assert selection == expected
+
+
+def _selected_pairs(selection_a, selection_b, pairs):
+    """
+    Convert the arrays returned by :func:`edge_tuning.pairs_under_threshold`
+    to a list of ``(key_a, key_b, distance)`` tuples.
+    """
+    index_a, index_b, distances = pairs
+    return [
+        (selection_a[idx], selection_b[jdx], distance)
+        for idx, jdx, distance in zip(index_a, index_b, distances)
+    ]
+
+
 def test_select_nodes_multi(multi_molecules):
     """
     Test the output of :func:`edge_tuning.select_nodes_multi`.
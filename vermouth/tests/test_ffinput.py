@@ -144,3 +144,42 @@ def test_treat_atom_prefix(key, attributes,
     assert result_prefixed == ref_prefixed
     assert result_attributes == ref_attributes
     assert result_attributes is not attributes  # We do a shallow copy
+
+
+@pytest.mark.parametrize('line, expected', (
+    ('', []),
+    ('A B  C', ['A', 'B', 'C']),
+    ('\tPO4 GL1 -- 1 0.2 1000 ', ['PO4', 'GL1', '--', '1', '0.2', '1000']),
+    ('BB {"resname": "ALA"} +BB {"order": 1} 1 0.2',
+     ['BB', '{"resname": "ALA"}', '+BB', '{"order": 1}', '1', '0.2']),
+    ('ATOM1{"a": 1}ATOM2', ['ATOM1', '{"a": 1}', 'ATOM2']),
+    ('{"a": 1}{"b": 2}', ['{"a": 1}', '{"b": 2}']),
+    # Nested brackets are treated by the slow path
+    ('A {"a": {"b": 1}} B', ['A', '{"a": {"b": 1}}', 'B']),
+    ('A}B C', ['A}B C']),
+))
+def test_tokenize(line, expected):
+    assert ffinput._tokenize(line) == expected
+
+
+@pytest.mark.parametrize('line', ('A {"a": 1', 'A {"a": {"b": 1}'))
+def test_tokenize_error(line):
+    with pytest.raises(IOError):
+        ffinput._tokenize(line)
+
+
+@pytest.mark.parametrize('line, expected', (
+    ('no macro', 'no macro'),
+    ('A $one B', 'A 1 B'),
+    ('$one$two', 'ABC'),
+    ('A {"a": $one}', 'A {"a": 1}'),
+    ('$nested B', 'x 1 y B'),
+))
+def test_substitute_macros(line, expected):
+    macros = {'one': '1', 'one$two': 'ABC', 'nested': 'x $one y'}
+    assert ffinput._substitute_macros(line, macros) == expected
+
+
+def test_substitute_macros_unknown():
+    with pytest.raises(KeyError):
+        ffinput._substitute_macros('A $unknown', {})
@@ -0,0 +1,120 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Test the discovery and the lazy loading of force fields.
+"""
+# pylint: disable=redefined-outer-name
+
+import textwrap
+
+import pytest
+
+import vermouth.forcefield
+from vermouth.forcefield import ForceField, ForceFieldRegistry, find_force_fields
+
+BLOCK_TEMPLATE = textwrap.dedent("""
+    [ moleculetype ]
+    {0} 1
+    [ atoms ]
+    1 P1 1 {0} A 1 0
+""")
+
+
+def _write_force_field(directory, name, *blocks):
+    ff_dir = directory.mkdir(name)
+    for block in blocks:
+        ff_dir.join(block + '.ff').write(BLOCK_TEMPLATE.format(block))
+
+
+@pytest.fixture
+def parse_count(monkeypatch):
+    """
+    Count the parsed force field files, with the cache disabled.
+    """
+    monkeypatch.setenv('VERMOUTH_CACHE_DIR', '')
+    counts = []
+    parser = vermouth.forcefield.FORCE_FIELD_PARSERS['.ff']
+
+    def counting_parser(infile, force_field):
+        counts.append(force_field.name)
+        return parser(infile, force_field)
+
+    monkeypatch.setitem(vermouth.forcefield.FORCE_FIELD_PARSERS, '.ff', counting_parser)
+    return counts
+
+
+@pytest.fixture
+def ff_directory(tmpdir):
+    directory = tmpdir.mkdir('force_fields')
+    _write_force_field(directory, 'first', 'AAA')
+    _write_force_field(directory, 'second', 'BBB', 'CCC')
+    directory.mkdir('not_a_force_field')
+    return directory
+
+
+def test_find_force_fields_lazy(ff_directory, parse_count):
+    """
+    Force fields are found without being parsed, and are parsed once when
+    accessed.
+    """
+    force_fields = find_force_fields(str(ff_directory))
+    assert isinstance(force_fields, ForceFieldRegistry)
+    assert set(force_fields) == {'first', 'second'}
+    assert len(force_fields) == 2
+    assert 'first' in force_fields
+    assert 'not_a_force_field' not in force_fields
+    assert parse_count == []
+
+    assert set(force_fields['second'].blocks) == {'BBB', 'CCC'}
+    assert force_fields['second'] is force_fields['second']
+    assert len(parse_count) == 2
+
+
+def test_find_force_fields_update(ff_directory, tmpdir, parse_count):
+    """
+    Force fields found in a second directory update the known ones.
+    """
+    other_directory = tmpdir.mkdir('other')
+    _write_force_field(other_directory, 'first', 'DDD')
+    _write_force_field(other_directory, 'third', 'EEE')
+    force_fields = find_force_fields(str(ff_directory))
+    first = force_fields['first']
+    find_force_fields(str(other_directory), force_fields)
+    assert set(force_fields) == {'first', 'second', 'third'}
+    assert force_fields['first'] is first
+    assert set(first.blocks) == {'AAA', 'DDD'}
+    assert 'second' not in parse_count
+
+
+def test_find_force_fields_dict(ff_directory, parse_count):
+    """
+    Plain dictionaries are filled with parsed force fields.
+    """
+    force_fields = {}
+    assert find_force_fields(str(ff_directory), force_fields) is force_fields
+    assert set(force_fields) == {'first', 'second'}
+    assert all(isinstance(ff, ForceField) for ff in force_fields.values())
+    assert len(parse_count) == 3
+
+
+def test_registry_set_and_delete(ff_directory, parse_count):
+    force_fields = find_force_fields(str(ff_directory))
+    replacement = ForceField(name='first')
+    force_fields['first'] = replacement
+    assert force_fields['first'] is replacement
+    del force_fields['second']
+    assert set(force_fields) == {'first'}
+    with pytest.raises(KeyError):
+        del force_fields['second']
+    assert parse_count == []
@@ -21,6 +21,7 @@ from pprint import pprint
 import networkx as nx
 import pytest
 import vermouth
+import vermouth.forcefield
 from .helper_functions import make_into_set
 
 # no-member because module networkx does indeed have a member isomorphism;
@@ -333,8 +334,7 @@ def test_maximum_common_subgraph(node_data1, edges1, node_data2, edges2, attrs):
     pprint(("Expected asnwers", expected))
 
     pprint(("Expected answers that are not found", expected - found))
-    # We don't find all MCS'es. See comment in vermouth.graph_utils.maximum_common_subgraph
-    assert found <= expected
+    assert found == expected
 
 
 @pytest.mark.parametrize('node_data1, edges1, node_data2, edges2, attrs, expected', [
@@ -390,7 +390,12 @@ def test_maximum_common_subgraph(node_data1, edges1, node_data2, edges2, attrs):
          {0: 3, 1: 2, 2: 1, 3: 0},
          {0: 1, 1: 2, 2: 3, 4: 4},
          {0: 0, 1: 1, 2: 2, 4: 3},
-         {0: 0, 1: 1, 2: 2, 3: 3}]
+         {0: 0, 1: 1, 2: 2, 3: 3},
+         # Not connected, but induced common subgraphs nonetheless
+         {0: 0, 2: 3, 3: 2, 4: 4},
+         {0: 0, 2: 3, 3: 4, 4: 2},
+         {0: 4, 2: 1, 3: 0, 4: 2},
+         {0: 4, 2: 1, 3: 2, 4: 0}]
     ),
 ])
 def test_maximum_common_subgraph_known_outcome(node_data1, edges1, node_data2, edges2, attrs, expected):
@@ -412,6 +417,24 @@ def test_maximum_common_subgraph_known_outcome(node_data1, edges1, node_data2, e
     assert found == expected
 
 
+@pytest.mark.parametrize('max_steps, complete', ((None, True), (1000, True), (10, False)))
+def test_maximum_common_subgraph_complete(max_steps, complete):
+    """
+    ``maximum_common_subgraph`` tells when it ran out of steps, and then only
+    returns the matches found so far.
+    """
+    graph1 = nx.cycle_graph(6)
+    graph2 = nx.path_graph(6)
+    expected = vermouth.graph_utils.maximum_common_subgraph(graph1, graph2)
+    found, is_complete = vermouth.graph_utils.maximum_common_subgraph(
+        graph1, graph2, max_steps=max_steps, return_complete=True
+    )
+    assert is_complete == complete
+    assert found
+    assert all(match in expected for match in found)
+    assert (len(found) == len(expected)) == complete
+
+
 @pytest.mark.parametrize('node_data1, edges1, node_data2, edges2', [
     (
         [{'atomname': 0, 'element': 0}, {'atomname': 0, 'element': 0}],
@@ -505,6 +528,56 @@ def test_isomorphism_known_outcome(node_data1, edges1, node_data2, edges2, expec
     assert found == expected
 
 
+@pytest.mark.parametrize('resname, removed', [
+    ('LYS', []),
+    ('LYS', ['CE', 'HE1', 'HE2', 'NZ', 'HZ1', 'HZ2', 'HZ3']),
+    ('LYS', ['HZ1', 'HZ2', 'HZ3', 'HN', 'HA']),
+    ('TRP', ['HD1', 'HE1', 'HE3']),
+])
+def test_isomorphism_compiled(resname, removed):
+    """
+    Compiled references give the same matches as the graphs they describe.
+    """
+    force_field = vermouth.forcefield.FORCE_FIELDS['universal']
+    reference = force_field.reference_graphs[resname].copy()
+    residue = nx.Graph(reference)
+    residue.remove_nodes_from(removed)
+    compiled = vermouth.graph_utils.CompiledReference(reference)
+    compiled_residue = vermouth.graph_utils.CompiledReference(residue)
+
+    expected = vermouth.graph_utils.isomorphism(reference, residue)
+    assert expected
+    assert vermouth.graph_utils.isomorphism(compiled, residue) == expected
+    assert vermouth.graph_utils.isomorphism(compiled, compiled_residue) == expected
+
+    expected = vermouth.graph_utils.isomorphism(residue, reference)
+    assert vermouth.graph_utils.isomorphism(residue, compiled) == expected
+
+
+def test_compiled_reference_cache():
+    """
+    Force fields compile their reference graphs once, and again if the block
+    is replaced.
+    """
+    force_field = vermouth.forcefield.ForceField(name='dummy')
+    force_field.blocks['A'] = basic_molecule(
+        [{'atomname': 'C1'}, {'atomname': 'H1'}, {'atomname': 'C2'}],
+        {(0, 1): {}, (0, 2): {}},
+    )
+    compiled = force_field.compiled_reference('A')
+    assert compiled.graph is force_field.blocks['A']
+    assert compiled.elements == {0: 'C', 1: 'H', 2: 'C'}
+    assert compiled.hydrogens == [1, 2]
+    assert list(compiled.heavy_graph) == [0]
+    assert compiled.hydrogens_by_parent[0] == {'H1': [1], 'C2': [2]}
+    assert force_field.compiled_reference('A') is compiled
+
+    force_field.blocks['A'] = force_field.blocks['A'].copy()
+    assert force_field.compiled_reference('A') is not compiled
+    with pytest.raises(KeyError):
+        force_field.compiled_reference('B')
+
+
 @pytest.mark.parametrize('node_data, edges, partitions, attrs, expected_nodes, expected_edges', [
     ([], {}, [], {}, [], {}),
     ([{}], {}, [[0]], {}, [{}], {}),
@@ -778,3 +851,66 @@ def test_make_residue_graph(nodes1, edges1, nodes2, edges2):
         assert expected.has_edge(idx, jdx) and expected.edges[idx, jdx] == data
         edges_seen.add(frozenset((idx, jdx)))
     assert set(frozenset(edge) for edge in expected.edges) == edges_seen
+
+
+def _residue_chain_molecule():
+    """
+    Build a molecule with 4 residues of 2 atoms, out of order, with edges
+    within and between residues.
+    """
+    residues = [(0, 'A', 3), (1, 'A', 1), (2, 'B', 1), (3, 'A', 2)]
+    nodes = []
+    for res_idx, chain, resid in residues:
+        nodes.extend([
+            {'chain': chain, 'resid': resid, 'resname': 'RES{}'.format(res_idx)},
+        ] * 2)
+    edges = {
+        (0, 1): {}, (2, 3): {}, (4, 5): {}, (6, 7): {},
+        (1, 6): {}, (3, 7): {'weight': 3}, (6, 2): {}, (5, 0): {},
+    }
+    return basic_molecule(nodes, edges)
+
+
+def test_make_residue_index():
+    """
+    The residue index groups the atoms like make_residue_graph.
+    """
+    mol = _residue_chain_molecule()
+    index = vermouth.graph_utils.make_residue_index(mol)
+    assert index.keys == [('A', 1, 'RES1'), ('A', 2, 'RES3'),
+                          ('A', 3, 'RES0'), ('B', 1, 'RES2')]
+    assert index.residues == [(2, 3), (6, 7), (0, 1), (4, 5)]
+    assert index.node_residue == {2: 0, 3: 0, 6: 1, 7: 1, 0: 2, 1: 2, 4: 3, 5: 3}
+
+    graph = vermouth.graph_utils.blockmodel(
+        mol, index.residues, chain=['A', 'A', 'A', 'B'], resid=[1, 2, 3, 1],
+        resname=['RES1', 'RES3', 'RES0', 'RES2'],
+        atomname=['RES1', 'RES3', 'RES0', 'RES2'],
+    )
+    assert list(index.edges()) == list(graph.edges())
+    found = vermouth.graph_utils.make_residue_graph(mol)
+    assert list(found.edges(data=True)) == list(graph.edges(data=True))
+    for node in graph:
+        expected = dict(graph.nodes[node])
+        data = dict(found.nodes[node])
+        assert list(data.pop('graph').nodes) == list(expected.pop('graph').nodes)
+        assert data == expected
+
+
+def test_residue_index_cache():
+    """
+    The residue index of a molecule is cached until the molecule changes.
+    """
+    mol = _residue_chain_molecule()
+    index = mol.residue_index
+    assert mol.residue_index is index
+    assert list(mol.iter_residues()) == index.residues
+
+    mol.add_edge(0, 4)
+    assert mol.residue_index is not index
+    assert 3 in mol.residue_index.adjacency[2]
+    index = mol.residue_index
+    mol.nodes[0]['resid'] = 7
+    assert mol.residue_index.keys[-2] == ('A', 7, 'RES0')
+    mol.remove_nodes_from([6, 7])
+    assert mol.residue_index.residues == [(2, 3), (1,), (0,), (4, 5)]
@@ -14,10 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
+
+import networkx as nx
 import pytest
 import numpy as np
 from vermouth.processors import do_links, DoLinks
-from vermouth.molecule import Molecule, Link
+from vermouth.molecule import Molecule, Link, Choice, Interaction
 import vermouth.forcefield
 
 @pytest.mark.parametrize(
@@ -273,4 +276,161 @@ def test_link_processor(mol_nodes, mol_edges, link_nodes, link_edges,
 
     out = DoLinks().run_molecule(mol)
     assert dict(out.nodes(data=True)) == dict(expected_nodes)
-    assert set(out.edges(data=False)) == set(expected_edges)
\ No newline at end of file
+    assert set(out.edges(data=False)) == set(expected_edges)
+
+@pytest.fixture
+def chain_molecule():
+    """
+    A linear chain of 5 residues with a BB and a SC1 bead each.
+    """
+    nodes = []
+    edges = []
+    for resid in range(1, 6):
+        bb_key = len(nodes)
+        nodes.append((bb_key, {'atomname': 'BB', 'resname': 'ALA', 'resid': resid}))
+        nodes.append((bb_key + 1, {'atomname': 'SC1', 'resname': 'ALA', 'resid': resid}))
+        edges.append((bb_key, bb_key + 1))
+        if resid > 1:
+            edges.append((bb_key - 2, bb_key))
+    return make_mol(nodes, edges)
+
+
+@pytest.mark.parametrize('link_nodes, link_edges, expected', (
+    (  # Backbone bond, seeded from the index
+        [(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': 1})],
+        [(0, 1)],
+        [{0: 0, 1: 2}, {0: 2, 1: 4}, {0: 4, 1: 6}, {0: 6, 1: 8}],
+    ),
+    (  # Choice on the first node
+        [(0, {'atomname': Choice(['SC1', 'BB']), 'order': 0}),
+         (1, {'atomname': 'BB', 'order': '>'})],
+        [(0, 1)],
+        [{0: 0, 1: 2}, {0: 2, 1: 4}, {0: 4, 1: 6}, {0: 6, 1: 8}],
+    ),
+    (  # No atom name on the first node: every node is tried
+        [(0, {'resname': 'ALA', 'order': 0}), (1, {'atomname': 'SC1', 'order': 0})],
+        [(0, 1)],
+        [{0: 0, 1: 1}, {0: 2, 1: 3}, {0: 4, 1: 5}, {0: 6, 1: 7}, {0: 8, 1: 9}],
+    ),
+    (  # The order constraints exclude every match
+        [(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': '<'}),
+         (2, {'atomname': 'SC1', 'order': '>'})],
+        [(0, 1), (1, 2)],
+        [],
+    ),
+))
+def test_match_link_index(chain_molecule, link_nodes, link_edges, expected):
+    """
+    Seeding the search from the atom name index does not change the matches
+    nor their order.
+    """
+    link = make_link(link_nodes, link_edges)
+    indexed = list(do_links.match_link(
+        chain_molecule, link, do_links._index_atomnames(chain_molecule)
+    ))
+    full = list(do_links.match_link(chain_molecule, link))
+    assert indexed == full == expected
+
+
+def _reference_match_link(molecule, link):
+    """
+    The link matcher as it was before the search was seeded and the order
+    constraints were checked during the search.
+    """
+    matcher = nx.isomorphism.GraphMatcher(
+        molecule, link, node_match=do_links._atoms_match
+    )
+    for raw_match in matcher.subgraph_isomorphisms_iter():
+        rev_raw_match = {value: key for key, value in raw_match.items()}
+        if not do_links._is_valid_non_edges(molecule, link, rev_raw_match):
+            continue
+        if link.patterns and not do_links._any_pattern_match(
+                molecule, link.patterns, rev_raw_match):
+            continue
+        order_match = {}
+        for mol_idx, link_idx in raw_match.items():
+            if 'order' in link.nodes[link_idx]:
+                order = link.nodes[link_idx]['order']
+                resid = molecule.nodes[mol_idx]['resid']
+                if order_match.setdefault(order, resid) != resid:
+                    break
+        else:
+            if all(do_links.match_order(order1, resid1, order2, resid2)
+                   for (order1, resid1), (order2, resid2)
+                   in itertools.combinations(order_match.items(), 2)):
+                yield rev_raw_match
+
+
+@pytest.mark.parametrize('link_nodes, link_edges', (
+    (  # Keys in order
+        [(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': 1})],
+        [(0, 1)],
+    ),
+    (  # The smallest key is not the first node
+        [(1, {'atomname': 'SC1', 'order': 0}), (0, {'atomname': 'BB', 'order': 0})],
+        [(0, 1)],
+    ),
+    (  # The smallest key is not the first node, and has no atom name
+        [(2, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': '>'}),
+         (0, {'resname': 'ALA', 'order': '>'})],
+        [(2, 1), (1, 0)],
+    ),
+    (  # String keys
+        ['B', 'A'],
+        [('B', 'A')],
+    ),
+))
+def test_match_link_order(link_nodes, link_edges):
+    """
+    The matches come out as with the plain VF2 matcher, in the same order,
+    whichever link node networkx starts the search from.
+    """
+    # The side chains are numbered in the opposite order as the backbone so
+    # the order of the matches depends on where the search starts.
+    nodes = []
+    edges = []
+    for resid in range(1, 6):
+        nodes.append((resid - 1, {'atomname': 'BB', 'resname': 'ALA', 'resid': resid}))
+        nodes.append((10 - resid, {'atomname': 'SC1', 'resname': 'ALA', 'resid': resid}))
+        edges.append((resid - 1, 10 - resid))
+        if resid > 1:
+            edges.append((resid - 2, resid - 1))
+    molecule = make_mol(sorted(nodes, key=lambda node: node[0]), edges)
+    link = make_link(link_nodes, link_edges)
+    expected = list(_reference_match_link(molecule, link))
+    assert expected
+    indexed = list(do_links.match_link(
+        molecule, link, do_links._index_atomnames(molecule)
+    ))
+    full = list(do_links.match_link(molecule, link))
+    assert indexed == full == expected
+
+
+def test_link_prefilter(chain_molecule):
+    """
+    Links requiring attributes the molecule does not have are skipped.
+    """
+    chain_molecule.meta['scfix'] = True
+    links = [
+        # Can match
+        make_link([(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'BB', 'order': 1})],
+                  [(0, 1)]),
+        # Atom name not in the molecule
+        make_link([(0, {'atomname': 'BB', 'order': 0}), (1, {'atomname': 'SC2', 'order': 0})],
+                  [(0, 1)]),
+        # None of the choices are in the molecule
+        make_link([(0, {'resname': Choice(['GLY', 'PRO'])})]),
+        # Molecule meta does not match
+        make_link([(0, {'atomname': 'BB'})]),
+    ]
+    links[0].interactions['bonds'] = [Interaction(atoms=(0, 1), parameters=['1'], meta={})]
+    links[3].molecule_meta = {'scfix': False}
+    links[3].interactions['bonds'] = [Interaction(atoms=(0, 0), parameters=['2'], meta={})]
+    chain_molecule._force_field = vermouth.forcefield.ForceField(name='dummy')
+    chain_molecule.force_field.links = links
+
+    processor = DoLinks()
+    processor.run_molecule(chain_molecule)
+    assert processor.link_counts == {'tested': 4, 'skipped': 3}
+    assert [interaction.atoms for interaction in chain_molecule.interactions['bonds']] \
+        == [(0, 2), (2, 4), (4, 6), (6, 8)]
@@ -12,6 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pickle
+
+import networkx as nx
+import numpy as np
 import pytest
 import vermouth
 
@@ -192,6 +196,50 @@ def test_copy_interactions_mod(molecule, molecule_copy):
     assert n_bonds_copy > n_bonds
 
 
+def test_copy_independent(molecule):
+    """
+    Containers obtained before copying do not belong to the copy.
+    """
+    node = molecule.nodes[0]
+    edge = molecule.edges[0, 1]
+    bonds = molecule.interactions['bonds']
+    molecule_copy = molecule.copy()
+    node['atomname'] = 'mod'
+    edge['attr'] = 'mod'
+    bonds.append(vermouth.molecule.Interaction(
+        atoms=(0, 2), parameters=[], meta={}
+    ))
+    assert molecule_copy.nodes[0]['atomname'] != 'mod'
+    assert 'attr' not in molecule_copy.edges[0, 1]
+    assert len(molecule_copy.interactions['bonds']) == len(bonds) - 1
+    assert molecule_copy.nodes[0] is not node
+    assert molecule_copy.edges[0, 1] is not edge
+    assert molecule_copy.interactions['bonds'] is not bonds
+
+
+def test_copy_edge_order(molecule):
+    """
+    A copy has the same nodes and edges as the original, in the same order.
+    """
+    molecule_copy = molecule.copy()
+    assert list(molecule_copy.nodes(data=True)) == list(molecule.nodes(data=True))
+    assert list(molecule_copy.edges(data=True)) == list(molecule.edges(data=True))
+    assert molecule_copy.interactions == molecule.interactions
+
+
+def test_copy_modified_attributes(molecule):
+    """
+    Modifying an atom obtained before copying does not modify the copy.
+    """
+    node = molecule.nodes[0]
+    molecule_copy = molecule.copy()
+    node['atomname'] = 'mod'
+    assert molecule_copy.nodes[0]['atomname'] != 'mod'
+    assert molecule.nodes[0]['atomname'] == 'mod'
+    node['resname'] = 'mod'
+    assert molecule_copy.nodes[0].get('resname') != 'mod'
+
+
 def test_subgraph_base(molecule_subgraph):
     assert tuple(molecule_subgraph) == (2, 0)  # order matters!
     assert (0, 2) in molecule_subgraph.edges
@@ -315,3 +363,297 @@ def test_subgraph_edges(edges_between_molecule, edges_between_selections,
         for edge in sorted_expected
     ]
     assert found_attributes == expected_attributes
+
+
+def _merge_candidates():
+    """
+    Build a list of small molecules to merge, including an empty one.
+    """
+    molecules = []
+    for mol_idx, size in enumerate((3, 0, 2, 4)):
+        molecule = vermouth.molecule.Molecule(nrexcl=1)
+        molecule.add_nodes_from(
+            (idx, {'atomname': 'A{}'.format(idx), 'resid': idx // 2 + 1,
+                   'charge_group': idx + 1, 'mol': mol_idx})
+            for idx in range(size)
+        )
+        molecule.add_edges_from(zip(range(size - 1), range(1, size)))
+        for idx in range(size - 1):
+            molecule.add_interaction('bonds', (idx, idx + 1), [str(mol_idx)])
+        molecules.append(molecule)
+    return molecules
+
+
+def test_merge_molecules():
+    """
+    :meth:`vermouth.molecule.Molecule.merge_molecules` gives the same result
+    as calling :meth:`vermouth.molecule.Molecule.merge_molecule` in turn.
+    """
+    first, *others = _merge_candidates()
+    correspondences = first.merge_molecules(others)
+
+    expected_first, *expected_others = _merge_candidates()
+    expected_correspondences = [
+        expected_first.merge_molecule(other) for other in expected_others
+    ]
+
+    assert correspondences == expected_correspondences
+    assert list(first.nodes(data=True)) == list(expected_first.nodes(data=True))
+    assert set(first.edges) == set(expected_first.edges)
+    assert first.interactions == expected_first.interactions
+    assert first.nrexcl == expected_first.nrexcl
+
+
+def test_merge_molecules_nrexcl():
+    """
+    :meth:`vermouth.molecule.Molecule.merge_molecules` does not modify the
+    molecule if one of the molecules to merge is incompatible.
+    """
+    first, *others = _merge_candidates()
+    others[-1].nrexcl = 2
+    n_nodes = len(first)
+    with pytest.raises(ValueError):
+        first.merge_molecules(others)
+    assert len(first) == n_nodes
+
+
+@pytest.fixture
+def molecule_versions():
+    """
+    Build a linear molecule with multiple versions of some dihedral angles.
+    """
+    molecule = vermouth.molecule.Molecule()
+    molecule.add_nodes_from(range(6))
+    molecule.add_edges_from(zip(range(5), range(1, 6)))
+    for start in range(3):
+        atoms = tuple(range(start, start + 4))
+        molecule.add_interaction('dihedrals', atoms, ['a'])
+        molecule.add_interaction('dihedrals', atoms, ['b'], meta={'version': 1})
+    return molecule
+
+
+@pytest.mark.parametrize('atoms, version, expected', (
+    ((0, 1, 2, 3), 0, ['new', 'b', 'a', 'b', 'a', 'b']),
+    ((1, 2, 3, 4), 1, ['a', 'b', 'a', 'new', 'a', 'b']),
+    ((2, 1, 0, 5), 0, ['a', 'b', 'a', 'b', 'a', 'b', 'new']),
+    ((0, 1, 2, 3), 2, ['a', 'b', 'a', 'b', 'a', 'b', 'new']),
+))
+def test_add_or_replace_interaction(molecule_versions, atoms, version, expected):
+    """
+    :meth:`vermouth.molecule.Molecule.add_or_replace_interaction` replaces
+    the interaction in place when it exists, and adds it at the end otherwise.
+    """
+    # Replace twice to make sure the replaced interaction is found again.
+    for parameter in ('tmp', 'new'):
+        molecule_versions.add_or_replace_interaction(
+            'dihedrals', atoms, [parameter], meta={'version': version}
+        )
+    parameters = [
+        interaction.parameters[0]
+        for interaction in molecule_versions.interactions['dihedrals']
+    ]
+    assert parameters == expected
+
+
+@pytest.mark.parametrize('version', (0, 1))
+def test_remove_interaction(molecule_versions, version):
+    """
+    :meth:`vermouth.molecule.Molecule.remove_interaction` removes the
+    interaction with the requested version.
+    """
+    molecule_versions.remove_interaction('dihedrals', (1, 2, 3, 4), version)
+    remaining = [
+        (interaction.atoms, interaction.meta.get('version', 0))
+        for interaction in molecule_versions.interactions['dihedrals']
+    ]
+    assert len(remaining) == 5
+    assert ((1, 2, 3, 4), version) not in remaining
+    assert ((1, 2, 3, 4), 1 - version) in remaining
+    with pytest.raises(KeyError):
+        molecule_versions.remove_interaction('dihedrals', (1, 2, 3, 4), version)
+
+
+def test_remove_matching_interaction(molecule_versions):
+    """
+    :meth:`vermouth.molecule.Molecule.remove_matching_interaction` removes
+    the first interaction matching the template.
+    """
+    template = vermouth.molecule.Interaction(
+        atoms=(2, 3, 4, 5), parameters=['b'], meta={},
+    )
+    molecule_versions.remove_matching_interaction('dihedrals', template)
+    remaining = [
+        (interaction.atoms, interaction.parameters)
+        for interaction in molecule_versions.interactions['dihedrals']
+    ]
+    assert ((2, 3, 4, 5), ['a']) in remaining
+    assert ((2, 3, 4, 5), ['b']) not in remaining
+    with pytest.raises(ValueError):
+        molecule_versions.remove_matching_interaction('dihedrals', template)
+
+
+def test_interaction_index_direct_modifications(molecule_versions):
+    """
+    The interaction index follows the interactions modified without using the
+    methods of :class:`vermouth.molecule.Molecule`.
+    """
+    # Build the index
+    molecule_versions.remove_interaction('dihedrals', (0, 1, 2, 3), 1)
+    # Append directly
+    molecule_versions.interactions['dihedrals'].append(
+        vermouth.molecule.Interaction(atoms=(5, 4, 3, 2), parameters=['c'], meta={})
+    )
+    molecule_versions.remove_interaction('dihedrals', (5, 4, 3, 2))
+    # Replace the list
+    molecule_versions.interactions['dihedrals'] = [
+        vermouth.molecule.Interaction(atoms=(3, 2, 1, 0), parameters=['d'], meta={})
+    ]
+    with pytest.raises(KeyError):
+        molecule_versions.remove_interaction('dihedrals', (0, 1, 2, 3))
+    molecule_versions.remove_nodes_from([0])
+    assert molecule_versions.interactions == {}
+
+
+def test_summary():
+    """
+    The summary of a molecule is cached, and follows the modifications of
+    the atoms.
+    """
+    molecule = vermouth.molecule.Molecule()
+    molecule.add_nodes_from([
+        (0, {'resname': 'ALA', 'chain': 'A', 'position': np.zeros(3)}),
+        (1, {'resname': 'GLY', 'chain': 'A'}),
+    ])
+    summary = molecule.summary
+    assert summary.resnames == {'ALA', 'GLY'}
+    assert summary.chains == {'A'}
+    assert summary.n_atoms == 2
+    assert molecule.summary is summary
+
+    molecule.nodes[1].update(resname='SOL')
+    assert molecule.summary.resnames == {'ALA', 'SOL'}
+    del molecule.nodes[0]['chain']
+    assert molecule.summary.chains == {'A', None}
+    molecule.add_node(2, chain='B')
+    assert molecule.summary.n_atoms == 3
+    molecule.remove_node(0)
+    assert molecule.summary.resnames == {'SOL', None}
+
+    copied = pickle.loads(pickle.dumps(molecule))
+    assert copied.summary == molecule.summary
+    copied.nodes[1]['resname'] = 'ALA'
+    assert copied.summary.resnames == {'ALA', None}
+    assert molecule.summary.resnames == {'SOL', None}
+    copied = molecule.copy()
+    copied.nodes[1]['resname'] = 'ALA'
+    assert copied.summary.resnames == {'ALA', None}
+
+
+@pytest.fixture
+def chain_molecule():
+    """
+    A linear molecule of 4 atoms, with a bond between each atom.
+    """
+    molecule = vermouth.molecule.Molecule()
+    molecule.add_nodes_from((idx, {'atomname': 'A{}'.format(idx)}) for idx in range(4))
+    molecule.add_edges_from([(0, 1), (1, 2), (2, 3)])
+    for idx in range(3):
+        molecule.add_interaction('bonds', (idx, idx + 1), ['1'])
+    return molecule
+
+
+def test_lazy_subgraph(chain_molecule):
+    """
+    A lazy subgraph reads its nodes from the source molecule, and behaves like
+    the subgraph once built.
+    """
+    lazy = vermouth.molecule.LazySubgraph(chain_molecule, [2, 1])
+    assert len(lazy) == 2
+    assert list(lazy) == [2, 1]
+    assert 1 in lazy and 0 not in lazy
+    assert list(lazy.nodes) == [2, 1]
+    assert lazy.nodes[2] == chain_molecule.nodes[2]
+    assert lazy.nodes(data='atomname') == [(2, 'A2'), (1, 'A1')]
+    with pytest.raises(KeyError):
+        lazy.nodes[0]  # pylint: disable=pointless-statement
+    assert lazy._subgraph is None
+
+    expected = chain_molecule.subgraph([2, 1])
+    assert list(lazy.edges) == list(expected.edges)
+    assert lazy.interactions == expected.interactions
+    assert lazy.materialize() is lazy.materialize()
+    assert lazy.source is None
+    assert list(lazy.nodes(data=True)) == list(expected.nodes(data=True))
+
+    copied = pickle.loads(pickle.dumps(lazy))
+    assert list(copied.nodes(data=True)) == list(lazy.nodes(data=True))
+
+
+def test_lazy_subgraph_snapshot(chain_molecule):
+    """
+    The snapshot of a lazy subgraph keeps the node attributes as they were.
+    """
+    lazy = vermouth.molecule.LazySubgraph(chain_molecule, [1, 2], snapshot=True)
+    chain_molecule.nodes[1]['atomname'] = 'B1'
+    chain_molecule.nodes[1]['graph'] = lazy
+    chain_molecule.remove_node(2)
+    assert lazy.nodes[1] == {'atomname': 'A1'}
+    subgraph = lazy.materialize()
+    assert dict(subgraph.nodes(data=True)) == {1: {'atomname': 'A1'},
+                                               2: {'atomname': 'A2'}}
+    assert not subgraph.edges
+
+
+def test_lazy_subgraph_networkx(chain_molecule):
+    """
+    networkx functions that use the private attributes of graphs work on a
+    lazy subgraph.
+    """
+    lazy = vermouth.molecule.LazySubgraph(chain_molecule, [0, 1, 2])
+    assert nx.dijkstra_path_length(lazy, 0, 2) == 2
+    assert lazy.source is None
+    assert list(lazy.edges) == list(chain_molecule.subgraph([0, 1, 2]).edges)
+
+
+@pytest.mark.parametrize('snapshot', (True, False))
+def test_lazy_subgraph_no_alias(chain_molecule, snapshot):
+    """
+    Modifying a lazy subgraph does not modify its source molecule.
+    """
+    lazy = vermouth.molecule.LazySubgraph(chain_molecule, [1, 2], snapshot=snapshot)
+    node = lazy.nodes[1]
+    node['atomname'] = 'B1'
+    del lazy.nodes[2]['atomname']
+    assert node['atomname'] == 'B1'
+    assert lazy.nodes[1]['atomname'] == 'B1'
+    assert 'atomname' not in lazy.nodes[2]
+    assert chain_molecule.nodes[1]['atomname'] == 'A1'
+    assert chain_molecule.nodes[2]['atomname'] == 'A2'
+
+    lazy = vermouth.molecule.LazySubgraph(chain_molecule, [1, 2], snapshot=snapshot)
+    lazy.add_edge(1, 3)
+    lazy.remove_node(2)
+    assert list(chain_molecule.edges) == [(0, 1), (1, 2), (2, 3)]
+    assert list(lazy.edges) == [(1, 3)]
+
+
+def test_subgraph_interaction_order(chain_molecule):
+    """
+    The interactions of a subgraph keep their order, whatever atom they are
+    found from, and equal interactions are all kept.
+    """
+    chain_molecule.add_interaction('angles', (3, 2, 1), ['1'])
+    chain_molecule.add_interaction('bonds', (2, 1), ['2'])
+    chain_molecule.add_interaction('bonds', (2, 1), ['2'])
+    chain_molecule.add_interaction('angles', (0, 1, 2), ['2'])
+    subgraph = chain_molecule.subgraph([3, 2, 1])
+    expected = {
+        name: [interaction for interaction in interactions
+               if set(interaction.atoms) <= {1, 2, 3}]
+        for name, interactions in chain_molecule.interactions.items()
+    }
+    assert subgraph.interactions == expected
+    assert len(subgraph.interactions['bonds']) == 4
+    # The index is kept up to date after the interactions change.
+    chain_molecule.remove_interaction('bonds', (1, 2))
+    assert len(chain_molecule.subgraph([1, 2]).interactions['bonds']) == 2
@@ -21,6 +21,7 @@ import networkx as nx
 import pytest
 
 import vermouth
+import vermouth.forcefield
 import vermouth.processors.canonicalize_modifications as canmod
 
 # pylint: disable=redefined-outer-name
@@ -191,3 +192,196 @@ def test_identify_ptms(known_ptm_graphs, atoms, edges, expected):
     found = canmod.identify_ptms(molecule, ptms, known_ptms)
     found = [(ptm.name, match) for ptm, match in found]
     assert found == expected
+
+
+@pytest.mark.parametrize('atoms, edges, expected', [
+    (
+        # Only one PTM oxygen: COOC is ruled out by the histograms
+        {
+            0: {'atomname': 'C', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+            1: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            2: {'atomname': 'N', 'PTM_atom': False, 'element': 'N', 'resid': 1},
+            3: {'atomname': 'H', 'PTM_atom': True, 'element': 'H', 'resid': 1},
+        },
+        [(0, 1), (0, 2), (2, 3)],
+        ['NH'],
+    ),
+    (
+        # The PTM oxygens are there, but the anchors are not named C
+        {
+            0: {'atomname': 'CA', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+            1: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            2: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            3: {'atomname': 'CA', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+        },
+        [(0, 1), (1, 2), (2, 3)],
+        [],
+    ),
+    (
+        {
+            0: {'atomname': 'C', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+            1: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            2: {'atomname': 'O', 'PTM_atom': True, 'element': 'O', 'resid': 1},
+            3: {'atomname': 'C', 'PTM_atom': False, 'element': 'C', 'resid': 1},
+        },
+        [(0, 1), (1, 2), (2, 3)],
+        ['COOC'],
+    ),
+])
+def test_allowed_ptms(known_ptm_graphs, atoms, edges, expected):
+    """
+    Make sure the histogram filter does not change the allowed PTMs.
+    """
+    molecule = make_molecule(atoms, edges)
+    library = canmod._ModificationLibrary(known_ptm_graphs)
+    found = canmod.allowed_ptms(molecule, [], known_ptm_graphs, library.histograms)
+    assert [ptm.name for ptm, _ in found] == expected
+    found = canmod.allowed_ptms(molecule, [], known_ptm_graphs)
+    assert [ptm.name for ptm, _ in found] == expected
+
+
+def test_modification_library(known_ptm_graphs):
+    """
+    The library is cached per force field, and rebuilt when the modifications
+    change.
+    """
+    force_field = vermouth.forcefield.ForceField(name='dummy')
+    force_field.modifications = known_ptm_graphs[:1]
+    library = canmod._modification_library(force_field)
+    assert canmod._modification_library(force_field) is library
+    force_field.modifications.append(known_ptm_graphs[1])
+    new_library = canmod._modification_library(force_field)
+    assert new_library is not library
+    assert new_library.modifications == known_ptm_graphs
+    assert len(new_library.histograms) == 2
+
+
+def test_cover_graph_enumerates_once(known_ptm_graphs):
+    """
+    The matches of every fragment are enumerated only once, regardless of
+    the depth of the recursion.
+    """
+    atoms = {0: {'atomname': 'N', 'PTM_atom': False, 'element': 'N', 'resid': 1}}
+    edges = []
+    for idx in range(1, 4):
+        atoms[idx] = {'atomname': 'H', 'PTM_atom': True, 'element': 'H', 'resid': 1}
+        edges.append((0, idx))
+    molecule = make_molecule(atoms, edges)
+
+    class CountingMatcher(nx.isomorphism.GraphMatcher):
+        calls = 0
+
+        def subgraph_isomorphisms_iter(self):
+            CountingMatcher.calls += 1
+            return super().subgraph_isomorphisms_iter()
+
+    known_ptms = [(ptm_graph, CountingMatcher(molecule, ptm_graph,
+                                              node_match=canmod.ptm_node_matcher))
+                  for ptm_graph in known_ptm_graphs]
+    ptms = canmod.find_ptm_atoms(molecule)
+    found = canmod.identify_ptms(molecule, ptms, known_ptms)
+    assert [ptm.name for ptm, _ in found] == ['NH'] * 3
+    assert CountingMatcher.calls == len(known_ptms)
+
+
+def test_identification_cache(known_ptm_graphs):
+    """
+    Residues with the same PTMs are identified once, and get the same result
+    as without cache.
+    """
+    atoms = {}
+    edges = []
+    for resid in range(1, 4):
+        n_idx = 2 * (resid - 1)
+        atoms[n_idx] = {'atomname': 'N', 'PTM_atom': False, 'element': 'N',
+                        'resid': resid, 'resname': 'GLY', 'chain': 'A',
+                        'atomid': n_idx}
+        atoms[n_idx + 1] = {'atomname': 'HN', 'PTM_atom': True, 'element': 'H',
+                            'resid': resid, 'resname': 'GLY', 'chain': 'A',
+                            'atomid': n_idx + 1}
+        edges.append((n_idx, n_idx + 1))
+        if resid > 1:
+            edges.append((n_idx - 2, n_idx))
+    force_field = vermouth.forcefield.ForceField(name='dummy')
+    force_field.modifications = known_ptm_graphs
+
+    reference = make_molecule(atoms, edges)
+    reference._force_field = force_field
+    canmod.fix_ptm(reference)
+
+    molecule = make_molecule(atoms, edges)
+    molecule._force_field = force_field
+    processor = canmod.CanonicalizeModifications()
+    processor.run_molecule(molecule)
+
+    assert processor.cache_stats == {'hits': 2, 'misses': 1}
+
+    def strip_graph(graph):
+        return {key: {name: value for name, value in attrs.items() if name != 'graph'}
+                for key, attrs in graph.nodes.items()}
+    assert strip_graph(molecule) == strip_graph(reference)
+    assert molecule.nodes[1]['atomname'] == 'H'
+    assert molecule.nodes[5]['modifications'] == [known_ptm_graphs[1]]
+
+
+def test_identification_cache_node_keys(known_ptm_graphs):
+    """
+    The same modification hits the cache whatever the values of the node keys
+    of the residue.
+    """
+    # With 9 atoms per residue, the keys of the 4th residue (27 to 35) are
+    # not iterated in order when in a set.
+    atoms = {}
+    edges = []
+    for resid in range(1, 6):
+        start = 9 * (resid - 1)
+        common = {'resid': resid, 'resname': 'GLY', 'chain': 'A'}
+        atoms[start] = dict(common, atomname='N', PTM_atom=False, element='N')
+        atoms[start + 1] = dict(common, atomname='HN', PTM_atom=True, element='H')
+        edges.append((start, start + 1))
+        previous = start
+        for idx in range(2, 9):
+            atoms[start + idx] = dict(common, atomname='C{}'.format(idx),
+                                      PTM_atom=False, element='C')
+            edges.append((previous, start + idx))
+            previous = start + idx
+        if resid > 1:
+            edges.append((start - 1, start))
+    for key, attrs in atoms.items():
+        attrs['atomid'] = key
+    force_field = vermouth.forcefield.ForceField(name='dummy')
+    force_field.modifications = known_ptm_graphs
+
+    reference = make_molecule(atoms, edges)
+    reference._force_field = force_field
+    canmod.fix_ptm(reference)
+
+    molecule = make_molecule(atoms, edges)
+    molecule._force_field = force_field
+    processor = canmod.CanonicalizeModifications()
+    processor.run_molecule(molecule)
+
+    assert processor.cache_stats == {'hits': 4, 'misses': 1}
+    assert ([molecule.nodes[key]['atomname'] for key in molecule]
+            == [reference.nodes[key]['atomname'] for key in reference])
+    assert molecule.nodes[28]['atomname'] == 'H'
+
+
+def test_residue_graph_order():
+    """
+    The order of the residue graph follows the given node order, and not the
+    values of the keys.
+    """
+    atoms = {
+        key: {'atomname': 'A{}'.format(key), 'resid': 1}
+        for key in range(28, 37)
+    }
+    edges = [(key, key + 1) for key in range(28, 36)]
+    molecule = make_molecule(atoms, edges)
+    ordered_nodes = list(range(28, 37))
+    residue = canmod._residue_graph(molecule, ordered_nodes)
+    assert list(residue) == ordered_nodes
+    assert [list(residue[node]) for node in ordered_nodes] == [
+        [29]] + [[key - 1, key + 1] for key in range(29, 36)] + [[35]]
+    assert residue.nodes[28] == molecule.nodes[28]
+    assert residue.nodes[28] is not molecule.nodes[28]
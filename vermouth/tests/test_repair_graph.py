@@ -20,6 +20,7 @@ Test graph reparation and related operations.
 import pytest
 import vermouth
 import vermouth.forcefield
+import vermouth.processors.repair_graph as repair_graph
 import networkx as nx
 import copy
 
@@ -242,3 +243,230 @@ def test_renaming(renamed_graph):
             assert node['resname'] == 'GLU0'
         else:
             assert node['resname'] == 'GLY'
+
+
+def test_repair_graph_processes(forcefield_with_mods):
+    """
+    Repairing the graph with a process pool gives the same result as doing it
+    in a single process.
+    """
+    serial = build_system_mod(forcefield_with_mods)
+    vermouth.RepairGraph(include_graph=False).run_system(serial)
+    parallel = build_system_mod(forcefield_with_mods)
+    vermouth.RepairGraph(include_graph=False, processes=2).run_system(parallel)
+    serial_molecule = serial.molecules[0]
+    parallel_molecule = parallel.molecules[0]
+    assert list(parallel_molecule.nodes(data=True)) == list(serial_molecule.nodes(data=True))
+    assert list(parallel_molecule.edges) == list(serial_molecule.edges)
+
+
+# The repaired molecule from `build_system_mod`, as produced before the
+# residues could be matched in worker processes: the node key, resid,
+# atom name, and PTM_atom flag of every node, and the edges.
+REPAIRED_NODES = [
+    (0, 1, 'N', False),
+    (1, 1, 'CA', False),
+    (2, 1, 'C', False),
+    (3, 1, 'O', False),
+    (4, 1, 'CB', False),
+    (5, 1, 'HB1', False),
+    (6, 1, 'HB2', False),
+    (7, 1, 'CG', False),
+    (8, 1, 'HG1', False),
+    (9, 1, 'HG2', False),
+    (10, 1, 'CD', False),
+    (11, 1, 'OE2', False),
+    (12, 1, 'OE1', False),
+    (13, 1, 'HE1', True),
+    (14, 1, 'H', True),
+    (15, 1, 'HA', False),
+    (16, 1, 'HN', False),
+    (17, 2, 'N', False),
+    (18, 2, 'CA', False),
+    (19, 2, 'C', False),
+    (20, 3, 'N', False),
+    (21, 3, 'O', False),
+    (22, 4, 'N', False),
+    (23, 4, 'CA', False),
+    (24, 4, 'C', False),
+    (25, 4, 'O', False),
+    (26, 4, 'HA2', False),
+    (27, 4, 'HA1', False),
+    (28, 4, 'HN', False),
+    (29, 5, 'N', False),
+    (30, 5, 'CA', False),
+    (31, 5, 'C', False),
+    (32, 5, 'O', False),
+    (33, 5, 'HN', False),
+    (34, 5, 'HA1', False),
+    (35, 5, 'HA2', False),
+    (36, 5, 'O2', True),
+    (37, 2, 'HN', False),
+    (38, 2, 'HA2', False),
+    (39, 2, 'HA1', False),
+    (40, 2, 'O', False),
+    (41, 3, 'HN', False),
+    (42, 3, 'C', False),
+    (43, 3, 'CA', False),
+    (44, 3, 'HA2', False),
+    (45, 3, 'HA1', False),
+]
+REPAIRED_EDGES = [
+    (0, 1), (0, 14), (0, 16), (1, 2), (1, 4), (1, 15),
+    (2, 3), (2, 17), (4, 5), (4, 6), (4, 7), (7, 8),
+    (7, 9), (7, 10), (10, 11), (10, 12), (12, 13), (17, 18),
+    (17, 37), (18, 19), (18, 38), (18, 39), (19, 20), (19, 40),
+    (20, 41), (20, 43), (21, 22), (21, 42), (22, 23), (22, 28),
+    (23, 24), (23, 26), (23, 27), (24, 25), (24, 29), (29, 30),
+    (29, 33), (30, 31), (30, 34), (30, 35), (31, 32), (31, 36),
+    (42, 43), (43, 44), (43, 45),
+]
+
+
+@pytest.mark.parametrize('processes', (1, 2))
+def test_repair_graph_known_output(forcefield_with_mods, processes):
+    """
+    The repaired graph is the one known from before the residues were
+    matched through compact copies.
+    """
+    system = build_system_mod(forcefield_with_mods)
+    vermouth.RepairGraph(include_graph=False, processes=processes).run_system(system)
+    molecule = system.molecules[0]
+    nodes = [
+        (key, node['resid'], node.get('atomname'), node.get('PTM_atom', False))
+        for key, node in molecule.nodes.items()
+    ]
+    # Nodes 26 and 27 are the equivalent hydrogens on the C alpha of residue
+    # 4. Which one gets which name depends on the hash seed, as it always did.
+    ambiguous = (26, 27)
+    assert sorted(atomname for key, _, atomname, _ in nodes if key in ambiguous) \
+        == ['HA1', 'HA2']
+    assert [node for node in nodes if node[0] not in ambiguous] \
+        == [node for node in REPAIRED_NODES if node[0] not in ambiguous]
+    assert sorted(tuple(sorted(edge)) for edge in molecule.edges) == REPAIRED_EDGES
+
+
+def test_compact_residue_order():
+    """
+    The compact copy of a residue keeps the order of the nodes, and of the
+    neighbours of every node.
+    """
+    residue = nx.Graph()
+    residue.add_nodes_from((
+        (2, {'element': 'C', 'atomname': 'CA'}),
+        (0, {'element': 'N', 'atomname': 'N'}),
+        (1, {'element': 'C', 'atomname': 'C'}),
+        (3, {'element': 'O'}),
+    ))
+    residue.add_edges_from([(1, 3), (2, 1), (0, 2)])
+    compact = repair_graph._compact_residue(residue)
+    assert list(compact.nodes(data=True)) == [
+        (2, {'element': 'C', 'atomname': 'CA'}),
+        (0, {'element': 'N', 'atomname': 'N'}),
+        (1, {'element': 'C', 'atomname': 'C'}),
+        (3, {'element': 'O', 'atomname': None}),
+    ]
+    for node in residue:
+        assert list(compact[node]) == list(residue[node])
+    assert compact.edges[1, 2] is compact.edges[2, 1]
+
+
+def test_repair_graph_single_pool(monkeypatch, forcefield_with_mods):
+    """
+    A single pool of worker processes is started for the whole system.
+    """
+    pools = []
+    make_pool = repair_graph._make_pool
+
+    def counting_make_pool(compiled_references, processes):
+        pools.append(processes)
+        return make_pool(compiled_references, processes)
+    monkeypatch.setattr(repair_graph, '_make_pool', counting_make_pool)
+
+    system = build_system_mod(forcefield_with_mods)
+    system.molecules = [system.molecules[0], system.molecules[0].copy()]
+    vermouth.RepairGraph(include_graph=False, processes=2).run_system(system)
+    assert pools == [2]
+    assert len(system.molecules) == 2
+
+
+def _mcs_residue(resname, missing):
+    """
+    Build a residue from the universal reference, without hydrogens, with a
+    missing atom and a terminal oxygen, so it is neither a subgraph nor a
+    supergraph of its reference.
+    """
+    force_field = vermouth.forcefield.FORCE_FIELDS['universal']
+    reference = force_field.reference_graphs[resname]
+    vermouth.graph_utils.add_element_attr(reference)
+    residue = reference.copy()
+    residue.remove_nodes_from(
+        [missing] + [node for node in residue
+                     if residue.nodes[node]['element'] == 'H']
+    )
+    residue.add_node('OXT', atomname='OXT', element='O')
+    residue.add_edge('C', 'OXT')
+    return residue
+
+
+@pytest.mark.parametrize('resname, missing', [
+    (resname, missing)
+    for resname in ('ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY',
+                    'HIS', 'ILE', 'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER',
+                    'THR', 'TRP', 'TYR', 'VAL')
+    for missing in ('N', 'CB')
+    if not (resname == 'GLY' and missing == 'CB')
+])
+def test_match_residue_mcs(resname, missing):
+    """
+    Residues that need a maximum common subgraph to be matched against their
+    reference get one best match: every atom on the reference atom with the
+    same name, and the extra terminal oxygen left out. Which of two
+    equivalent atoms, such as NH1 and NH2 in ARG, goes where is not
+    reproducible, so the match is compared up to the symmetries of the
+    residue.
+    """
+    force_field = vermouth.forcefield.FORCE_FIELDS['universal']
+    compiled_reference = force_field.compiled_reference(resname)
+    residue = repair_graph._compact_residue(_mcs_residue(resname, missing))
+    matches, used_mcs, mcs_complete = repair_graph._match_residue(
+        resname, residue, compiled_reference
+    )
+    assert used_mcs
+    assert mcs_complete
+    assert len(matches) == 1
+    match = matches[0]
+    expected = residue.subgraph(node for node in residue if node != 'OXT')
+    assert sorted(match) == sorted(match.values()) == sorted(expected)
+    assert all(expected.nodes[key]['element'] == expected.nodes[value]['element']
+               for key, value in match.items())
+    mapped_edges = {frozenset((match[node1], match[node2]))
+                    for node1, node2 in expected.edges}
+    assert mapped_edges == {frozenset(edge) for edge in expected.edges}
+    for atomname in ('N', 'CA', 'C', 'O'):
+        assert match.get(atomname, atomname) == atomname
+
+
+def test_match_residue_mcs_exhausted(monkeypatch, caplog):
+    """
+    A maximum common subgraph search that runs out of steps is reported.
+    """
+    monkeypatch.setattr(repair_graph, 'MCS_MAX_STEPS', 10)
+    force_field = vermouth.forcefield.FORCE_FIELDS['universal']
+    residue = _mcs_residue('LYS', 'CB')
+    _, used_mcs, mcs_complete = repair_graph._match_residue(
+        'LYS', repair_graph._compact_residue(residue),
+        force_field.compiled_reference('LYS'),
+    )
+    assert used_mcs
+    assert not mcs_complete
+
+    molecule = vermouth.molecule.Molecule(force_field=force_field)
+    for node, attrs in residue.nodes.items():
+        molecule.add_node(node, resname='LYS', resid=1, chain='A', **attrs)
+    molecule.add_edges_from(residue.edges)
+    repair_graph.make_reference(molecule)
+    warnings = [record for record in caplog.records
+                if 'stopped after 10 steps' in record.getMessage()]
+    assert len(warnings) == 1
+    assert 'LYS1' in warnings[0].getMessage()
@@ -0,0 +1,128 @@
+# Copyright 2018 University of Groningen
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Test the built-in assignment of secondary structures.
+"""
+# pylint: disable=redefined-outer-name
+
+import numpy as np
+import pytest
+
+import vermouth
+from vermouth.dssp import secondary_structure
+from vermouth.dssp.secondary_structure import (
+    AnnotateSecondaryStructure,
+    assign_secondary_structure,
+)
+from vermouth.pdb.pdb import read_pdb
+from vermouth.tests.datafiles import PDB_PROTEIN
+from vermouth.tests.test_dssp import SECSTRUCT_1BTA
+
+
+@pytest.fixture
+def protein():
+    return read_pdb(str(PDB_PROTEIN))
+
+
+def test_assign_secondary_structure(protein):
+    """
+    The assignment is the same as the one of DSSP.
+    """
+    assert assign_secondary_structure(protein) == SECSTRUCT_1BTA
+
+
+def test_assign_secondary_structure_rigid_motion(protein):
+    """
+    The assignment does not depend on the orientation of the protein.
+    """
+    angle = np.radians(35)
+    rotation = np.array([
+        [np.cos(angle), -np.sin(angle), 0],
+        [np.sin(angle), np.cos(angle), 0],
+        [0, 0, 1],
+    ])
+    for node in protein.nodes.values():
+        node['position'] = rotation.dot(node['position']) + [3, -2, 10]
+    assert assign_secondary_structure(protein) == SECSTRUCT_1BTA
+
+
+def test_missing_backbone(protein):
+    """
+    A residue with an incomplete backbone is a coil, and breaks the chain.
+    """
+    missing = [key for key, node in protein.nodes.items()
+               if node['resid'] == 20 and node['atomname'] == 'CA']
+    protein.remove_nodes_from(missing)
+    secstructs = assign_secondary_structure(protein)
+    assert len(secstructs) == len(SECSTRUCT_1BTA)
+    assert secstructs[19] == 'C'
+    # The helix around the missing residue is interrupted.
+    assert secstructs[19:24] != SECSTRUCT_1BTA[19:24]
+    assert secstructs[:12] == SECSTRUCT_1BTA[:12]
+
+
+@pytest.mark.parametrize('nres', (0, 1, 4))
+def test_short_protein(protein, nres):
+    """
+    Too short proteins are coils.
+    """
+    short = protein.subgraph(
+        key for key, node in protein.nodes.items() if node['resid'] <= nres
+    )
+    assert assign_secondary_structure(short) == ['C'] * nres
+
+
+def test_hbond_energy():
+    """
+    The energy of an ideal hydrogen bond is the one of the DSSP paper.
+    """
+    molecule = vermouth.molecule.Molecule()
+    # The donor is the second residue, the acceptor is the third one. The
+    # N-H...O=C atoms are aligned, with N-O at 2.9 Å.
+    positions = {
+        (1, 'N'): [-3, 0, 0], (1, 'CA'): [-3, 1.5, 0],
+        (1, 'C'): [-2.2, -1, 0], (1, 'O'): [-3.2, -1, 0],
+        (2, 'N'): [-1, -1, 0], (2, 'CA'): [-1, 1, 1],
+        (2, 'C'): [-1, 2, 1], (2, 'O'): [-1, 3, 1],
+        (3, 'N'): [5, 0, 0], (3, 'CA'): [5, 1, 1],
+        (3, 'C'): [3.1, -1, 0], (3, 'O'): [1.9, -1, 0],
+    }
+    for idx, ((resid, name), position) in enumerate(positions.items()):
+        molecule.add_node(idx, resid=resid, resname='ALA', atomname=name,
+                          chain='A', position=np.array(position) / 10)
+    backbone = secondary_structure._Backbone(molecule)
+    assert np.allclose(backbone.positions['H'][1], [0, -1, 0])
+    energy = secondary_structure._hbond_energies(backbone, [1], [2])
+    expected = 27.888 * (1 / 2.9 + 1 / 3.1 - 1 / 1.9 - 1 / 4.1)
+    assert energy[0] == pytest.approx(expected, abs=1e-3)
+
+
+def test_processor(protein):
+    """
+    The processor annotates the protein molecules, and nothing else.
+    """
+    system = vermouth.System()
+    system.add_molecule(protein)
+    other = vermouth.molecule.Molecule()
+    other.add_node(0, resname='SOL', resid=1, atomname='OW', chain='B',
+                   position=np.zeros(3))
+    system.add_molecule(other)
+    AnnotateSecondaryStructure().run_system(system)
+    secstructs = [
+        protein.nodes[residue[0]]['secstruct']
+        for residue in protein.iter_residues()
+    ]
+    assert secstructs == SECSTRUCT_1BTA
+    assert 'secstruct' not in other.nodes[0]
@@ -18,6 +18,8 @@ Tests for the selectors in :mod:`vermouth.selectors`.
 
 import functools
 
+import networkx as nx
+import numpy as np
 import pytest
 
 import vermouth
@@ -146,3 +148,46 @@ def test_filter_minimal():
 
     # Do we keep the right atoms?
     assert list(filtered) == to_keep
+
+
+def test_filter_minimal_in_place():
+    """
+    :func:`vermouth.selectors.filter_minimal` sees positions modified in place.
+    """
+    molecule = read_pdb(str(PDB_PROTEIN))
+    keys = list(molecule.nodes)
+    selector = vermouth.selectors.selector_has_position
+    assert list(vermouth.selectors.filter_minimal(molecule, selector)) == keys
+    molecule.nodes[keys[0]]['position'][:] = np.nan
+    molecule.nodes[keys[1]]['position'][1] = np.inf
+    assert list(vermouth.selectors.filter_minimal(molecule, selector)) == keys[2:]
+    assert list(vermouth.selectors.filter_minimal(molecule, selector)) == [
+        key for key in keys if selector(molecule.nodes[key])
+    ]
+
+
+def test_is_protein_modified():
+    """
+    :func:`vermouth.selectors.is_protein` follows the changes of residue names.
+    """
+    molecule = read_pdb(str(PDB_PROTEIN))
+    assert vermouth.selectors.is_protein(molecule)
+    node = next(iter(molecule.nodes.values()))
+    node['resname'] = 'SOL'
+    assert not vermouth.selectors.is_protein(molecule)
+    node['resname'] = 'ALA'
+    assert vermouth.selectors.is_protein(molecule)
+
+
+def test_selectors_graph():
+    """
+    The selectors also work on graphs that are not molecules.
+    """
+    graph = nx.Graph()
+    graph.add_node(0, resname='ALA', position=[0, 0, 0])
+    graph.add_node(1, resname='GLY')
+    assert vermouth.selectors.is_protein(graph)
+    filtered = vermouth.selectors.filter_minimal(
+        graph, selector=vermouth.selectors.selector_has_position
+    )
+    assert list(filtered) == [0]
@@ -16,6 +16,8 @@
 Tests for the `test_utils.py` module.
 """
 
+import copy
+import pickle
 import string
 import pytest
 from hypothesis import strategies, given, example
@@ -168,3 +170,42 @@ def test_distance(vec_and_dist):
     """
     point1, point2, distance = vec_and_dist
     assert_allclose(utils.distance(point1, point2), distance)
+
+
+@pytest.mark.parametrize('modify', (
+    lambda mapping: mapping.__setitem__('c', 3),
+    lambda mapping: mapping.__delitem__('a'),
+    lambda mapping: mapping.clear(),
+    lambda mapping: mapping.pop('a'),
+    lambda mapping: mapping.popitem(),
+    lambda mapping: mapping.setdefault('c', 3),
+    lambda mapping: mapping.update(c=3),
+))
+def test_read_only_dict_modify(modify):
+    """
+    A :class:`vermouth.utils.ReadOnlyDict` cannot be modified.
+    """
+    mapping = utils.ReadOnlyDict({'a': 1, 'b': [2]})
+    with pytest.raises(TypeError):
+        modify(mapping)
+    assert mapping == {'a': 1, 'b': [2]}
+
+
+@pytest.mark.parametrize('duplicate', (
+    copy.copy,
+    copy.deepcopy,
+    lambda mapping: pickle.loads(pickle.dumps(mapping)),
+))
+def test_read_only_dict_copy(duplicate):
+    """
+    Copies of a :class:`vermouth.utils.ReadOnlyDict` are read-only as well.
+    """
+    mapping = utils.ReadOnlyDict({'a': 1, 'b': [2]})
+    duplicated = duplicate(mapping)
+    assert duplicated == mapping
+    assert isinstance(duplicated, utils.ReadOnlyDict)
+    with pytest.raises(TypeError):
+        duplicated['c'] = 3
+    plain = mapping.copy()
+    plain['c'] = 3
+    assert 'c' not in mapping
@@ -127,3 +127,27 @@ def are_all_equal(iterable):
     iterator = iter(iterable)
     first = next(iterator, None)
     return all(item == first for item in iterator)
+
+
+class ReadOnlyDict(dict):
+    """
+    Dictionary that cannot be modified after its creation.
+
+    Unlike :class:`types.MappingProxyType`, it can be pickled and deep
+    copied, and it is still a :class:`dict`. Use it for a dictionary that is
+    shared between many objects, so that modifying it for one of them does
+    not modify it silently for all the others. :meth:`dict.copy` gives a
+    regular dictionary that can be modified.
+    """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("'{}' object does not support modifications"
+                        .format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))